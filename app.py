@@ -1,11 +1,14 @@
 import streamlit as st
 import os
 import sys
+import threading
+import uuid
 
 # Add src directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from src.rag_system import ConversationalRAGSystem
+from src.context_builder import source_label
 
 # Page configuration
 st.set_page_config(
@@ -17,7 +20,49 @@ st.set_page_config(
 # Initialize RAG system
 @st.cache_resource
 def load_rag_system():
-    return ConversationalRAGSystem(embedding_provider="openai")
+    rag = ConversationalRAGSystem(embedding_provider="openai")
+    # Load the store and clients in the background while the page renders
+    threading.Thread(target=warm_up, args=(rag,), daemon=True).start()
+    return rag
+
+def warm_up(rag):
+    try:
+        rag.warm_up()
+    except Exception as e:
+        print(f"Warm-up failed: {str(e)}")
+
+@st.fragment(run_every=1.0)
+def ingest_progress(rag):
+    """Sidebar panel following background ingest jobs, refreshed every second"""
+    jobs = rag.job_status()
+    if not jobs:
+        return
+    
+    # Refresh the whole page (document count, chat) when a job completes
+    completed = {job['job_id'] for job in jobs if job['status'] == "completed"}
+    seen = st.session_state.setdefault('completed_jobs', completed)
+    if completed - seen:
+        st.session_state.completed_jobs = completed
+        st.rerun(scope="app")
+    
+    with st.sidebar:
+        for job in jobs[-3:]:
+            name = os.path.basename(job['directory']) or job['directory']
+            if job['status'] in ("queued", "running"):
+                st.write(f"⏳ {name}: {job['status']}")
+                if job['files_total']:
+                    done = job['files'] + job['failed_files']
+                    st.progress(min(1.0, done / job['files_total']), text=f"{done}/{job['files_total']} files")
+                st.caption(f"{job['chunks']} chunks stored · {job['embedded_per_second']:.1f} embeddings/s · "
+                           f"{job['chunks_per_second']:.1f} chunks/s")
+                if st.button("⏹️ Cancel", key=f"cancel_{job['job_id']}"):
+                    rag.cancel_job(job['job_id'])
+            elif job['status'] == "completed":
+                st.caption(f"✅ {name}: {job['files']} files, {job['chunks']} chunks in {job['elapsed_seconds']:.1f}s")
+            elif job['status'] == "failed":
+                st.caption(f"❌ {name}: {job['error']}")
+            else:
+                st.caption(f"⏹️ {name}: cancelled after {job['files']} files")
 
 def main():
     st.title("💬 Conversational Claude RAG Pipeline")
@@ -29,6 +74,11 @@ def main():
     if 'messages' not in st.session_state:
         st.session_state.messages = []
     
+    # Each browser tab gets its own conversation history in the shared RAG system
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
+    session_id = st.session_state.session_id
+    
     # Sidebar for system management
     st.sidebar.header("🔧 System Management")
     
@@ -41,21 +91,21 @@ def main():
     with col1:
         if st.button("📥 Ingest Documents"):
             if os.path.exists(docs_directory):
-                with st.spinner("Processing documents..."):
-                    success = rag.ingest_documents(docs_directory)
-                if success:
-                    st.sidebar.success("Documents ingested successfully!")
-                    st.rerun()
-                else:
-                    st.sidebar.error("No documents found or processing failed!")
+                # Runs in the background: survives reruns and keeps the UI responsive
+                rag.ingest_async(docs_directory)
             else:
                 st.sidebar.error("Directory not found!")
     
     with col2:
         if st.button("🗑️ Clear Database"):
-            rag.clear_database()
-            st.sidebar.success("Database cleared!")
-            st.rerun()
+            if rag.ingest_jobs.active():
+                st.sidebar.error("Cancel or wait for ingestion first!")
+            else:
+                rag.clear_database()
+                st.sidebar.success("Database cleared!")
+                st.rerun()
+    
+    ingest_progress(rag)
     
     # NEW: Conversation management
     st.sidebar.subheader("💬 Conversation")
@@ -64,16 +114,39 @@ def main():
     with col3:
         if st.button("🔄 Clear Chat"):
             st.session_state.messages = []
-            rag.clear_conversation()
+            rag.clear_conversation(session_id)
             st.rerun()
     
     with col4:
-        conversation_summary = rag.get_conversation_summary()
+        conversation_summary = rag.get_conversation_summary(session_id)
         st.write(f"📊 {conversation_summary}")
     
     # System stats
     stats = rag.get_system_stats()
     st.sidebar.metric("Total Documents", stats['total_documents'])
+    if stats.get('dedup', {}).get('duplicate_chunks'):
+        st.sidebar.caption(f"{stats['dedup']['duplicate_chunks']} near-duplicate chunks linked (embeddings saved)")
+    
+    # Where the time goes: per-stage latency, tokens and cache hit rates
+    with st.sidebar.expander("⏱️ Pipeline Metrics"):
+        metrics_summary = rag.get_metrics()
+        if metrics_summary['stages']:
+            st.table([
+                {
+                    'Stage': stage,
+                    'Calls': s['count'],
+                    'Mean (ms)': round(s['mean_ms'], 1),
+                    'p95 (ms)': round(s['p95_ms'], 1),
+                    'Errors': s['errors']
+                }
+                for stage, s in sorted(metrics_summary['stages'].items())
+            ])
+            for cache, rate in metrics_summary['cache_hit_rate'].items():
+                st.write(f"{cache.capitalize()} cache hit rate: {rate:.0%}")
+            for kind, t in metrics_summary['tokens'].items():
+                st.write(f"{kind.replace('_', ' ').capitalize()}: {t['total']} over {t['requests']} requests")
+        else:
+            st.write("No pipeline activity yet")
     
     # Main chat interface
     st.header("💬 Chat with Your Documents")
@@ -86,7 +159,7 @@ def main():
                 if message["sources"]:
                     with st.expander("📚 Sources Used"):
                         for i, source in enumerate(message["sources"], 1):
-                            st.write(f"📄 {i}. {source['source']}")
+                            st.write(f"📄 {i}. {source_label(source)}")
 
 
     # Replace the query processing section with:
@@ -96,32 +169,30 @@ def main():
         with st.chat_message("user"):
             st.write(prompt)
         
-        # Generate assistant response
+        # Generate assistant response, streaming tokens as they arrive
         with st.chat_message("assistant"):
-            with st.spinner("🔍 Searching and thinking..."):
-                if stats['total_documents'] == 0:
-                    # No documents - use general knowledge
-                    response_text = rag.llm_service.generate_simple_response(prompt)
-                    sources = []
-                    mode = "general_knowledge"
-                else:
-                    # Hybrid mode
-                    result = rag.query_hybrid(prompt, n_results=5)
-                    response_text = result['answer']
-                    sources = result['sources']
-                    mode = result['mode']
-                
-                st.write(response_text)
-                
-                # Show mode indicator
-                if mode == "document_based":
-                    st.info("📚 Answer based on your documents")
-                    if sources:
-                        with st.expander("📄 Sources Used"):
-                            for i, source in enumerate(sources, 1):
-                                st.write(f"{i}. {source['source']}")
-                else:
-                    st.info("🧠 Answer based on general knowledge (no relevant documents found)")
+            if stats['total_documents'] == 0:
+                # No documents - use general knowledge
+                response_text = st.write_stream(rag.llm_service.stream_simple_response(prompt))
+                sources = []
+                mode = "general_knowledge"
+            else:
+                # Hybrid mode
+                with st.spinner("🔍 Searching..."):
+                    result = rag.query_hybrid_stream(prompt, n_results=5, session_id=session_id)
+                response_text = st.write_stream(result['answer_stream'])
+                sources = result['sources']
+                mode = result['mode']
+            
+            # Show mode indicator
+            if mode == "document_based":
+                st.info("📚 Answer based on your documents")
+                if sources:
+                    with st.expander("📄 Sources Used"):
+                        for i, source in enumerate(sources, 1):
+                            st.write(f"{i}. {source_label(source)}")
+            else:
+                st.info("🧠 Answer based on general knowledge (no relevant documents found)")
         
         # Add assistant response to chat history
         st.session_state.messages.append({
@@ -0,0 +1,78 @@
+import os
+import random
+
+from docx import Document
+
+WORDS = (
+    "system data model query document vector index search answer context "
+    "retrieval embedding chunk token latency memory throughput cache batch "
+    "pipeline server client request response network storage process thread "
+    "policy contract invoice customer product order shipment warehouse supplier "
+    "report analysis revenue quarter forecast budget risk compliance audit"
+).split()
+
+# Sentences with abbreviations exercise the sentence splitter's lookbehinds
+TEMPLATES = [
+    "The {0} {1} was reviewed by Dr. Smith on the {2} {3}.",
+    "See the {0} {1}, e.g. the {2} section of the {3} report.",
+    "Part number {id} ships with the {0} {1} and the {2} {3}.",
+    "Why does the {0} {1} affect the {2} {3}?",
+    "Mr. Jones approved the {0} {1} vs. the {2} {3} proposal!",
+    "Each {0} {1} has a {2} {3} and a {4} {5} attached."
+]
+
+
+def make_paragraph(rng, sentences=6):
+    """A paragraph of synthetic sentences"""
+    parts = []
+    for _ in range(sentences):
+        template = rng.choice(TEMPLATES)
+        words = [rng.choice(WORDS) for _ in range(6)]
+        parts.append(template.format(*words, id=f"XK-{rng.randint(10000, 99999)}"))
+    return " ".join(parts)
+
+
+def make_document(rng, words=800):
+    """Synthetic document text of roughly `words` words"""
+    paragraphs = []
+    count = 0
+    while count < words:
+        paragraph = make_paragraph(rng, rng.randint(3, 8))
+        paragraphs.append(paragraph)
+        count += len(paragraph.split())
+    return "\n\n".join(paragraphs)
+
+
+def generate_corpus(directory, n_docs=50, words_per_doc=800, seed=0, formats=('txt', 'md', 'docx')):
+    """Write a deterministic synthetic corpus, returning the file paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    
+    for i in range(n_docs):
+        fmt = formats[i % len(formats)]
+        text = make_document(rng, words_per_doc)
+        path = os.path.join(directory, f"doc_{i:05d}.{fmt}")
+        
+        if fmt == 'docx':
+            document = Document()
+            for paragraph in text.split("\n\n"):
+                document.add_paragraph(paragraph)
+            document.save(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                if fmt == 'md':
+                    f.write(f"# Document {i}\n\n")
+                f.write(text)
+        paths.append(path)
+    
+    return paths
+
+
+def generate_queries(n_queries=50, seed=1):
+    """Deterministic synthetic questions"""
+    rng = random.Random(seed)
+    return [
+        f"What does the {rng.choice(WORDS)} {rng.choice(WORDS)} say about {rng.choice(WORDS)}?"
+        for _ in range(n_queries)
+    ]
@@ -0,0 +1,187 @@
+"""Local HTTP stand-in for the OpenAI embeddings endpoint
+
+Serves POST /v1/embeddings with deterministic vectors (benchmarks.fakes.fake_embedding)
+and can inject latency, random 429s and 5xx errors, and enforce its own
+per-minute request/token limits. Responses carry x-ratelimit-* headers
+like the real API, so EmbeddingDispatcher's pacing and retries can be
+exercised end to end with the real openai client:
+
+    with FakeOpenAIServer(error_rate=0.1, latency=0.05) as server:
+        client = openai.OpenAI(api_key="test", base_url=server.url)
+
+or standalone:
+
+    python -m benchmarks.fake_openai_server --port 8089 --rate-limit-rpm 600
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from benchmarks.fakes import fake_embedding
+
+
+class _Window:
+    """Requests and tokens used in the current one-minute window"""
+    
+    def __init__(self):
+        self.start = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+    
+    def roll(self):
+        now = time.monotonic()
+        if now - self.start >= 60:
+            self.start, self.requests, self.tokens = now, 0, 0
+        return 60 - (now - self.start)
+
+
+class FakeOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, dim=1536, latency=0.0, error_rate=0.0,
+                 server_error_rate=0.0, rate_limit_rpm=None, rate_limit_tpm=None, seed=0):
+        self.dim = dim
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self.rate_limit_tpm = rate_limit_tpm
+        self.random = random.Random(seed)
+        self.window = _Window()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'inputs': 0, 'rate_limited': 0, 'server_errors': 0}
+        
+        handler = type("Handler", (_Handler,), {'fake': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+    
+    def admit(self, tokens):
+        """(status, headers) for a request of `tokens` tokens"""
+        with self.lock:
+            self.stats['requests'] += 1
+            reset = self.window.roll()
+            headers = {}
+            limited = False
+            for kind, limit, used, cost in (('requests', self.rate_limit_rpm, self.window.requests, 1),
+                                            ('tokens', self.rate_limit_tpm, self.window.tokens, tokens)):
+                if limit is None:
+                    continue
+                headers[f'x-ratelimit-limit-{kind}'] = str(limit)
+                headers[f'x-ratelimit-remaining-{kind}'] = str(max(0, limit - used - cost))
+                headers[f'x-ratelimit-reset-{kind}'] = f"{reset:.3f}s"
+                limited = limited or used + cost > limit
+            
+            if limited or self.random.random() < self.error_rate:
+                self.stats['rate_limited'] += 1
+                headers['retry-after-ms'] = str(int(reset * 1000) if limited else self.random.randint(50, 250))
+                return 429, headers
+            if self.random.random() < self.server_error_rate:
+                self.stats['server_errors'] += 1
+                return 500, headers
+            
+            self.window.requests += 1
+            self.window.tokens += tokens
+            return 200, headers
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/embeddings'):
+            return self._send(404, {'error': {'message': f"Unknown path {self.path}"}})
+        
+        inputs = body.get('input', [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        time.sleep(self.fake.latency)
+        
+        status, headers = self.fake.admit(tokens)
+        if status == 429:
+            return self._send(status, {'error': {'message': "Rate limit reached", 'type': "requests"}}, headers)
+        if status != 200:
+            return self._send(status, {'error': {'message': "Injected server error", 'type': "server_error"}}, headers)
+        
+        with self.fake.lock:
+            self.fake.stats['inputs'] += len(inputs)
+        as_base64 = body.get('encoding_format') == 'base64'
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, self.fake.dim)
+            if as_base64:
+                vector = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+            data.append({'object': 'embedding', 'index': i, 'embedding': vector})
+        self._send(200, {
+            'object': 'list',
+            'data': data,
+            'model': body.get('model'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+        }, headers)
+    
+    def _send(self, status, payload, headers=None):
+        encoded = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction answered with 500")
+    parser.add_argument("--rate-limit-rpm", type=int)
+    parser.add_argument("--rate-limit-tpm", type=int)
+    args = parser.parse_args(argv)
+    
+    server = FakeOpenAIServer(args.host, args.port, args.dim, args.latency_ms / 1000, args.error_rate,
+                              args.server_error_rate, args.rate_limit_rpm, args.rate_limit_tpm)
+    print(f"Fake OpenAI server on {server.url} (OPENAI_BASE_URL={server.url})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Deterministic offline stand-ins for the OpenAI and Anthropic clients
+
+Only the parts of the SDK surface the services use are implemented. Each
+request sleeps for `latency` seconds (plus `per_item_latency` per input for
+embeddings) to model network round trips.
+"""
+import asyncio
+import hashlib
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+
+def fake_embedding(text, dim=1536):
+    """Unit-length vector derived from a hash of the text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _embedding_response(inputs, dim):
+    return SimpleNamespace(
+        data=[SimpleNamespace(embedding=fake_embedding(text, dim), index=i) for i, text in enumerate(inputs)],
+        usage=SimpleNamespace(prompt_tokens=sum(len(text) // 4 for text in inputs))
+    )
+
+
+class FakeEmbeddings:
+    def __init__(self, dim=1536, latency=0.0, per_item_latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.requests = 0
+        self.inputs = 0
+    
+    def create(self, model, input, **kwargs):
+        inputs = [input] if isinstance(input, str) else list(input)
+        self.requests += 1
+        self.inputs += len(inputs)
+        time.sleep(self.latency + self.per_item_latency * len(inputs))
+        return _embedding_response(inputs, self.dim)
+    
+    @property
+    def with_raw_response(self):
+        """create() wrapped like the SDK's raw-response accessor (no rate-limit headers)"""
+        def create(**kwargs):
+            response = self.create(**kwargs)
+            return SimpleNamespace(headers={}, parse=lambda: response)
+        return SimpleNamespace(create=create)
+
+
+class FakeAsyncEmbeddings(FakeEmbeddings):
+    async def create(self, model, input, **kwargs):
+        inputs = [input] if isinstance(input, str) else list(input)
+        self.requests += 1
+        self.inputs += len(inputs)
+        await asyncio.sleep(self.latency + self.per_item_latency * len(inputs))
+        return _embedding_response(inputs, self.dim)
+
+
+class FakeOpenAI:
+    """Stand-in for openai.OpenAI"""
+    
+    def __init__(self, dim=1536, latency=0.0, per_item_latency=0.0):
+        self.embeddings = FakeEmbeddings(dim, latency, per_item_latency)
+
+
+class FakeAsyncOpenAI:
+    """Stand-in for openai.AsyncOpenAI"""
+    
+    def __init__(self, dim=1536, latency=0.0, per_item_latency=0.0):
+        self.embeddings = FakeAsyncEmbeddings(dim, latency, per_item_latency)
+
+
+def _answer_text(kwargs):
+    prompt = str(kwargs['messages'][-1]['content'])
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+    return f"Synthetic answer {digest} based on the provided context."
+
+
+def _message(text):
+    return SimpleNamespace(
+        content=[SimpleNamespace(type="text", text=text)],
+        usage=SimpleNamespace(input_tokens=0, output_tokens=len(text.split()))
+    )
+
+
+class _FakeStream:
+    def __init__(self, text, latency, is_async):
+        self._words = text.split(" ")
+        self._latency = latency
+        self._is_async = is_async
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+    
+    @property
+    def text_stream(self):
+        # Latency goes to the first token, like a real time-to-first-token
+        if self._is_async:
+            async def deltas():
+                await asyncio.sleep(self._latency)
+                for i, word in enumerate(self._words):
+                    yield word if i == 0 else " " + word
+            return deltas()
+        
+        def deltas():
+            time.sleep(self._latency)
+            for i, word in enumerate(self._words):
+                yield word if i == 0 else " " + word
+        return deltas()
+    
+    def get_final_message(self):
+        message = _message(" ".join(self._words))
+        if self._is_async:
+            # The SDK's async stream returns a coroutine here
+            async def final():
+                return message
+            return final()
+        return message
+
+
+class FakeMessages:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+    
+    def create(self, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+        return _message(_answer_text(kwargs))
+    
+    def stream(self, **kwargs):
+        self.requests += 1
+        return _FakeStream(_answer_text(kwargs), self.latency, is_async=False)
+
+
+class FakeAsyncMessages(FakeMessages):
+    async def create(self, **kwargs):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return _message(_answer_text(kwargs))
+    
+    def stream(self, **kwargs):
+        self.requests += 1
+        return _FakeStream(_answer_text(kwargs), self.latency, is_async=True)
+
+
+class FakeAnthropic:
+    """Stand-in for anthropic.Anthropic"""
+    
+    def __init__(self, latency=0.0):
+        self.messages = FakeMessages(latency)
+
+
+class FakeAsyncAnthropic:
+    """Stand-in for anthropic.AsyncAnthropic"""
+    
+    def __init__(self, latency=0.0):
+        self.messages = FakeAsyncMessages(latency)
@@ -0,0 +1,384 @@
+"""Offline benchmarks for the ingestion and query hot paths
+
+Runs against a synthetic corpus with the fake clients in benchmarks/fakes.py,
+so no API keys or network are needed:
+
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run                                  # compare against benchmarks/baseline.json
+    python -m benchmarks.run --baseline other.json --tolerance 0.25
+    python -m benchmarks.run --no-compare --output results.json
+    python -m benchmarks.run --backend ann --no-compare --output ann.json   # compare vector backends
+
+Each benchmark reports throughput and p50/p95/p99 latency per operation from
+the fastest of --repeat timed passes, and the peak traced Python memory of a
+separate tracemalloc pass (tracing slows code down, so it is kept out of the
+timed passes). The exit status is 1 if any benchmark regressed by more than
+the tolerance, and 2 if there is no baseline to compare against (baselines
+are machine-specific, so record one with --save-baseline where you compare,
+or pass --no-compare).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+# The services read keys at construction; the fakes replace the clients right after
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("ANTHROPIC_API_KEY", "offline-benchmark")
+
+from benchmarks.corpus import generate_corpus, generate_queries
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.fakes import FakeOpenAI, FakeAsyncOpenAI, FakeAnthropic, FakeAsyncAnthropic, fake_embedding
+from src.document_processor import DocumentProcessor
+from src.embeddings import EmbeddingService
+from src.vector_store import VectorStore
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Metric -> True if larger is worse
+COMPARED_METRICS = {
+    'throughput': False,
+    'p50_ms': True,
+    'p95_ms': True,
+    'peak_memory_mb': True
+}
+
+
+class BenchmarkContext:
+    """Shared state for one benchmark run"""
+    
+    def __init__(self, args):
+        self.args = args
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+        self.corpus_dir = os.path.join(self.workdir, "corpus")
+        self.files = generate_corpus(self.corpus_dir, args.docs, args.words, seed=args.seed)
+        self.processor = DocumentProcessor()
+        with quiet():
+            self.chunks = self.processor.process_directory(self.corpus_dir)
+        self._stores = 0
+        self._server = None
+    
+    def embedding_service(self):
+        service = EmbeddingService(provider="openai")
+        service.client = FakeOpenAI(self.args.dim, self.args.embed_latency_ms / 1000)
+        service._async_client = FakeAsyncOpenAI(self.args.dim, self.args.embed_latency_ms / 1000)
+        return service
+    
+    def fake_server(self):
+        """Local fake OpenAI HTTP server, started on first use"""
+        if self._server is None:
+            self._server = FakeOpenAIServer(dim=self.args.dim, latency=self.args.embed_latency_ms / 1000,
+                                            error_rate=self.args.error_rate, seed=self.args.seed).start()
+        return self._server
+    
+    def new_store(self):
+        self._stores += 1
+        with quiet():
+            return VectorStore(persist_directory=os.path.join(self.workdir, f"store_{self._stores}"),
+                               backend=self.args.backend, backend_options=self.backend_options())
+    
+    def backend_options(self):
+        if not self.args.quantization:
+            return None
+        return {'quantization': self.args.quantization, 'keep_full_vectors': not self.args.codes_only}
+    
+    def chunk_batches(self, size=100):
+        return [self.chunks[i:i + size] for i in range(0, len(self.chunks), size)]
+    
+    def cleanup(self):
+        if self._server is not None:
+            self._server.stop()
+        if not self.args.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the services' progress prints"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# Each benchmark takes (context, pass_number) and returns
+# (operation, inputs, item_count, unit); the operation is timed once per input.
+
+def bench_extract_text(ctx, pass_number):
+    return ctx.processor.extract_text, ctx.files, lambda path: 1, "files"
+
+
+def bench_semantic_chunk_llm(ctx, pass_number):
+    texts = [ctx.processor.extract_text(path) for path in ctx.files]
+    return ctx.processor.semantic_chunk_llm, texts, len, "chars"
+
+
+def bench_process_directory(ctx, pass_number):
+    n_files = len(ctx.files)
+    return ctx.processor.process_directory, [ctx.corpus_dir] * 3, lambda _: n_files, "files"
+
+
+def bench_get_embeddings_batch(ctx, pass_number):
+    service = ctx.embedding_service()
+    batches = [[chunk['text'] for chunk in batch] for batch in ctx.chunk_batches()]
+    return lambda texts: service.get_embeddings_batch(texts), batches, len, "texts"
+
+
+def bench_embedding_dispatch(ctx, pass_number):
+    # The real openai client against the local fake server, which injects 429s
+    import openai
+    service = EmbeddingService(provider="openai")
+    service.client = openai.OpenAI(api_key="offline-benchmark", base_url=ctx.fake_server().url)
+    service.dispatcher.max_batch_tokens = ctx.args.dispatch_batch_tokens
+    texts = [chunk['text'] for chunk in ctx.chunks]
+    return lambda texts: service.get_embeddings_batch(texts), [texts], len, "texts"
+
+
+def bench_add_documents(ctx, pass_number):
+    store = ctx.new_store()
+    batches = [(batch, [fake_embedding(chunk['text'], ctx.args.dim) for chunk in batch])
+               for batch in ctx.chunk_batches()]
+    return lambda batch: store.add_documents(*batch), batches, lambda batch: len(batch[0]), "chunks"
+
+
+def bench_vector_query(ctx, pass_number):
+    store = ctx.new_store()
+    service = ctx.embedding_service()
+    for batch in ctx.chunk_batches():
+        store.add_documents(batch, [fake_embedding(chunk['text'], ctx.args.dim) for chunk in batch])
+    queries = generate_queries(ctx.args.queries, seed=ctx.args.seed + 1 + pass_number)
+    return lambda question: store.query(question, service, n_results=5), queries, lambda _: 1, "queries"
+
+
+def bench_vector_query_batch(ctx, pass_number):
+    store = ctx.new_store()
+    service = ctx.embedding_service()
+    for batch in ctx.chunk_batches():
+        store.add_documents(batch, [fake_embedding(chunk['text'], ctx.args.dim) for chunk in batch])
+    queries = generate_queries(ctx.args.queries, seed=ctx.args.seed + 1 + pass_number)
+    # The same queries as vector_query, embedded and searched in one call
+    return (lambda questions: store.query_batch(questions, service, n_results=5), [queries],
+            len, "queries")
+
+
+def rag_system(ctx):
+    """A ConversationalRAGSystem on fake clients with the corpus ingested"""
+    from src.rag_system import ConversationalRAGSystem
+    
+    # The system keeps its state under ./chroma_db
+    os.chdir(ctx.workdir)
+    rag = ConversationalRAGSystem(embedding_provider="openai", vector_backend=ctx.args.backend,
+                                  vector_quantization=ctx.args.quantization)
+    latency = ctx.args.embed_latency_ms / 1000
+    rag.embedding_service.client = FakeOpenAI(ctx.args.dim, latency)
+    rag.embedding_service.async_client = FakeAsyncOpenAI(ctx.args.dim, latency)
+    rag.llm_service.client = FakeAnthropic(ctx.args.llm_latency_ms / 1000)
+    rag.llm_service.async_client = FakeAsyncAnthropic(ctx.args.llm_latency_ms / 1000)
+    rag.ingest_workers = 0
+    rag.ingest_documents(ctx.corpus_dir)
+    return rag
+
+
+def checked_answer(answer):
+    """An answer, or an error if the fakes sent the query down an error path"""
+    if answer.startswith("Error"):
+        raise RuntimeError(f"Benchmark query failed: {answer}")
+    return answer
+
+
+def bench_rag_query(ctx, pass_number):
+    rag = rag_system(ctx)
+    # Fresh questions per pass so the answer cache doesn't turn the pass into lookups
+    queries = generate_queries(ctx.args.queries, seed=ctx.args.seed + 1 + pass_number)
+    return lambda question: checked_answer(rag.query(question)['answer']), queries, lambda _: 1, "queries"
+
+
+def bench_rag_aquery_stream(ctx, pass_number):
+    rag = rag_system(ctx)
+    # One loop for the whole pass: the system's async locks stay on it
+    loop = asyncio.new_event_loop()
+    
+    async def ask(question):
+        result = await rag.aquery_stream(question)
+        return checked_answer(''.join([text async for text in result['answer_stream']]))
+    
+    queries = generate_queries(ctx.args.queries, seed=ctx.args.seed + 1 + pass_number)
+    return lambda question: loop.run_until_complete(ask(question)), queries, lambda _: 1, "queries"
+
+
+BENCHMARKS = {
+    'extract_text': bench_extract_text,
+    'semantic_chunk_llm': bench_semantic_chunk_llm,
+    'process_directory': bench_process_directory,
+    'get_embeddings_batch': bench_get_embeddings_batch,
+    'embedding_dispatch': bench_embedding_dispatch,
+    'add_documents': bench_add_documents,
+    'vector_query': bench_vector_query,
+    'vector_query_batch': bench_vector_query_batch,
+    'rag_query': bench_rag_query,
+    'rag_aquery_stream': bench_rag_aquery_stream
+}
+
+
+def run_benchmark(ctx, setup, repeat=3):
+    """Time one benchmark (best of `repeat` passes), then measure its peak memory in a separate pass"""
+    cwd = os.getcwd()
+    best = None
+    try:
+        with quiet():
+            for pass_number in range(repeat):
+                operation, inputs, item_count, unit = setup(ctx, pass_number)
+                latencies = []
+                start = time.perf_counter()
+                for value in inputs:
+                    op_start = time.perf_counter()
+                    operation(value)
+                    latencies.append(time.perf_counter() - op_start)
+                total = time.perf_counter() - start
+                if best is None or total < best[0]:
+                    best = (total, latencies, inputs)
+            
+            operation, memory_inputs, _, _ = setup(ctx, repeat)
+            tracemalloc.start()
+            try:
+                for value in memory_inputs:
+                    operation(value)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+    
+    total, latencies, inputs = best
+    latencies_ms = np.array(latencies) * 1000
+    items = sum(item_count(value) for value in inputs)
+    return {
+        'ops': len(inputs),
+        'items': items,
+        'unit': unit,
+        'total_s': round(total, 4),
+        'throughput': round(items / total, 2) if total else None,
+        'mean_ms': round(float(latencies_ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'peak_memory_mb': round(peak / 2 ** 20, 3)
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """Regressions of results against a baseline, as a list of messages
+
+    Latency changes smaller than min_delta_ms are treated as timer noise.
+    """
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        for metric, larger_is_worse in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            if metric.endswith('_ms') and abs(new - old) < min_delta_ms:
+                continue
+            change = (new - old) / old
+            if (change if larger_is_worse else -change) > tolerance:
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline RAG pipeline benchmarks")
+    parser.add_argument("--docs", type=int, default=30, help="synthetic documents to generate")
+    parser.add_argument("--words", type=int, default=800, help="approximate words per document")
+    parser.add_argument("--queries", type=int, default=30, help="queries per query benchmark")
+    parser.add_argument("--dim", type=int, default=1536, help="fake embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="fake OpenAI latency per request")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="fake Claude latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of fake server requests answered 429")
+    parser.add_argument("--dispatch-batch-tokens", type=int, default=4000, help="token budget per dispatched request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=["chroma", "ann"], default="chroma", help="vector store backend")
+    parser.add_argument("--quantization", choices=["float16", "int8", "pq"], help="ann backend storage mode")
+    parser.add_argument("--codes-only", action="store_true", help="drop the float32 vectors once quantized")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes per benchmark (fastest is kept)")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--workdir", help="keep corpus and stores here instead of a temp dir")
+    parser.add_argument("--output", help="write results JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="write results as a new baseline to this file")
+    parser.add_argument("--no-compare", action="store_true", help="only report results, without a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes below this")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ctx = BenchmarkContext(args)
+    
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'baseline', 'save_baseline', 'no_compare', 'workdir',
+                                      'tolerance', 'min_delta_ms')},
+            'chunks': len(ctx.chunks)
+        },
+        'benchmarks': {}
+    }
+    
+    try:
+        for name in args.only or BENCHMARKS:
+            print(f"Running {name}...", file=sys.stderr)
+            results['benchmarks'][name] = run_benchmark(ctx, BENCHMARKS[name], args.repeat)
+    finally:
+        ctx.cleanup()
+    
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"Saved baseline to {args.save_baseline}", file=sys.stderr)
+        return 0
+    
+    if args.no_compare:
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}: record one on this machine with "
+              f"--save-baseline {args.baseline}, or pass --no-compare", file=sys.stderr)
+        return 2
+    
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('meta', {}).get('config') != results['meta']['config']:
+        print("Warning: baseline was recorded with a different configuration", file=sys.stderr)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("Regressions:", file=sys.stderr)
+        for message in regressions:
+            print(f"  {message}", file=sys.stderr)
+        return 1
+    print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Startup-time benchmark for the RAG system and the MCP server
+
+Each sample runs in a fresh Python process, so import costs are included:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --output startup.json
+
+Reported (median and max over --repeat runs, in milliseconds):
+  import_ms           importing src.rag_system
+  construct_ms        ConversationalRAGSystem()
+  warm_up_ms          warm_up(): vector store, API clients, local model
+  mcp_initialize_ms   spawning mcp_server.py until the initialize handshake completes
+  mcp_list_tools_ms   spawning mcp_server.py until list_tools answers
+  mcp_stats_ms        spawning mcp_server.py until document_stats answers
+
+The MCP server runs against its configured store (./chroma_db next to
+mcp_server.py). Dummy API keys are set when none are configured; nothing
+is sent to the APIs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from src.rag_system import ConversationalRAGSystem
+imported = time.perf_counter()
+rag = ConversationalRAGSystem(embedding_provider={provider!r})
+constructed = time.perf_counter()
+rag.warm_up()
+warmed = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'construct_ms': (constructed - imported) * 1000,
+    'warm_up_ms': (warmed - constructed) * 1000
+}}))
+"""
+
+
+def child_env(extra=None):
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    env.setdefault("ANTHROPIC_API_KEY", "offline-benchmark")
+    env.update(extra or {})
+    return env
+
+
+def time_rag_system(provider):
+    """Import, construction and warm-up times in a fresh interpreter"""
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD.format(provider=provider)],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+async def time_mcp_server(warm_up):
+    """Time from spawning mcp_server.py to each of its first responses"""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+    
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(ROOT, "mcp_server.py")],
+        env=child_env({"MCP_WARM_UP": "1" if warm_up else "0"}),
+        cwd=ROOT
+    )
+    timings = {}
+    with open(os.devnull, 'w') as devnull:
+        start = time.perf_counter()
+        async with stdio_client(params, errlog=devnull) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                timings['mcp_initialize_ms'] = (time.perf_counter() - start) * 1000
+                await session.list_tools()
+                timings['mcp_list_tools_ms'] = (time.perf_counter() - start) * 1000
+                await session.call_tool("document_stats", {})
+                timings['mcp_stats_ms'] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def summarize(samples):
+    return {
+        key: {
+            'median': round(statistics.median(sample[key] for sample in samples), 2),
+            'max': round(max(sample[key] for sample in samples), 2)
+        }
+        for key in samples[0]
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RAG system and MCP server startup benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--provider", choices=["openai", "local"], default="openai", help="embedding provider")
+    parser.add_argument("--no-warm-up", action="store_true", help="start the MCP server with MCP_WARM_UP=0")
+    parser.add_argument("--skip-mcp", action="store_true", help="only time the RAG system")
+    parser.add_argument("--output", help="write results JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {'config': vars(args)}
+    
+    print("Timing RAG system startup...", file=sys.stderr)
+    results['rag_system'] = summarize([time_rag_system(args.provider) for _ in range(args.repeat)])
+    
+    if not args.skip_mcp:
+        print("Timing MCP server startup...", file=sys.stderr)
+        results['mcp_server'] = summarize([
+            asyncio.run(time_mcp_server(not args.no_warm_up)) for _ in range(args.repeat)
+        ])
+    
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
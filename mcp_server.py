@@ -12,16 +12,84 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 print("Starting MCP server...", file=sys.stderr)
 
+from io import TextIOWrapper
+import threading
+
+import anyio
 from mcp.server import Server
 from mcp.types import Tool, TextContent
 import mcp.server.stdio
 
-from src.rag_system import ConversationalRAGSystem
+# stdout carries the protocol stream; anything else printed there (progress
+# messages from the RAG system, library banners) would corrupt it
+protocol_stdout = sys.stdout
+sys.stdout = sys.stderr
+
+# The RAG system (and chromadb, openai, anthropic, ...) is loaded on first
+# use so the server answers list_tools immediately after start
+rag_system = None
+_rag_lock = threading.Lock()
+
+def get_rag_system():
+    global rag_system
+    if rag_system is None:
+        with _rag_lock:
+            if rag_system is None:
+                print("Initializing RAG system...", file=sys.stderr)
+                from src.rag_system import ConversationalRAGSystem
+                rag_system = ConversationalRAGSystem(embedding_provider="openai")
+                print("RAG system ready", file=sys.stderr)
+    return rag_system
+
+async def aget_rag_system():
+    """get_rag_system without blocking the event loop while the system loads"""
+    if rag_system is not None:
+        return rag_system
+    return await asyncio.to_thread(get_rag_system)
+
+# Strong references to tasks started by main(), which the event loop only holds weakly
+background_tasks = set()
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
-# Initialize RAG system
-print("Initializing RAG system...", file=sys.stderr)
-rag_system = ConversationalRAGSystem(embedding_provider="openai")
-print("RAG system ready", file=sys.stderr)
+# Metadata filters accepted by the search tools (see ConversationalRAGSystem.build_where)
+FILTERS_SCHEMA = {
+    "type": "object",
+    "description": "Only search matching chunks (optional; string values may also be lists)",
+    "properties": {
+        "extension": {"type": ["string", "array"], "description": "File extension, e.g. \".pdf\""},
+        "directory": {"type": ["string", "array"], "description": "Directory, including its subdirectories"},
+        "source": {"type": ["string", "array"], "description": "File name"},
+        "file_path": {"type": ["string", "array"], "description": "Full file path"},
+        "page": {"type": ["integer", "array"], "description": "PDF page number"},
+        "modified_after": {"type": ["string", "number"], "description": "ISO date or epoch seconds"},
+        "modified_before": {"type": ["string", "number"], "description": "ISO date or epoch seconds"}
+    }
+}
+
+# Upper bound on queries per search_documents_batch call
+MAX_BATCH_QUERIES = 1000
+
+# Default chunk text budget for retrieve_documents
+DEFAULT_RETRIEVE_TOKENS = 4000
+
+async def warm_up():
+    """Load the store and clients in the background so the first search doesn't pay for it"""
+    try:
+        await asyncio.to_thread(lambda: get_rag_system().warm_up())
+    except Exception as e:
+        print(f"Warm-up failed: {str(e)}", file=sys.stderr)
+
+async def watch(directory):
+    """Keep a directory indexed while the server runs (changes are ingested as background jobs)"""
+    try:
+        await asyncio.to_thread(lambda: get_rag_system().watch(directory))
+    except Exception as e:
+        print(f"Watching {directory} failed: {str(e)}", file=sys.stderr)
 
 # Create server
 server = Server("personal-documents")
@@ -39,11 +107,102 @@ async def list_tools() -> list[Tool]:
                     "query": {
                         "type": "string",
                         "description": "Search query or question"
-                    }
+                    },
+                    "session_id": {
+                        "type": "string",
+                        "description": "Conversation to continue (optional; each id keeps its own history)"
+                    },
+                    "filters": FILTERS_SCHEMA
+                },
+                "required": ["query"]
+            }
+        ),
+        Tool(
+            name="search_documents_batch",
+            description="Retrieve the most relevant document chunks for many queries in one call (no answer generation)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "queries": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "maxItems": MAX_BATCH_QUERIES,
+                        "description": "Search queries or questions"
+                    },
+                    "n_results": {
+                        "type": "integer",
+                        "description": "Chunks to return per query (default 5)"
+                    },
+                    "filters": FILTERS_SCHEMA
+                },
+                "required": ["queries"]
+            }
+        ),
+        Tool(
+            name="retrieve_documents",
+            description="Ranked document chunks (text, score, source, offsets) for a query, without generating an answer",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Search query or question"
+                    },
+                    "n_results": {
+                        "type": "integer",
+                        "description": "Chunks to return at most (default 5)"
+                    },
+                    "max_tokens": {
+                        "type": "integer",
+                        "description": f"Budget for chunk text in tokens (default {DEFAULT_RETRIEVE_TOKENS})"
+                    },
+                    "max_chars": {
+                        "type": "integer",
+                        "description": "Budget for chunk text in characters (optional)"
+                    },
+                    "filters": FILTERS_SCHEMA
                 },
                 "required": ["query"]
             }
         ),
+        Tool(
+            name="ingest_documents",
+            description="Start indexing a directory of documents in the background (only new or changed files are processed); returns a job id",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "directory": {
+                        "type": "string",
+                        "description": "Directory to ingest (PDF, Word, Markdown and text files)"
+                    }
+                },
+                "required": ["directory"]
+            }
+        ),
+        Tool(
+            name="ingest_status",
+            description="Progress of background ingest jobs: state, files, chunks and embeddings per second",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {
+                        "type": "string",
+                        "description": "Job to report on (optional; all recent jobs if omitted)"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="cancel_ingest",
+            description="Cancel a queued or running ingest job",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {"type": "string", "description": "Job to cancel"}
+                },
+                "required": ["job_id"]
+            }
+        ),
         Tool(
             name="document_stats",
             description="Get statistics about document collection",
@@ -51,6 +210,20 @@ async def list_tools() -> list[Tool]:
                 "type": "object",
                 "properties": {}
             }
+        ),
+        Tool(
+            name="pipeline_metrics",
+            description="Latency per pipeline stage (extract, embed, retrieve, generate...), token counts and cache hit rates",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "format": {
+                        "type": "string",
+                        "enum": ["text", "json", "prometheus"],
+                        "description": "Readable summary (default), full JSON, or Prometheus text format"
+                    }
+                }
+            }
         )
     ]
 
@@ -60,14 +233,36 @@ async def call_tool(name: str, arguments: Any) -> Sequence[TextContent]:
     
     if name == "search_documents":
         query = arguments.get("query", "")
+        session_id = arguments.get("session_id") or "mcp"
+        filters = arguments.get("filters")
         print(f"Searching for: {query}", file=sys.stderr)
         
         try:
-            result = rag_system.query(query, n_results=5)
+            ctx = server.request_context
+            progress_token = ctx.meta.progressToken if ctx.meta else None
+            rag = await aget_rag_system()
+            
+            if progress_token is None:
+                result = await rag.aquery(query, n_results=5, session_id=session_id, filters=filters)
+                answer = result['answer']
+            else:
+                # Client asked for progress: forward answer text as it is generated
+                result = await rag.aquery_stream(query, n_results=5, session_id=session_id, filters=filters)
+                parts = []
+                async for text in result['answer_stream']:
+                    parts.append(text)
+                    await ctx.session.send_progress_notification(
+                        progress_token,
+                        progress=len(parts),
+                        message=text,
+                        related_request_id=ctx.request_id
+                    )
+                answer = ''.join(parts)
             
-            response = f"**Answer:** {result['answer']}\n\n"
+            response = f"**Answer:** {answer}\n\n"
             if result['sources']:
-                sources = [s['source'] for s in result['sources']]
+                from src.context_builder import source_label
+                sources = [source_label(s) for s in result['sources']]
                 response += f"**Sources:** {', '.join(sources)}"
             
             return [TextContent(type="text", text=response)]
@@ -77,21 +272,113 @@ async def call_tool(name: str, arguments: Any) -> Sequence[TextContent]:
             print(error_msg, file=sys.stderr)
             return [TextContent(type="text", text=error_msg)]
     
+    elif name == "search_documents_batch":
+        queries = arguments.get("queries") or []
+        n_results = arguments.get("n_results") or 5
+        print(f"Batch search for {len(queries)} queries", file=sys.stderr)
+        if len(queries) > MAX_BATCH_QUERIES:
+            return [TextContent(type="text", text=f"At most {MAX_BATCH_QUERIES} queries per call")]
+        
+        try:
+            batch = await asyncio.to_thread(
+                lambda: get_rag_system().query_batch(queries, n_results, arguments.get("filters"))
+            )
+            response = [
+                {
+                    'query': result['question'],
+                    'results': [
+                        {'source': metadata['source'], 'file_path': metadata['file_path'],
+                         'also_in': [d['file_path'] for d in metadata.get('duplicates', [])],
+                         'distance': distance, 'text': text}
+                        for metadata, distance, text in zip(
+                            result['sources'], result['similarity_scores'], result['retrieved_chunks']
+                        )
+                    ]
+                }
+                for result in batch
+            ]
+            return [TextContent(type="text", text=json.dumps(response, indent=2))]
+        
+        except Exception as e:
+            error_msg = f"Error searching documents: {str(e)}"
+            print(error_msg, file=sys.stderr)
+            return [TextContent(type="text", text=error_msg)]
+    
+    elif name == "retrieve_documents":
+        query = arguments.get("query", "")
+        print(f"Retrieving for: {query}", file=sys.stderr)
+        
+        try:
+            rag = await aget_rag_system()
+            result = await rag.aretrieve(
+                query,
+                n_results=arguments.get("n_results") or 5,
+                filters=arguments.get("filters"),
+                max_tokens=arguments.get("max_tokens") or DEFAULT_RETRIEVE_TOKENS,
+                max_chars=arguments.get("max_chars")
+            )
+            return [TextContent(type="text", text=json.dumps(result, indent=2))]
+        
+        except Exception as e:
+            error_msg = f"Error retrieving documents: {str(e)}"
+            print(error_msg, file=sys.stderr)
+            return [TextContent(type="text", text=error_msg)]
+    
+    elif name == "ingest_documents":
+        directory = os.path.expanduser(arguments.get("directory", ""))
+        if not os.path.isdir(directory):
+            return [TextContent(type="text", text=f"Directory not found: {directory}")]
+        rag = await aget_rag_system()
+        status = await asyncio.to_thread(lambda: rag.job_status(rag.ingest_async(directory)))
+        return [TextContent(type="text", text=json.dumps(status, indent=2))]
+    
+    elif name == "ingest_status":
+        job_id = (arguments or {}).get("job_id")
+        status = await asyncio.to_thread(lambda: get_rag_system().job_status(job_id))
+        if status is None:
+            return [TextContent(type="text", text=f"Unknown ingest job: {job_id}")]
+        return [TextContent(type="text", text=json.dumps(status, indent=2))]
+    
+    elif name == "cancel_ingest":
+        job_id = arguments.get("job_id", "")
+        if await asyncio.to_thread(lambda: get_rag_system().cancel_job(job_id)):
+            return [TextContent(type="text", text=f"Cancelling ingest job {job_id}")]
+        return [TextContent(type="text", text=f"Ingest job {job_id} is unknown or already finished")]
+    
     elif name == "document_stats":
         try:
-            stats = rag_system.get_system_stats()
+            stats = await asyncio.to_thread(lambda: get_rag_system().get_system_stats())
             response = f"Document collection contains {stats['total_documents']} chunks"
             return [TextContent(type="text", text=response)]
         except Exception as e:
             return [TextContent(type="text", text=f"Error getting stats: {str(e)}")]
     
+    elif name == "pipeline_metrics":
+        output_format = (arguments or {}).get("format") or "text"
+        if output_format not in ("text", "json", "prometheus"):
+            return [TextContent(type="text", text=f"Unknown metrics format: {output_format}")]
+        text = await asyncio.to_thread(lambda: get_rag_system().get_metrics(output_format))
+        return [TextContent(type="text", text=text)]
+    
     return [TextContent(type="text", text=f"Unknown tool: {name}")]
 
 async def main():
     print("Starting stdio server...", file=sys.stderr)
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+    stdout = anyio.wrap_file(TextIOWrapper(protocol_stdout.buffer, encoding="utf-8"))
+    async with mcp.server.stdio.stdio_server(stdout=stdout) as (read_stream, write_stream):
         print("MCP server connected and running", file=sys.stderr)
-        await server.run(read_stream, write_stream, server.create_initialization_options())
+        # Set MCP_WARM_UP=0 to load everything on the first tool call instead
+        if os.getenv("MCP_WARM_UP", "1") != "0":
+            start_background(warm_up())
+        # WATCH_DIRECTORY=/path/to/documents re-indexes files as they change
+        if os.getenv("WATCH_DIRECTORY"):
+            start_background(watch(os.path.expanduser(os.getenv("WATCH_DIRECTORY"))))
+        try:
+            await server.run(read_stream, write_stream, server.create_initialization_options())
+        finally:
+            for task in list(background_tasks):
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,753 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+
+from src.quantization import kmeans, make_quantizer, nearest_centroids, recall_at_k
+from src.vector_backends import VectorBackend, where_to_sql
+
+# Change-log entries kept for other processes to catch up from; one that
+# falls further behind reloads the whole index
+_CHANGES_KEPT = 100000
+
+
+class ANNBackend(VectorBackend):
+    """In-process vector index: memory-mapped float32 matrix + SQLite side store
+
+    Row i of `vectors.f32` holds the embedding of the record stored with
+    row = i in `records.sqlite` (id, document, JSON metadata). Deleted rows are
+    reused by later inserts. Collections smaller than `ivf_threshold` are
+    searched exactly with one vectorized matrix-vector product; larger ones
+    get an IVF index (k-means centroids over the vectors) and only the
+    `nprobe` closest inverted lists are scanned. A `where` filter is
+    evaluated in SQLite first and only the matching rows are scored.
+
+    With `quantization` set ("float16", "int8" or "pq") searches score
+    compact in-memory codes instead of the float32 matrix, then rescore the
+    best `rescore_factor * n_results` candidates with their full-precision
+    vectors, which are read from the memory-mapped file only for those rows.
+    The float32 file stays on disk next to the codes for that rescoring;
+    with `keep_full_vectors=False` it is deleted once the quantizer is
+    trained and the codes (memory-mapped in `codes.bin`) become the only
+    stored vectors, trading the rescoring step for the smaller footprint.
+
+    Every write logs its rows in a `changes` table, so other processes
+    reading the same directory (alongside one writer, such as the watch
+    daemon) catch up with refresh(): changed rows are re-read from SQLite
+    and the shared memory-mapped file. A retrained index, a clear() or the
+    switch to codes only changes the `layout` token and reloads everything.
+    """
+    
+    name = "ann"
+    
+    def __init__(self, directory, ivf_threshold=10000, nprobe=16, quantization=None,
+                 rescore_factor=4, quantization_options=None, keep_full_vectors=True):
+        self.directory = directory
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.quantization = quantization
+        # 0 returns the compressed distances without rescoring
+        self.rescore_factor = rescore_factor
+        self.quantization_options = quantization_options or {}
+        self.keep_full_vectors = keep_full_vectors
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._norms_path = os.path.join(directory, "norms.npy")
+        self._centroids_path = os.path.join(directory, "ivf_centroids.npy")
+        self._assign_path = os.path.join(directory, "ivf_assign.npy")
+        self._quantizer_path = os.path.join(directory, "quantizer.npz")
+        self._codes_path = os.path.join(directory, "codes.npy")
+        self._codes_map_path = os.path.join(directory, "codes.bin")
+        
+        self._conn = sqlite3.connect(os.path.join(directory, "records.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " row INTEGER PRIMARY KEY,"
+            " id TEXT UNIQUE NOT NULL,"
+            " document TEXT,"
+            " metadata TEXT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, row INTEGER)")
+        self._conn.commit()
+        self._load()
+    
+    def add(self, ids, embeddings, documents, metadatas):
+        # Like Chroma, add() leaves existing ids untouched
+        with self._lock:
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._row_of]
+            self.upsert(
+                [ids[i] for i in keep], [embeddings[i] for i in keep],
+                [documents[i] for i in keep], [metadatas[i] for i in keep]
+            )
+    
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_meta('dim', self.dim)
+                self._set_layout()
+                self._init_quantizer()
+                self._open_matrix(max(1024, len(ids)))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+            self._mark_dirty()
+            self._filter_rows_cache.clear()
+            
+            rows = []
+            for chunk_id in ids:
+                row = self._row_of.get(chunk_id)
+                if row is None:
+                    row = self._free_rows.pop() if self._free_rows else self._next_row()
+                    self._row_of[chunk_id] = row
+                rows.append(row)
+            self._ensure_capacity(max(rows) + 1)
+            
+            rows = np.asarray(rows)
+            if self._matrix is not None:
+                self._matrix[rows] = vectors
+            self._norms[rows] = np.einsum('ij,ij->i', vectors, vectors)
+            self._alive[rows] = True
+            for row, chunk_id in zip(rows.tolist(), ids):
+                self._row_ids[row] = chunk_id
+            if self._centroids is not None:
+                self._assign[rows] = nearest_centroids(vectors, self._centroids)
+            if self._quantizer is not None and self._quantizer.trained:
+                self._codes[rows] = self._quantizer.encode(vectors)
+            (self._codes if self._codes_only else self._matrix).flush()
+            
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(row, chunk_id, document, json.dumps(metadata))
+                 for row, chunk_id, document, metadata in zip(rows.tolist(), ids, documents, metadatas)]
+            )
+            self._log_changes(rows.tolist())
+            self._conn.commit()
+            
+            self._maybe_train()
+    
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            doomed = self.resolve_ids(ids, where)
+            rows = [self._row_of.pop(chunk_id) for chunk_id in doomed if chunk_id in self._row_of]
+            if not rows:
+                return
+            self._mark_dirty()
+            self._filter_rows_cache.clear()
+            self._alive[rows] = False
+            for row in rows:
+                self._row_ids.pop(row, None)
+            self._free_rows.extend(rows)
+            self._conn.executemany("DELETE FROM records WHERE row = ?", [(row,) for row in rows])
+            self._log_changes(rows)
+            self._conn.commit()
+    
+    def resolve_ids(self, ids=None, where=None):
+        with self._lock:
+            if not where:
+                return [chunk_id for chunk_id in ids or [] if chunk_id in self._row_of]
+            matching = [self._row_ids[row] for row in self._filter_rows(where).tolist()]
+            if ids:
+                wanted = set(ids)
+                return [chunk_id for chunk_id in matching if chunk_id in wanted]
+            return matching
+    
+    def query(self, query_embedding, n_results, where=None, ids=None):
+        return self.query_batch([query_embedding], n_results, where, ids)[0]
+    
+    def query_batch(self, query_embeddings, n_results, where=None, ids=None):
+        """Nearest records for each query embedding
+        
+        Exact float32 searches score all queries with one matrix product;
+        IVF and quantized searches run per query. Records for every hit are
+        read from SQLite in one pass.
+        """
+        if not len(query_embeddings):
+            return []
+        with self._lock:
+            allowed = self._filter_rows(where) if where else None
+            if ids:
+                id_rows = np.array(sorted({self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of}),
+                                   dtype=np.int64)
+                allowed = id_rows if allowed is None else np.intersect1d(allowed, id_rows, assume_unique=True)
+            if (allowed is not None and not len(allowed)) or not self._row_of or n_results <= 0:
+                return [{'ids': [], 'documents': [], 'metadatas': [], 'distances': []} for _ in query_embeddings]
+            
+            queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+            quantized = self._quantizer is not None and self._quantizer.trained
+            uses_ivf = self._centroids is not None and (allowed is None or len(allowed) > self.ivf_threshold)
+            if quantized or uses_ivf:
+                hits = [self._search(query, n_results, allowed=allowed) for query in queries]
+            else:
+                hits = self._exact_search_batch(queries, n_results, allowed)
+            
+            records = self._records(sorted({row for rows, _ in hits for row in rows.tolist()}))
+            results = []
+            for rows, distances in hits:
+                top_rows = rows.tolist()
+                results.append({
+                    'ids': [self._row_ids[row] for row in top_rows],
+                    'documents': [records[row][0] for row in top_rows],
+                    'metadatas': [records[row][1] for row in top_rows],
+                    'distances': [max(0.0, float(distance)) for distance in distances]
+                })
+            return results
+    
+    def get(self, ids, include_embeddings=False):
+        with self._lock:
+            found = [(chunk_id, self._row_of[chunk_id]) for chunk_id in ids if chunk_id in self._row_of]
+            records = self._records([row for _, row in found])
+            fetched = {
+                'ids': [chunk_id for chunk_id, _ in found],
+                'documents': [records[row][0] for _, row in found],
+                'metadatas': [records[row][1] for _, row in found]
+            }
+            if include_embeddings:
+                vectors = self._vectors(np.array([row for _, row in found], dtype=np.int64))
+                fetched['embeddings'] = [vector.tolist() for vector in vectors]
+            return fetched
+    
+    def page(self, offset, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, document FROM records ORDER BY row LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return {'ids': [row[0] for row in rows], 'documents': [row[1] for row in rows]}
+    
+    def count(self):
+        return len(self._row_of)
+    
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.execute("DELETE FROM changes")
+            self._set_layout()
+            self._conn.commit()
+            self._matrix = self._codes = None
+            for path in (self._vectors_path, self._norms_path, self._centroids_path,
+                         self._assign_path, self._quantizer_path, self._codes_path, self._codes_map_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._load()
+    
+    def flush(self):
+        """Persist per-row norms, the IVF index and quantized codes so a restart needn't rebuild them"""
+        with self._lock:
+            if self.dim is None or self._clean:
+                return
+            n_rows = self._n_rows
+            np.save(self._norms_path, self._norms[:n_rows])
+            if self._centroids is not None:
+                np.save(self._centroids_path, self._centroids)
+                np.save(self._assign_path, self._assign[:n_rows])
+            if self._quantizer is not None and self._quantizer.trained:
+                np.savez(self._quantizer_path, mode=self._quantizer.mode, **self._quantizer.state())
+                if self._codes_only:
+                    self._codes.flush()
+                else:
+                    np.save(self._codes_path, self._codes[:n_rows])
+            self._set_meta('clean', 1)
+            self._conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (_CHANGES_KEPT,))
+            self._conn.commit()
+            self._clean = True
+    
+    def refresh(self):
+        """Catch up with writes made by another process sharing the directory"""
+        with self._lock:
+            layout = self._conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+            if (layout and layout[0]) != self._layout:
+                self._load()
+                return
+            latest, oldest = self._conn.execute("SELECT MAX(seq), MIN(seq) FROM changes").fetchone()
+            if latest is None or latest <= self._seen_seq:
+                return
+            if oldest > self._seen_seq + 1:
+                # The log was pruned past this process's position
+                self._load()
+                return
+            self._apply_changes([row for (row,) in self._conn.execute(
+                "SELECT DISTINCT row FROM changes WHERE seq > ? AND seq <= ?", (self._seen_seq, latest)
+            )])
+            self._seen_seq = latest
+    
+    def stats(self):
+        """Index layout and per-vector memory and disk"""
+        full_bytes = 4 * self.dim if self.dim else 0
+        stats = {
+            'vectors': len(self._row_of),
+            'dimension': self.dim,
+            'ivf_lists': len(self._centroids) if self._centroids is not None else 0,
+            'quantization': self.quantization or "none",
+            'full_bytes_per_vector': full_bytes,
+            'full_vectors_on_disk': not self._codes_only,
+            'disk_bytes_per_vector': 0 if self._codes_only else full_bytes
+        }
+        if self._quantizer is not None:
+            code_bytes = self._quantizer.code_size * np.dtype(self._quantizer.code_dtype).itemsize
+            stats['code_bytes_per_vector'] = code_bytes
+            stats['quantizer_trained'] = self._quantizer.trained
+            if self._quantizer.trained:
+                # Codes are saved next to the float32 file unless they replaced it
+                stats['disk_bytes_per_vector'] += code_bytes
+        return stats
+    
+    def recall_report(self, k=10, n_queries=100, seed=0):
+        """recall@k of the configured search against exact float32 search
+
+        Queries are stored vectors with a little noise added. Reports recall
+        with and without full-precision rescoring, so the quantization mode
+        and rescore_factor can be chosen from measured numbers. Once the
+        float32 vectors are dropped there is nothing exact to measure
+        against, so only the footprint is reported.
+        """
+        with self._lock:
+            live_rows = np.flatnonzero(self._alive[:self._n_rows])
+            if not len(live_rows):
+                return {'k': k, 'queries': 0}
+            if self._codes_only:
+                report = {'k': k, 'queries': 0, 'rescore_factor': 0,
+                          'recall_at_k': None, 'recall_at_k_without_rescoring': None}
+                report.update(self.stats())
+                return report
+            
+            rng = np.random.default_rng(seed)
+            picked = np.sort(rng.choice(live_rows, min(n_queries, len(live_rows)), replace=False))
+            queries = np.asarray(self._matrix[picked])
+            queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * 0.05 * queries.std()
+            
+            exact, rescored, compressed = [], [], []
+            for query in queries:
+                exact.append(self._exact_search(query, k)[0].tolist())
+                rescored.append(self._search(query, k)[0].tolist())
+                compressed.append(self._search(query, k, rescore=False)[0].tolist())
+            
+            report = {
+                'k': k,
+                'queries': len(queries),
+                'quantization': self.quantization or "none",
+                'rescore_factor': self.rescore_factor,
+                'recall_at_k': recall_at_k(rescored, exact),
+                'recall_at_k_without_rescoring': recall_at_k(compressed, exact)
+            }
+            report.update(self.stats())
+            return report
+    
+    def _search(self, query, n_results, rescore=True, allowed=None):
+        """(rows, distances) of the nearest live vectors, best first
+        
+        `allowed` (sorted live rows) restricts the search to those rows.
+        """
+        if not self._row_of or n_results <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        n_rows = self._n_rows
+        
+        rows = None
+        # A selective filter is cheaper to scan exactly than to probe
+        if self._centroids is not None and (allowed is None or len(allowed) > self.ivf_threshold):
+            probe = np.argsort(self._centroid_distances(query))[:self.nprobe]
+            mask = np.isin(self._assign[:n_rows], probe) & self._alive[:n_rows]
+            if allowed is not None:
+                mask &= np.isin(np.arange(n_rows), allowed, assume_unique=True)
+            rows = np.flatnonzero(mask)
+            if len(rows) < n_results:
+                rows = None
+        if rows is None and allowed is not None:
+            rows = allowed
+        
+        quantized = self._quantizer is not None and self._quantizer.trained
+        if rows is None:
+            rows = np.arange(n_rows)
+            if quantized:
+                distances = self._quantizer.distances(query, self._codes[:n_rows], self._norms[:n_rows])
+            else:
+                distances = self._exact_distances(query, None)
+            distances[~self._alive[:n_rows]] = np.inf
+        elif quantized:
+            distances = self._quantizer.distances(query, self._codes[rows], self._norms[rows])
+        else:
+            distances = self._exact_distances(query, rows)
+        
+        if quantized and rescore and self.rescore_factor and self._matrix is not None:
+            # Shortlist on compressed scores, then rescore with float32
+            shortlist = _top_k(distances, n_results * self.rescore_factor)
+            rows = rows[shortlist]
+            distances = self._exact_distances(query, rows)
+        
+        best = _top_k(distances, n_results)
+        return rows[best], distances[best]
+    
+    def _exact_search(self, query, n_results):
+        distances = self._exact_distances(query, None)
+        distances[~self._alive[:self._n_rows]] = np.inf
+        best = _top_k(distances, n_results)
+        return best, distances[best]
+    
+    def _exact_search_batch(self, queries, n_results, allowed=None, block_size=256):
+        """[(rows, distances)] per query, scoring blocks of queries with one matrix product"""
+        n_rows = self._n_rows
+        if allowed is None:
+            rows, matrix, norms = np.arange(n_rows), self._matrix[:n_rows], self._norms[:n_rows]
+            dead = ~self._alive[:n_rows]
+        else:
+            rows, matrix, norms = allowed, self._matrix[allowed], self._norms[allowed]
+            dead = None
+        k = min(n_results, len(rows))
+        
+        hits = []
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            distances = norms[None, :] - 2 * (block @ matrix.T) + np.einsum('ij,ij->i', block, block)[:, None]
+            if dead is not None:
+                distances[:, dead] = np.inf
+            best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(distances, best, axis=1)
+            order = np.argsort(best_distances, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_distances = np.take_along_axis(best_distances, order, axis=1)
+            for query_best, query_distances in zip(best, best_distances):
+                finite = np.isfinite(query_distances)
+                hits.append((rows[query_best[finite]], query_distances[finite]))
+        return hits
+    
+    def _exact_distances(self, query, rows):
+        """Squared L2 via ||x||^2 - 2 x.q + ||q||^2 for the given rows (None = all)"""
+        if rows is None:
+            n_rows = self._n_rows
+            return self._norms[:n_rows] - 2 * (self._matrix[:n_rows] @ query) + float(query @ query)
+        return self._norms[rows] - 2 * (self._matrix[rows] @ query) + float(query @ query)
+    
+    def _load(self):
+        # Read first: a write landing during the load is applied again by the next refresh
+        self._seen_seq = self._conn.execute("SELECT MAX(seq) FROM changes").fetchone()[0] or 0
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        self._layout = meta.get('layout')
+        self.dim = int(meta['dim']) if 'dim' in meta else None
+        # Saved norms/assignments/codes are only trusted after a clean flush
+        self._clean = meta.get('clean') == '1'
+        # Set once the float32 file has been replaced by the codes
+        self._codes_only = 'codes_only' in meta
+        if self._codes_only and meta['codes_only'] != self.quantization:
+            raise ValueError(f"{self.directory} only stores {meta['codes_only']} codes; "
+                             f"open it with quantization={meta['codes_only']!r}")
+        
+        self._row_of = {}
+        self._row_ids = {}
+        self._filter_rows_cache = {}
+        for row, chunk_id in self._conn.execute("SELECT row, id FROM records"):
+            self._row_of[chunk_id] = row
+            self._row_ids[row] = chunk_id
+        self._n_rows = max(self._row_ids) + 1 if self._row_ids else 0
+        self._free_rows = sorted(set(range(self._n_rows)) - set(self._row_ids), reverse=True)
+        
+        self._matrix = None
+        self._alive = self._norms = self._assign = self._codes = None
+        self._centroids = None
+        self._quantizer = None
+        self._ivf_trained_size = 0
+        self._quantizer_trained_size = 0
+        if self.dim is None:
+            self._alive = np.zeros(0, dtype=bool)
+            self._norms = np.zeros(0, dtype=np.float32)
+            self._assign = np.zeros(0, dtype=np.int32)
+            self._clean = True
+            return
+        
+        self._init_quantizer()
+        if self._codes_only:
+            path, row_bytes = self._codes_map_path, self._code_bytes()
+            if os.path.exists(self._vectors_path):
+                # Left behind by a crash between saving the codes and deleting it
+                os.remove(self._vectors_path)
+        else:
+            path, row_bytes = self._vectors_path, 4 * self.dim
+        capacity = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        self._open_matrix(max(capacity, self._n_rows, 1024))
+        self._alive[list(self._row_ids)] = True
+        n_rows = self._n_rows
+        
+        # Loaded first: without the float32 matrix, norms and IVF lists are rebuilt from decoded codes
+        if self._quantizer is not None:
+            codes = None
+            if os.path.exists(self._quantizer_path):
+                state = dict(np.load(self._quantizer_path))
+                if str(state.pop('mode')) == self._quantizer.mode:
+                    self._quantizer.load_state(state)
+                    self._quantizer_trained_size = len(self._row_of)
+                    codes = self._load_rows(self._codes_path)
+            # Once the codes replace the matrix they are read straight from codes.bin
+            if not self._codes_only:
+                if codes is not None and codes.shape[1:] == self._codes.shape[1:]:
+                    self._codes[:n_rows] = codes
+                elif self._quantizer.trained:
+                    self._encode_all()
+        
+        norms = self._load_rows(self._norms_path)
+        if norms is not None:
+            self._norms[:n_rows] = norms
+        else:
+            for start, block in self._blocks():
+                self._norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+        
+        if os.path.exists(self._centroids_path):
+            self._centroids = np.load(self._centroids_path)
+            assign = self._load_rows(self._assign_path)
+            if assign is not None:
+                self._assign[:n_rows] = assign
+            else:
+                for start, block in self._blocks():
+                    self._assign[start:start + len(block)] = nearest_centroids(block, self._centroids)
+            self._ivf_trained_size = len(self._row_of)
+        
+        # Nothing of this process's to persist until it writes: a reader
+        # must not save arrays rebuilt from a view that may already be stale
+        self._clean = True
+        self._maybe_train()
+    
+    def _apply_changes(self, rows):
+        """Bring rows written by another process up to date from SQLite and the shared file"""
+        if not rows:
+            return
+        current = {}
+        for start in range(0, len(rows), 500):
+            batch = rows[start:start + 500]
+            current.update(self._conn.execute(
+                f"SELECT row, id FROM records WHERE row IN ({','.join('?' * len(batch))})", batch
+            ))
+        self._ensure_capacity(max(rows) + 1)
+        self._filter_rows_cache.clear()
+        
+        # A chunk that moved rows had both rows logged, so its old mapping goes here
+        for row in rows:
+            old_id = self._row_ids.pop(row, None)
+            if old_id is not None and self._row_of.get(old_id) == row:
+                del self._row_of[old_id]
+        for row, chunk_id in current.items():
+            self._row_of[chunk_id] = row
+            self._row_ids[row] = chunk_id
+        self._alive[rows] = [row in current for row in rows]
+        
+        live = np.array(sorted(current), dtype=np.int64)
+        if len(live):
+            vectors = self._vectors(live)
+            self._norms[live] = np.einsum('ij,ij->i', vectors, vectors)
+            if self._centroids is not None:
+                self._assign[live] = nearest_centroids(vectors, self._centroids)
+            if self._quantizer is not None and self._quantizer.trained and not self._codes_only:
+                self._codes[live] = self._quantizer.encode(vectors)
+        self._n_rows = max(self._n_rows, max(rows) + 1)
+        self._free_rows = sorted(set(range(self._n_rows)) - set(self._row_ids), reverse=True)
+    
+    def _log_changes(self, rows):
+        """Record written rows for other processes' refresh(), in the write's transaction"""
+        self._conn.executemany("INSERT INTO changes (row) VALUES (?)", [(row,) for row in rows])
+        # This process is already current; one writer per directory is assumed
+        self._seen_seq = self._conn.execute("SELECT MAX(seq) FROM changes").fetchone()[0]
+    
+    def _set_layout(self):
+        self._layout = uuid.uuid4().hex
+        self._set_meta('layout', self._layout)
+    
+    def _filter_rows(self, where):
+        """Sorted rows whose metadata matches a where filter (cached until the next write)"""
+        key = json.dumps(where, sort_keys=True)
+        rows = self._filter_rows_cache.get(key)
+        if rows is None:
+            sql, params = where_to_sql(where)
+            rows = np.array(sorted(row for (row,) in self._conn.execute(
+                f"SELECT row FROM records WHERE {sql}", params
+            )), dtype=np.int64)
+            if len(self._filter_rows_cache) >= 64:
+                self._filter_rows_cache.pop(next(iter(self._filter_rows_cache)))
+            self._filter_rows_cache[key] = rows
+        return rows
+    
+    def _load_rows(self, path):
+        """A saved per-row array, if it is current"""
+        if not self._clean or not os.path.exists(path):
+            return None
+        array = np.load(path)
+        return array if len(array) == self._n_rows else None
+    
+    def _blocks(self, size=65536):
+        for start in range(0, self._n_rows, size):
+            yield start, self._vectors(slice(start, min(start + size, self._n_rows)))
+    
+    def _vectors(self, rows):
+        """float32 vectors of the given rows, decoded from the codes once the matrix is dropped"""
+        if self._matrix is None:
+            return self._quantizer.decode(self._codes[rows])
+        return np.asarray(self._matrix[rows])
+    
+    def _code_bytes(self):
+        return self._quantizer.code_size * np.dtype(self._quantizer.code_dtype).itemsize
+    
+    def _init_quantizer(self):
+        if self.quantization and self._quantizer is None:
+            self._quantizer = make_quantizer(self.quantization, self.dim, **self.quantization_options)
+    
+    def _mark_dirty(self):
+        if self._clean:
+            self._set_meta('clean', 0)
+            self._clean = False
+    
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+    
+    def _maybe_train(self):
+        """(Re)train the IVF index and quantizer once the collection outgrows their last training"""
+        changed = False
+        live = len(self._row_of)
+        if live >= self.ivf_threshold and (self._centroids is None or live >= 4 * self._ivf_trained_size):
+            self._train_ivf()
+            changed = True
+        
+        # float16 needs no training; the others are refit as the data grows,
+        # as long as there are float32 vectors left to fit them on
+        quantizer = self._quantizer
+        if quantizer is not None and quantizer.min_training_vectors and live >= quantizer.min_training_vectors and (
+                not quantizer.trained or live >= 4 * self._quantizer_trained_size) and not self._codes_only:
+            self._train_quantizer()
+            changed = True
+        if quantizer is not None and quantizer.trained and not self.keep_full_vectors and not self._codes_only:
+            self._drop_full_vectors()
+            changed = True
+        
+        if changed:
+            # Other processes reload once everything is on disk
+            self._set_layout()
+            self._conn.commit()
+    
+    def _drop_full_vectors(self):
+        """Move the codes to a memory-mapped file and delete the float32 matrix"""
+        capacity = len(self._alive)
+        codes = self._codes
+        self._codes_only = True
+        self._codes = None
+        self._open_matrix(capacity)
+        self._codes[:] = codes
+        self._mark_dirty()
+        self.flush()
+        # Recorded only once the codes and quantizer state are on disk
+        self._set_meta('codes_only', self._quantizer.mode)
+        self._conn.commit()
+        self._matrix = None
+        os.remove(self._vectors_path)
+        if os.path.exists(self._codes_path):
+            os.remove(self._codes_path)
+    
+    def _open_matrix(self, capacity):
+        """(Re)open the memory-mapped matrix (or codes, once they replace it) with room for `capacity` rows"""
+        if self._codes_only:
+            if self._codes is not None:
+                self._codes.flush()
+                self._codes = None
+            self._codes = _memmap(self._codes_map_path, capacity, self._quantizer.code_dtype,
+                                  self._quantizer.code_size)
+        else:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
+            self._matrix = _memmap(self._vectors_path, capacity, np.float32, self.dim)
+            if self._quantizer is not None:
+                self._codes = _resized(self._codes, capacity, self._quantizer.code_dtype, self._quantizer.code_size)
+        
+        self._alive = _resized(self._alive, capacity, bool)
+        self._norms = _resized(self._norms, capacity, np.float32)
+        self._assign = _resized(self._assign, capacity, np.int32)
+    
+    def _ensure_capacity(self, n_rows):
+        if n_rows > len(self._alive):
+            self._open_matrix(max(n_rows, 2 * len(self._alive)))
+    
+    def _next_row(self):
+        row = self._n_rows
+        self._n_rows += 1
+        return row
+    
+    def _records(self, rows):
+        """row -> (document, metadata) for the given rows"""
+        records = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(rows), 500):
+            batch = rows[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for row, document, metadata in self._conn.execute(
+                f"SELECT row, document, metadata FROM records WHERE row IN ({placeholders})", batch
+            ):
+                records[row] = (document, json.loads(metadata))
+        return records
+    
+    def _training_sample(self, size, seed=0):
+        live_rows = np.flatnonzero(self._alive[:self._n_rows])
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(live_rows, min(len(live_rows), size), replace=False))
+        return self._vectors(sample_rows)
+    
+    def _train_ivf(self):
+        """k-means over (a sample of) the live vectors, then assign every row"""
+        live = len(self._row_of)
+        n_lists = min(4096, max(16, int(math.sqrt(live))))
+        print(f"Training IVF index with {n_lists} lists over {live} vectors...")
+        
+        self._centroids = kmeans(self._training_sample(n_lists * 64), n_lists)
+        for start, block in self._blocks():
+            self._assign[start:start + len(block)] = nearest_centroids(block, self._centroids)
+        self._ivf_trained_size = live
+        self._mark_dirty()
+        self.flush()
+    
+    def _train_quantizer(self):
+        live = len(self._row_of)
+        print(f"Training {self._quantizer.mode} quantizer over {live} vectors...")
+        self._quantizer.train(self._training_sample(10000))
+        self._encode_all()
+        self._quantizer_trained_size = live
+        self._mark_dirty()
+        self.flush()
+    
+    def _encode_all(self):
+        for start, block in self._blocks():
+            self._codes[start:start + len(block)] = self._quantizer.encode(block)
+    
+    def _centroid_distances(self, query):
+        diff = self._centroids - query
+        return np.einsum('ij,ij->i', diff, diff)
+
+
+def _top_k(distances, k):
+    """Indices of the k smallest finite distances, in ascending order"""
+    k = min(k, len(distances))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    best = np.argpartition(distances, k - 1)[:k]
+    best = best[np.argsort(distances[best])]
+    return best[np.isfinite(distances[best])]
+
+
+def _memmap(path, capacity, dtype, width):
+    """A read-write memory map of `capacity` rows, growing the file if needed"""
+    size = capacity * width * np.dtype(dtype).itemsize
+    if not os.path.exists(path) or os.path.getsize(path) < size:
+        with open(path, 'ab') as f:
+            f.truncate(size)
+    return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity, width))
+
+
+def _resized(array, size, dtype, width=None):
+    resized = np.zeros(size if width is None else (size, width), dtype=dtype)
+    if array is not None:
+        n = min(len(array), size)
+        resized[:n] = array[:n]
+    return resized
@@ -0,0 +1,140 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Words that point back into the conversation rather than at the documents
+_FOLLOW_UP_WORDS = frozenset((
+    'it', 'its', 'this', 'that', 'these', 'those', 'they', 'them', 'their', 'he', 'she', 'him', 'his',
+    'her', 'above', 'previous', 'earlier', 'again', 'also', 'else', 'former', 'latter', 'same', 'more'
+))
+_FOLLOW_UP_OPENERS = frozenset(('and', 'but', 'so', 'or', 'then'))
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def is_follow_up(question):
+    """Whether a question probably depends on the conversation so far
+
+    Very short questions, pronouns and back-references ("what does it
+    cost?", "tell me more") and openers like "and ..." or "what about ..."
+    count; anything else is treated as standalone.
+    """
+    words = _WORD.findall(question.lower())
+    if len(words) < 3 or words[0] in _FOLLOW_UP_OPENERS or words[1] == 'about' and words[0] in ('what', 'how'):
+        return True
+    return any(word in _FOLLOW_UP_WORDS for word in words)
+
+
+class AnswerCache:
+    """Semantic cache of generated answers
+
+    An answer is reused when a new question's embedding has cosine similarity
+    of at least `similarity_threshold` with a cached question AND retrieval
+    returned exactly the same set of chunk ids AND it was cached under the
+    same context. Callers pass the conversation history as context only for
+    follow-up questions (see is_follow_up), so standalone questions still
+    hit in a long session.
+    Entries expire after `ttl_seconds`, the cache holds at most
+    `max_entries`, and everything is dropped when the collection version
+    changes (any write to the store, from any process sharing it).
+    """
+    
+    def __init__(self, similarity_threshold=0.95, ttl_seconds=3600, max_entries=1000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        
+        # (kind, context digest, frozenset of chunk ids) -> OrderedDict{entry_id: (unit vector, answer, created)}
+        self._buckets = {}
+        # entry_id -> bucket key, oldest first, for the max_entries bound
+        self._order = OrderedDict()
+        self._next_id = 0
+        self._version = None
+        self._lock = threading.Lock()
+    
+    def lookup(self, kind, query_embedding, chunk_ids, collection_version, context=""):
+        """Cached answer for a question, or None
+
+        kind separates answers produced by different prompts/modes; context is
+        whatever else must match for the answer to apply (the conversation
+        history text, for a follow-up question).
+        """
+        with self._lock:
+            self._check_version(collection_version)
+            bucket = self._buckets.get(self._key(kind, chunk_ids, context))
+            
+            if bucket:
+                query = self._unit(query_embedding)
+                now = time.time()
+                for entry_id, (vector, answer, created) in list(bucket.items()):
+                    if now - created > self.ttl_seconds:
+                        self._remove(entry_id)
+                        continue
+                    if float(np.dot(query, vector)) >= self.similarity_threshold:
+                        self.hits += 1
+                        return answer
+            
+            self.misses += 1
+            return None
+    
+    def store(self, kind, query_embedding, chunk_ids, collection_version, answer, context=""):
+        """Cache an answer for a question, its retrieved chunk ids and its context"""
+        with self._lock:
+            self._check_version(collection_version)
+            key = self._key(kind, chunk_ids, context)
+            
+            entry_id = self._next_id
+            self._next_id += 1
+            self._buckets.setdefault(key, OrderedDict())[entry_id] = (
+                self._unit(query_embedding), answer, time.time()
+            )
+            self._order[entry_id] = key
+            
+            while len(self._order) > self.max_entries:
+                self._remove(next(iter(self._order)))
+    
+    def invalidate(self):
+        """Drop every cached answer"""
+        with self._lock:
+            self._buckets.clear()
+            self._order.clear()
+    
+    def stats(self):
+        """Hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._order)
+        }
+    
+    def _check_version(self, collection_version):
+        if collection_version != self._version:
+            self._buckets.clear()
+            self._order.clear()
+            self._version = collection_version
+    
+    @staticmethod
+    def _key(kind, chunk_ids, context):
+        return kind, hashlib.sha256(context.encode('utf-8')).digest(), frozenset(chunk_ids)
+    
+    def _remove(self, entry_id):
+        key = self._order.pop(entry_id, None)
+        if key is None:
+            return
+        bucket = self._buckets[key]
+        bucket.pop(entry_id, None)
+        if not bucket:
+            del self._buckets[key]
+    
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
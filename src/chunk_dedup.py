@@ -0,0 +1,273 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+from src.vector_backends import where_to_sql
+
+_WORD = re.compile(r'\w+')
+# Mersenne prime for the universal hash family; a * x stays below 2**63
+_PRIME = (1 << 31) - 1
+# Chunk fields kept for a linked duplicate (enough to cite it and to store it later)
+_CHUNK_FIELDS = ('source', 'file_path', 'start_char', 'end_char', 'extension', 'directory', 'mtime', 'page')
+
+
+class MinHasher:
+    """MinHash signatures over word shingles
+
+    The Jaccard similarity of two chunks' shingle sets is estimated by the
+    fraction of signature positions on which they agree.
+    """
+    
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)[:, None]
+    
+    def signature(self, text):
+        words = _WORD.findall(text.lower())
+        n = self.shingle_size
+        shingles = {' '.join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class ChunkDeduplicator:
+    """Near-duplicate chunk detection with MinHash and an LSH band index
+
+    The first copy of a chunk is kept and embedded; later chunks whose
+    estimated Jaccard similarity to a kept chunk reaches `threshold` are
+    linked to it instead. Links are the provenance list: every file a chunk
+    appears in can still be cited. Signatures are split into `bands` bands,
+    and only kept chunks sharing a band with a new chunk are compared.
+
+    When a kept chunk is removed, its first linked duplicate takes its place
+    and is returned so the caller can embed and store it.
+    State lives in SQLite; flush() commits it. Kept chunks count as unstored
+    until stored() reports their vectors were written; rollback() unregisters
+    the rest, so an interrupted ingest doesn't leave later copies linked to
+    a chunk that was never stored.
+    """
+    
+    def __init__(self, path, threshold=0.85, num_perm=128, bands=16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        self._rows = num_perm // bands
+        self._lock = threading.Lock()
+        # Kept (or promoted) chunk ids whose vectors aren't written yet
+        self._unstored = set()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # canonical_id is NULL for kept chunks; linked duplicates keep their
+        # text and fields so they can be promoted later
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " chunk_id TEXT PRIMARY KEY,"
+            " signature BLOB NOT NULL,"
+            " canonical_id TEXT,"
+            " chunk TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_canonical ON chunks(canonical_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, key BLOB NOT NULL, chunk_id TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands(band, key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_chunk ON bands(chunk_id)")
+        self._conn.commit()
+    
+    def add(self, chunks):
+        """Register chunks, returning the ones that are not near-duplicates
+
+        Duplicates (of stored chunks or of earlier chunks in the same list)
+        are linked to the chunk they repeat and should not be embedded.
+        """
+        unique = []
+        with self._lock:
+            for chunk in chunks:
+                signature = self.hasher.signature(chunk['text'])
+                # Re-ingesting a chunk id replaces its previous entry
+                was_kept = self._forget(chunk['chunk_id'])
+                canonical_id = self._find(signature)
+                if was_kept:
+                    # Its duplicates follow it to whichever chunk now holds the text
+                    self._conn.execute(
+                        "UPDATE chunks SET canonical_id = ? WHERE canonical_id = ?",
+                        (canonical_id or chunk['chunk_id'], chunk['chunk_id'])
+                    )
+                if canonical_id is None:
+                    self._insert(chunk['chunk_id'], signature)
+                    self._unstored.add(chunk['chunk_id'])
+                    unique.append(chunk)
+                else:
+                    fields = {key: chunk[key] for key in _CHUNK_FIELDS if key in chunk}
+                    self._conn.execute(
+                        "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                        (chunk['chunk_id'], signature.tobytes(), canonical_id,
+                         json.dumps({'text': chunk['text'], **fields}))
+                    )
+        return unique
+    
+    def remove(self, chunk_ids):
+        """Forget chunks; returns duplicates promoted to replace removed kept chunks
+
+        Promoted chunks come back as chunk dicts (chunk_id, text, source,
+        file_path, ...) ready to be embedded and stored.
+        """
+        with self._lock:
+            orphaned = set()
+            for chunk_id in chunk_ids:
+                if self._forget(chunk_id):
+                    orphaned.add(chunk_id)
+            
+            promoted = []
+            for canonical_id in sorted(orphaned):
+                rows = self._conn.execute(
+                    "SELECT chunk_id, signature, chunk FROM chunks WHERE canonical_id = ? ORDER BY chunk_id",
+                    (canonical_id,)
+                ).fetchall()
+                if not rows:
+                    continue
+                chunk_id, signature, chunk = rows[0]
+                self._conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+                self._insert(chunk_id, np.frombuffer(signature, dtype=np.uint32))
+                self._conn.execute(
+                    "UPDATE chunks SET canonical_id = ? WHERE canonical_id = ?", (chunk_id, canonical_id)
+                )
+                self._unstored.add(chunk_id)
+                promoted.append({'chunk_id': chunk_id, **json.loads(chunk)})
+        return promoted
+    
+    def stored(self, chunk_ids):
+        """Mark kept chunks as written to the vector store"""
+        with self._lock:
+            self._unstored.difference_update(chunk_ids)
+    
+    def rollback(self):
+        """Unregister kept chunks that were never stored (e.g. a cancelled or failed ingest)
+
+        Returns the duplicates promoted in their place, like remove().
+        """
+        with self._lock:
+            unstored = sorted(self._unstored)
+            self._unstored.clear()
+        return self.remove(unstored)
+    
+    def linked(self, chunk_ids):
+        """The subset of chunk_ids that are linked duplicates (not stored)"""
+        found = set()
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = list(chunk_ids[start:start + 500])
+                found.update(row[0] for row in self._conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE canonical_id IS NOT NULL"
+                    f" AND chunk_id IN ({','.join('?' * len(batch))})",
+                    batch
+                ))
+        return found
+    
+    def provenance(self, chunk_ids):
+        """Map of kept chunk id -> fields of the duplicates linked to it"""
+        duplicates = {}
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return duplicates
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT canonical_id, chunk FROM chunks"
+                f" WHERE canonical_id IN ({','.join('?' * len(chunk_ids))}) ORDER BY chunk_id",
+                chunk_ids
+            ).fetchall()
+        for canonical_id, chunk in rows:
+            fields = json.loads(chunk)
+            del fields['text']
+            duplicates.setdefault(canonical_id, []).append(fields)
+        return duplicates
+    
+    def canonical_ids(self, where):
+        """Kept chunk ids with a linked duplicate whose fields match a where filter
+
+        A duplicate isn't stored, so a filter on its source or directory has
+        to reach it through the chunk it is linked to.
+        """
+        sql, params = where_to_sql(where, column="chunk")
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT canonical_id FROM chunks WHERE canonical_id IS NOT NULL AND {sql}"
+                " ORDER BY canonical_id",
+                params
+            )]
+    
+    def stats(self):
+        """Kept and linked chunk counts (each linked chunk is an embedding saved)"""
+        with self._lock:
+            kept, linked = self._conn.execute(
+                "SELECT COUNT(*) - COUNT(canonical_id), COUNT(canonical_id) FROM chunks"
+            ).fetchone()
+        return {'unique_chunks': kept, 'duplicate_chunks': linked}
+    
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+    
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM bands")
+            self._conn.commit()
+            self._unstored.clear()
+    
+    def _band_keys(self, signature):
+        rows = self._rows
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+    
+    def _find(self, signature):
+        """Most similar kept chunk at or above the threshold, or None"""
+        keys = self._band_keys(signature)
+        rows = self._conn.execute(
+            "SELECT chunk_id, signature FROM chunks WHERE chunk_id IN ("
+            " SELECT chunk_id FROM bands WHERE " + " OR ".join(["(band = ? AND key = ?)"] * len(keys)) +
+            ") ORDER BY chunk_id",
+            [value for band_key in keys for value in band_key]
+        ).fetchall()
+        
+        best, best_similarity = None, self.threshold
+        for chunk_id, stored in rows:
+            similarity = float(np.mean(np.frombuffer(stored, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = chunk_id, similarity
+        return best
+    
+    def _insert(self, chunk_id, signature):
+        self._conn.execute("INSERT INTO chunks VALUES (?, ?, NULL, NULL)", (chunk_id, signature.tobytes()))
+        self._conn.executemany(
+            "INSERT INTO bands VALUES (?, ?, ?)",
+            [(band, key, chunk_id) for band, key in self._band_keys(signature)]
+        )
+    
+    def _forget(self, chunk_id):
+        """Drop one chunk's entry; True if it was a kept chunk"""
+        row = self._conn.execute("SELECT canonical_id FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        if row is None:
+            return False
+        self._conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+        if row[0] is not None:
+            return False
+        self._conn.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        self._unstored.discard(chunk_id)
+        return True
@@ -0,0 +1,192 @@
+import re
+
+from src.tokens import estimate_tokens
+
+CONVERSATIONAL_INSTRUCTIONS = """You are having a conversation with a user about their personal documents. Each message gives you the conversation so far in <conversation_history>, excerpts from their documents in <document_context> and their question in <current_question>.
+
+Instructions:
+- Answer the current question based on the document context and conversation history
+- Reference previous parts of our conversation when relevant
+- If the current question builds on previous questions, acknowledge that connection
+- When citing information, indicate which source you're drawing from
+- If the context doesn't contain enough information, say so clearly"""
+
+DOCUMENT_INSTRUCTIONS = """Answer the user's question based on the context in <context>. Please provide a comprehensive answer based on the context provided. When referencing information, indicate which source you're drawing from."""
+
+GENERAL_KNOWLEDGE_INSTRUCTIONS = """You are having a conversation with a user. Each message gives you the conversation so far in <conversation_history> and their question in <current_question>.
+
+Note: the user's personal document collection was searched but had no relevant information for these questions, so answer based on your general knowledge. If appropriate, acknowledge that this information comes from your training rather than their specific documents."""
+
+_WORD = re.compile(r'\w+')
+
+
+def source_label(metadata):
+    """A chunk's file name, plus the files its linked near-duplicates came from"""
+    others = []
+    for duplicate in metadata.get('duplicates', ()):
+        if duplicate['source'] != metadata['source'] and duplicate['source'] not in others:
+            others.append(duplicate['source'])
+    if not others:
+        return metadata['source']
+    return f"{metadata['source']}; also in {', '.join(others)}"
+
+
+def fit_to_budget(texts, max_tokens=None, max_chars=None):
+    """Longest prefix of texts (in order) that fits a token and/or character budget
+
+    The first text that doesn't fit is cut at a word boundary to fill the
+    rest of the budget. Returns (kept texts, whether anything was cut or dropped).
+    """
+    kept = []
+    used_tokens = used_chars = 0
+    for text in texts:
+        room_chars = len(text) if max_chars is None else max_chars - used_chars
+        fit = text[:max(0, room_chars)]
+        if max_tokens is not None:
+            room_tokens = max_tokens - used_tokens
+            # Shrink by the text's own characters-per-token ratio until it fits
+            while fit and estimate_tokens(fit) > room_tokens:
+                fit = fit[:min(len(fit) - 1, len(fit) * max(room_tokens, 0) // estimate_tokens(fit))]
+        if len(fit) < len(text):
+            if ' ' in fit:
+                fit = fit[:fit.rindex(' ')]
+            if fit.strip():
+                kept.append(fit)
+            return kept, True
+        kept.append(text)
+        used_chars += len(text)
+        if max_tokens is not None:
+            used_tokens += estimate_tokens(text)
+    return kept, False
+
+
+class ContextBuilder:
+    """Builds Claude requests that fit retrieved chunks and history into a token budget
+
+    Chunks are taken in retrieval order; exact duplicates and chunks whose
+    word shingles are mostly contained in an already kept chunk are dropped,
+    and chunks that would overflow max_context_tokens are skipped. Sources
+    keep their retrieval rank as their number so citations still line up
+    with the returned sources.
+
+    Instructions go in a system block and the document context opens the
+    user message, ahead of history and the question, so follow-ups over the
+    same chunks share that whole prefix. It is marked for Anthropic prompt
+    caching when it reaches min_cache_tokens (the model's minimum cacheable
+    prompt: 2048 tokens for Claude 3.5 Haiku, 1024 for Sonnet and Opus);
+    shorter prefixes can't be cached, so they aren't marked.
+    """
+    
+    def __init__(self, max_context_tokens=6000, max_history_tokens=800, history_turns=3,
+                 overlap_threshold=0.8, shingle_size=5, history_answer_chars=200, min_cache_tokens=2048):
+        self.max_context_tokens = max_context_tokens
+        self.max_history_tokens = max_history_tokens
+        self.history_turns = history_turns
+        # Fraction of a chunk's shingles found in a kept chunk for it to count as overlapping
+        self.overlap_threshold = overlap_threshold
+        self.shingle_size = shingle_size
+        self.history_answer_chars = history_answer_chars
+        self.min_cache_tokens = min_cache_tokens
+    
+    def conversational(self, query, retrieved_chunks, conversation_history):
+        """Request answering from documents and conversation history"""
+        context = f"""<document_context>
+{self.document_context(retrieved_chunks)}
+</document_context>"""
+        content = f"""<conversation_history>
+{self.history_text(conversation_history) or "This is the start of our conversation."}
+</conversation_history>
+
+<current_question>
+{query}
+</current_question>"""
+        return self._request(CONVERSATIONAL_INSTRUCTIONS, context, content)
+    
+    def documents(self, query, retrieved_chunks):
+        """Request answering from documents only"""
+        context = f"""<context>
+{self.document_context(retrieved_chunks)}
+</context>"""
+        content = f"""<question>
+{query}
+</question>"""
+        return self._request(DOCUMENT_INSTRUCTIONS, context, content)
+    
+    def general_knowledge(self, query, conversation_history):
+        """Request answering from general knowledge with conversation history"""
+        content = f"""<conversation_history>
+{self.history_text(conversation_history) or "This is the start of our conversation."}
+</conversation_history>
+
+<current_question>
+{query}
+</current_question>"""
+        return self._request(GENERAL_KNOWLEDGE_INSTRUCTIONS, None, content)
+    
+    def document_context(self, retrieved_chunks):
+        """Numbered source blocks that fit the budget"""
+        parts = []
+        kept_shingles = []
+        seen = set()
+        used = 0
+        
+        for rank, (doc, metadata) in enumerate(zip(retrieved_chunks['documents'], retrieved_chunks['metadatas']), 1):
+            words = _WORD.findall(doc.lower())
+            normalized = ' '.join(words)
+            if normalized in seen:
+                continue
+            shingles = self._shingles(words)
+            if any(self._contained(shingles, other) for other in kept_shingles):
+                continue
+            
+            part = f"Source {rank} ({source_label(metadata)}):\n{doc}"
+            tokens = estimate_tokens(part)
+            if used + tokens > self.max_context_tokens:
+                continue
+            
+            used += tokens
+            seen.add(normalized)
+            kept_shingles.append(shingles)
+            parts.append(part)
+        
+        return "\n\n".join(parts)
+    
+    def history_text(self, conversation_history):
+        """Most recent exchanges that fit max_history_tokens, oldest first"""
+        parts = []
+        used = 0
+        for exchange in reversed((conversation_history or [])[-self.history_turns:]):
+            # Truncate long responses
+            text = (f"Previous Q: {exchange['question']}\n"
+                    f"Previous A: {exchange['response'][:self.history_answer_chars]}...")
+            tokens = estimate_tokens(text)
+            if used + tokens > self.max_history_tokens:
+                break
+            used += tokens
+            parts.append(text)
+        return "\n".join(reversed(parts))
+    
+    def _request(self, instructions, context, content):
+        """System instructions, then one user message: the context block (if any) and the content"""
+        blocks = []
+        if context is not None:
+            block = {"type": "text", "text": context}
+            if estimate_tokens(instructions) + estimate_tokens(context) >= self.min_cache_tokens:
+                # Cache breakpoint: instructions + context are the reusable prefix
+                block["cache_control"] = {"type": "ephemeral"}
+            blocks.append(block)
+        blocks.append({"type": "text", "text": content})
+        return {
+            'system': [{"type": "text", "text": instructions}],
+            'messages': [{"role": "user", "content": blocks}]
+        }
+    
+    def _shingles(self, words):
+        n = self.shingle_size
+        if len(words) <= n:
+            return {tuple(words)}
+        return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+    
+    def _contained(self, shingles, other):
+        """Whether most of `shingles` also appear in `other`"""
+        return len(shingles & other) >= self.overlap_threshold * len(shingles)
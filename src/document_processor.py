@@ -1,11 +1,53 @@
 import os
-import PyPDF2
-from docx import Document
 import json
+import re
+import bisect
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from src.metrics import metrics
+
+# Common abbreviations that shouldn't trigger sentence splits
+ABBREVIATIONS = frozenset({'Dr.', 'Mr.', 'Mrs.', 'Ms.', 'Prof.', 'Inc.', 'Corp.', 'Ltd.', 'Co.', 
+                           'vs.', 'etc.', 'i.e.', 'e.g.', 'U.S.', 'U.K.', 'Ph.D.', 'M.D.'})
+
+
+def _sentence_end_pattern(abbreviations):
+    """Word-final . ! or ? that doesn't close an abbreviation, capturing the
+    first character of the next word"""
+    # Lookbehinds must be fixed-width, so use one per abbreviation length
+    by_length = {}
+    for abbreviation in abbreviations:
+        by_length.setdefault(len(abbreviation), []).append(re.escape(abbreviation))
+    not_abbreviation = ''.join(
+        f"(?<!(?<!\\S)(?:{'|'.join(sorted(escaped))}))"
+        for _, escaped in sorted(by_length.items())
+    )
+    return re.compile(r'[.!?]' + not_abbreviation + r'(?=\s+(\S))')
+
+
+_SENTENCE_END_RE = _sentence_end_pattern(ABBREVIATIONS)
+_WHITESPACE_RUN_RE = re.compile(r'\s{2,}')
+_NON_SPACE_RE = re.compile(r'\S')
 
 class DocumentProcessor:
-    def __init__(self):
+    def __init__(self, max_file_size=200 * 1024 * 1024, max_text_chars=50_000_000, file_timeout=300):
         self.supported_formats = ['.txt', '.pdf', '.docx', '.md']
+        # Guards so one bad file can't stall or exhaust memory during ingestion
+        # (None disables a limit): bytes on disk, extracted characters, seconds
+        self.max_file_size = max_file_size
+        self.max_text_chars = max_text_chars
+        self.file_timeout = file_timeout
+    
+    def options(self):
+        """Constructor arguments, for building an identical processor in a worker process"""
+        return {
+            'max_file_size': self.max_file_size,
+            'max_text_chars': self.max_text_chars,
+            'file_timeout': self.file_timeout
+        }
     
     def extract_text(self, file_path):
         """Extract text from various file formats"""
@@ -16,127 +58,273 @@ class DocumentProcessor:
                 return f.read()
         
         elif ext == '.pdf':
-            text = ""
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text += page.extract_text()
-            return text
+            return ''.join(self.extract_pdf_pages(file_path))
         
         elif ext == '.docx':
+            from docx import Document
             doc = Document(file_path)
             return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
         
         return ""
     
+    def iter_pdf_pages(self, file_path, start=0, stop=None, deadline=None):
+        """Yield the text of PDF pages [start, stop) one page at a time
+        
+        Raises TimeoutError between pages once time.monotonic() passes deadline.
+        """
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            page_count = len(reader.pages)
+            stop = page_count if stop is None else min(stop, page_count)
+            for number in range(start, stop):
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"{os.path.basename(file_path)} took longer than {self.file_timeout}s "
+                                       f"to extract (stopped at page {number + 1})")
+                yield reader.pages[number].extract_text() or ""
+    
+    def pdf_page_count(self, file_path):
+        """Number of pages in a PDF"""
+        import PyPDF2
+        with self.file_limits(file_path), open(file_path, 'rb') as f:
+            return len(PyPDF2.PdfReader(f).pages)
+    
+    def extract_pdf_pages(self, file_path, start=0, stop=None):
+        """Text of PDF pages [start, stop), within the time and size limits"""
+        pages = []
+        total = 0
+        with metrics.span('extract'), self.file_limits(file_path) as deadline:
+            for text in self.iter_pdf_pages(file_path, start, stop, deadline):
+                total += len(text)
+                self._check_text_size(file_path, total)
+                pages.append(text)
+        return pages
+    
+    def check_file_size(self, file_path):
+        """Raise ValueError if a file is larger than max_file_size"""
+        size = os.path.getsize(file_path)
+        if self.max_file_size is not None and size > self.max_file_size:
+            raise ValueError(f"{os.path.basename(file_path)} is {size / 1e6:.1f} MB, "
+                             f"over the {self.max_file_size / 1e6:.1f} MB limit")
+    
+    def _check_text_size(self, file_path, length):
+        if self.max_text_chars is not None and length > self.max_text_chars:
+            raise ValueError(f"{os.path.basename(file_path)} has more than {self.max_text_chars} "
+                             f"characters of text")
+    
+    @contextmanager
+    def file_limits(self, file_path):
+        """Check the size limit, then bound the enclosed extraction by file_timeout
+        
+        Yields the monotonic deadline (or None). On the main thread of a POSIX
+        process (such as an ingestion worker) SIGALRM also interrupts a single
+        call that runs past it; elsewhere the deadline is checked between PDF pages.
+        """
+        self.check_file_size(file_path)
+        if self.file_timeout is None:
+            yield None
+            return
+        
+        deadline = time.monotonic() + self.file_timeout
+        use_alarm = hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread()
+        if not use_alarm:
+            yield deadline
+            return
+        
+        def on_alarm(signum, frame):
+            raise TimeoutError(f"{os.path.basename(file_path)} took longer than {self.file_timeout}s to extract")
+        
+        previous = signal.signal(signal.SIGALRM, on_alarm)
+        # A little later than the deadline so the page check usually fires first
+        signal.setitimer(signal.ITIMER_REAL, self.file_timeout + 1)
+        try:
+            yield deadline
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    
     def semantic_chunk_llm(self, text, max_chunk_size=800, min_chunk_size=100):
         """Split text at sentence boundaries while preserving semantic coherence"""
-        if not text.strip():
-            return []
-        
-        # Split into sentences (handling common abbreviations)
-        sentences = self._split_into_sentences(text)
+        return [chunk['text'] for chunk in
+                self.semantic_chunk_with_offsets(text, max_chunk_size, min_chunk_size)]
+    
+    def semantic_chunk_with_offsets(self, text, max_chunk_size=800, min_chunk_size=100):
+        """Semantic chunking that also reports where each chunk lives in `text`
         
-        if not sentences:
+        Returns dicts with 'text', 'start_char' and 'end_char'. Sentences are
+        only tracked as offsets; each chunk's text is sliced out of the original
+        string once, with whitespace runs collapsed to single spaces.
+        """
+        if not text.strip():
             return []
         
+        # Each chunk is a list of (start, end) segments; a too-small final
+        # chunk is merged into the previous one as an extra segment
         chunks = []
-        current_chunk = []
-        current_length = 0
+        current_start = current_end = None
+        current_length = 0  # size accounting used for the max_chunk_size check
+        text_length = 0     # length of the chunk text once whitespace is collapsed
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            sentence_length = len(sentence)
-            
+        for start, end, sentence_length in self._sentence_spans(text):
             # If adding this sentence would exceed max_chunk_size
-            if current_length + sentence_length > max_chunk_size and current_chunk:
+            if current_length + sentence_length > max_chunk_size and current_start is not None:
                 # Save current chunk if it meets minimum size
-                chunk_text = ' '.join(current_chunk).strip()
-                if len(chunk_text) >= min_chunk_size:
-                    chunks.append(chunk_text)
+                if text_length >= min_chunk_size:
+                    chunks.append([(current_start, current_end)])
                 
                 # Start new chunk with current sentence
-                current_chunk = [sentence]
+                current_start, current_end = start, end
                 current_length = sentence_length
+                text_length = sentence_length
             else:
                 # Add sentence to current chunk
-                current_chunk.append(sentence)
+                if current_start is None:
+                    current_start = start
+                    text_length = sentence_length
+                else:
+                    text_length += 1 + sentence_length
+                current_end = end
                 current_length += sentence_length + 1  # +1 for space
         
         # Add final chunk if it exists and meets minimum size
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk).strip()
-            if len(chunk_text) >= min_chunk_size:
-                chunks.append(chunk_text)
+        if current_start is not None:
+            if text_length >= min_chunk_size:
+                chunks.append([(current_start, current_end)])
             elif chunks:
                 # If final chunk is too small, merge with previous chunk
-                chunks[-1] += ' ' + chunk_text
+                chunks[-1].append((current_start, current_end))
         
-        return chunks
+        return [{
+            'text': ' '.join(' '.join(text[start:end].split()) for start, end in segments),
+            'start_char': segments[0][0],
+            'end_char': segments[-1][1]
+        } for segments in chunks]
     
-    def _split_into_sentences(self, text):
-        """Split text into sentences, handling common abbreviations"""
-        # Common abbreviations that shouldn't trigger sentence splits
-        abbreviations = {'Dr.', 'Mr.', 'Mrs.', 'Ms.', 'Prof.', 'Inc.', 'Corp.', 'Ltd.', 'Co.', 
-                        'vs.', 'etc.', 'i.e.', 'e.g.', 'U.S.', 'U.K.', 'Ph.D.', 'M.D.'}
+    def _sentence_spans(self, text):
+        """Single pass over text yielding (start, end, length) for each sentence
         
-        # Simple sentence splitting (can be improved with more sophisticated NLP)
-        sentences = []
-        current_sentence = ""
+        start/end are offsets into text; length is the sentence length with
+        whitespace runs collapsed to single spaces. A sentence ends at a word
+        ending in . ! or ? that isn't a known abbreviation and is followed by a
+        word starting with a capital letter (or the end of the text).
+        """
+        first_word = _NON_SPACE_RE.search(text)
+        if first_word is None:
+            return
         
-        words = text.split()
+        # Whitespace runs longer than one character, for computing collapsed lengths
+        run_starts = []
+        run_excess = [0]
+        for match in _WHITESPACE_RUN_RE.finditer(text):
+            run_starts.append(match.start())
+            run_excess.append(run_excess[-1] + match.end() - match.start() - 1)
         
-        for i, word in enumerate(words):
-            current_sentence += word + " "
+        def collapsed_length(start, end):
+            first = bisect.bisect_left(run_starts, start)
+            last = bisect.bisect_left(run_starts, end)
+            return end - start - (run_excess[last] - run_excess[first])
+        
+        sentence_start = first_word.start()
+        for match in _SENTENCE_END_RE.finditer(text):
+            # Look ahead: next word must start with a capital (likely new sentence)
+            if not match.group(1).isupper():
+                continue
             
-            # Check if word ends with sentence-ending punctuation
-            if word.endswith(('.', '!', '?')):
-                # Check if it's not an abbreviation
-                if word not in abbreviations:
-                    # Look ahead to see if next word starts with capital (likely new sentence)
-                    if i + 1 < len(words) and (words[i + 1][0].isupper() if words[i + 1] else False):
-                        sentences.append(current_sentence.strip())
-                        current_sentence = ""
-                    # If it's end of text, add the sentence
-                    elif i + 1 >= len(words):
-                        sentences.append(current_sentence.strip())
-                        current_sentence = ""
+            sentence_end = match.end()
+            yield sentence_start, sentence_end, collapsed_length(sentence_start, sentence_end)
+            sentence_start = match.start(1)
         
         # Add any remaining text as final sentence
-        if current_sentence.strip():
-            sentences.append(current_sentence.strip())
-        
-        return sentences
+        text_end = len(text.rstrip())
+        yield sentence_start, text_end, collapsed_length(sentence_start, text_end)
+    
+    def _split_into_sentences(self, text):
+        """Split text into sentences, handling common abbreviations"""
+        return [' '.join(text[start:end].split())
+                for start, end, _ in self._sentence_spans(text)]
     
     def chunk_text(self, text, chunk_size=500, overlap=50):
         """Legacy method maintained for backwards compatibility"""
         return self.semantic_chunk_llm(text, max_chunk_size=800)
     
+    def iter_files(self, directory_path):
+        """Yield the path of every supported document in a directory"""
+        for root, dirs, files in os.walk(directory_path):
+            for file in files:
+                if self.is_supported(file):
+                    yield os.path.join(root, file)
+    
+    def is_supported(self, file_path):
+        """Whether a file's extension is one we can ingest"""
+        return any(file_path.endswith(ext) for ext in self.supported_formats)
+    
+    def process_file(self, file_path, chunk_prefix=None):
+        """Extract and chunk a single document
+        
+        Chunk ids are "<chunk_prefix>_<i>"; the prefix defaults to the file name
+        but callers should pass something unique (e.g. the path relative to the
+        ingested directory) so same-named files in different folders don't collide.
+        Raises ValueError for files over the size limits and TimeoutError when
+        extraction takes longer than file_timeout.
+        """
+        if os.path.splitext(file_path)[1].lower() == '.pdf':
+            return self.chunk_pages(file_path, self.extract_pdf_pages(file_path), chunk_prefix)
+        
+        with metrics.span('extract'), self.file_limits(file_path):
+            text = self.extract_text(file_path)
+        self._check_text_size(file_path, len(text))
+        return self.chunk_document(file_path, text, chunk_prefix)
+    
+    def chunk_pages(self, file_path, pages, chunk_prefix=None):
+        """chunk_document for a PDF's page texts, recording each chunk's 1-based page"""
+        # Offset at which each page's text starts, to map chunks back to pages
+        page_starts = [0]
+        for page in pages[:-1]:
+            page_starts.append(page_starts[-1] + len(page))
+        text = ''.join(pages)
+        self._check_text_size(file_path, len(text))
+        return self.chunk_document(file_path, text, chunk_prefix, page_starts)
+    
+    def chunk_document(self, file_path, text, chunk_prefix=None, page_starts=None):
+        """Chunk extracted text and attach each chunk's metadata"""
+        file = os.path.basename(file_path)
+        if chunk_prefix is None:
+            chunk_prefix = file
+        extension = os.path.splitext(file)[1].lower()
+        if not text.strip():  # Only process non-empty files
+            return []
+        
+        # Use semantic chunking
+        with metrics.span('chunk'):
+            chunks = self.semantic_chunk_with_offsets(text)
+        
+        # Add metadata to each chunk (file attributes make chunks filterable at query time)
+        directory = os.path.dirname(os.path.abspath(file_path))
+        mtime = os.path.getmtime(file_path)
+        processed = []
+        for i, chunk in enumerate(chunks):
+            processed_chunk = {
+                'text': chunk['text'],
+                'source': file,
+                'chunk_id': f"{chunk_prefix}_{i}",
+                'file_path': file_path,
+                'start_char': chunk['start_char'],
+                'end_char': chunk['end_char'],
+                'extension': extension,
+                'directory': directory,
+                'mtime': mtime
+            }
+            if page_starts is not None:
+                processed_chunk['page'] = bisect.bisect_right(page_starts, chunk['start_char'])
+            processed.append(processed_chunk)
+        return processed
+    
     def process_directory(self, directory_path):
         """Process all documents in a directory"""
         all_chunks = []
         
-        for root, dirs, files in os.walk(directory_path):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.supported_formats):
-                    file_path = os.path.join(root, file)
-                    print(f"Processing: {file}")
-                    
-                    text = self.extract_text(file_path)
-                    if text.strip():  # Only process non-empty files
-                        # Use semantic chunking
-                        chunks = self.semantic_chunk_llm(text)
-                        
-                        # Add metadata to each chunk
-                        for i, chunk in enumerate(chunks):
-                            all_chunks.append({
-                                'text': chunk,
-                                'source': file,
-                                'chunk_id': f"{file}_{i}",
-                                'file_path': file_path
-                            })
-        
-        return all_chunks
\ No newline at end of file
+        for file_path in self.iter_files(directory_path):
+            print(f"Processing: {os.path.basename(file_path)}")
+            all_chunks.extend(self.process_file(file_path))
+        
+        return all_chunks
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU in front of SQLite
+
+    Entries are keyed by (provider, model name, hash of whitespace-normalized
+    text) and stored as float32 blobs. The disk tier is bounded by
+    `max_disk_entries`; when it overflows the least recently used entries are
+    evicted in one batch.
+    """
+    
+    def __init__(self, path="./embedding_cache.sqlite", max_memory_entries=10000,
+                 max_disk_entries=1000000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access)"
+        )
+        self._conn.commit()
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    @staticmethod
+    def make_key(provider, model_name, text):
+        """Cache key for a text embedded by a given provider/model"""
+        normalized = ' '.join(text.split())
+        digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        return f"{provider}:{model_name}:{digest}"
+    
+    def get_many(self, keys):
+        """Look up keys, returning a list of float32 arrays (None for misses)"""
+        results = [None] * len(keys)
+        disk_lookups = {}
+        
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                else:
+                    disk_lookups.setdefault(key, []).append(i)
+            
+            if disk_lookups:
+                found = self._read_disk(list(disk_lookups))
+                for key, vector in found.items():
+                    self._remember(key, vector)
+                    for i in disk_lookups[key]:
+                        results[i] = vector
+            
+            hits = sum(1 for vector in results if vector is not None)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        
+        return results
+    
+    def get(self, key):
+        """Look up a single key"""
+        return self.get_many([key])[0]
+    
+    def put_many(self, keys, vectors):
+        """Store vectors under keys (both tiers)"""
+        if not keys:
+            return
+        
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows
+            )
+            self._disk_count += self._conn.total_changes - before
+            self._conn.commit()
+            
+            if self._disk_count > self.max_disk_entries:
+                self._evict_disk()
+    
+    def put(self, key, vector):
+        """Store a single vector"""
+        self.put_many([key], [vector])
+    
+    def stats(self):
+        """Hit/miss counters and tier sizes"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory_entries': len(self._memory),
+            'disk_entries': self._disk_count
+        }
+    
+    def clear(self):
+        """Drop every cached embedding"""
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._disk_count = 0
+    
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+    
+    def _read_disk(self, keys, chunk_size=500):
+        found = {}
+        now = time.time()
+        # SQLite limits the number of bound parameters per statement
+        for i in range(0, len(keys), chunk_size):
+            batch = keys[i:i + chunk_size]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        
+        if found:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+        return found
+    
+    def _evict_disk(self):
+        # Evict down to 90% of the bound so eviction isn't triggered on every put
+        target = int(self.max_disk_entries * 0.9)
+        excess = self._disk_count - target
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        self._conn.commit()
+        self._disk_count = target
@@ -0,0 +1,269 @@
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from src.metrics import metrics, SIZE_BUCKETS
+from src.tokens import estimate_tokens
+
+# OpenAI limits per embeddings request
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNIT_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def pack_batches(token_counts, max_batch_tokens, max_batch_items=MAX_INPUTS_PER_REQUEST):
+    """Group consecutive indices into batches under a token and an item budget"""
+    batches = []
+    batch, batch_tokens = [], 0
+    for i, tokens in enumerate(token_counts):
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_items):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_reset(value):
+    """Seconds from an OpenAI reset header ("20ms", "1s", "6m0s", "1h2m3.5s")"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNIT_SECONDS[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """Thread-safe token bucket; unlimited until a limit is known"""
+    
+    def __init__(self, capacity=None, per_seconds=60.0):
+        self.per_seconds = per_seconds
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        if self.capacity is not None:
+            rate = self.capacity / self.per_seconds
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * rate)
+        self._updated = now
+    
+    def acquire(self, amount):
+        """Block until amount can be taken (a request larger than the bucket waits for a full one)"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.capacity is None:
+                    return
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                delay = (needed - self.tokens) * self.per_seconds / self.capacity
+            time.sleep(min(delay, 1.0))
+    
+    def update(self, limit, remaining):
+        """Adopt the limit and remaining budget reported by the server"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                if self.capacity is None:
+                    self.tokens = limit
+                self.capacity = limit
+            if remaining is not None and self.tokens is not None:
+                self.tokens = min(self.tokens, remaining)
+
+
+class EmbeddingDispatcher:
+    """Embeds large text lists with the OpenAI API without tripping rate limits
+
+    Texts are packed into requests by estimated token count, up to
+    max_in_flight requests run at once (across all callers), request and
+    token buckets are paced from the x-ratelimit-* response headers, and
+    429s, 5xx responses and connection errors are retried with jittered
+    exponential backoff (honouring Retry-After). A 429 pauses every worker,
+    not just the one that saw it.
+    """
+    
+    def __init__(self, get_client, model_name, max_in_flight=8, max_batch_tokens=100000,
+                 max_retries=8, base_delay=0.5, max_delay=60.0):
+        # Called per embed() so the client can be replaced (e.g. by a test double)
+        self.get_client = get_client
+        self.model_name = model_name
+        self.max_in_flight = max_in_flight
+        self.max_batch_tokens = min(max_batch_tokens, MAX_TOKENS_PER_REQUEST)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+        self.request_bucket = TokenBucket()
+        self.token_bucket = TokenBucket()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'tokens': 0}
+    
+    def embed(self, texts, on_batch=None, max_batch_items=None):
+        """Embed texts in input order
+
+        Requests are packed up to max_batch_tokens and max_batch_items texts
+        (capped at the API's MAX_INPUTS_PER_REQUEST).
+
+        on_batch(indices, embeddings) is called in the calling thread as each
+        request completes, so finished work can be checkpointed before the
+        rest arrives. If a request still fails after max_retries, the
+        remaining requests are cancelled and the error is raised.
+        """
+        if not texts:
+            return []
+        client = self.get_client()
+        # The dispatcher does its own retries
+        if hasattr(client, 'with_options'):
+            client = client.with_options(max_retries=0)
+        
+        token_counts = [estimate_tokens(text) for text in texts]
+        batches = pack_batches(token_counts, self.max_batch_tokens,
+                               min(max_batch_items or MAX_INPUTS_PER_REQUEST, MAX_INPUTS_PER_REQUEST))
+        embeddings = [None] * len(texts)
+        
+        def finished(indices, vectors):
+            for i, vector in zip(indices, vectors):
+                embeddings[i] = vector
+            if on_batch:
+                on_batch(indices, vectors)
+        
+        if len(batches) == 1:
+            finished(batches[0], self._send(client, texts, sum(token_counts)))
+            return embeddings
+        
+        futures = {
+            self._pool.submit(self._send, client, [texts[i] for i in batch],
+                              sum(token_counts[i] for i in batch)): batch
+            for batch in batches
+        }
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(futures.pop(future), future.result())
+        except BaseException:
+            # Requests already on the wire are still checkpointed
+            running = [future for future in futures if not future.cancel()]
+            for future in wait(running).done:
+                if future.exception() is None:
+                    finished(futures[future], future.result())
+            raise
+        return embeddings
+    
+    def _send(self, client, batch, tokens):
+        """One embeddings request with pacing and retries"""
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(tokens)
+            
+            with self._slots:
+                try:
+                    raw = client.embeddings.with_raw_response.create(model=self.model_name, input=batch)
+                    response = raw.parse()
+                except Exception as e:
+                    status, headers = self._error_details(e)
+                    if not self._retryable(e, status) or attempt >= self.max_retries:
+                        raise
+                    error = e
+                else:
+                    error = None
+            
+            if error is None:
+                self._observe(raw.headers)
+                with self._lock:
+                    self.stats['requests'] += 1
+                    self.stats['tokens'] += tokens
+                metrics.observe('rag_tokens', tokens, buckets=SIZE_BUCKETS, kind='embedding')
+                data = sorted(response.data, key=lambda item: item.index)
+                return [item.embedding for item in data]
+            
+            attempt += 1
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            retry_after = self._retry_after(headers)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            metrics.inc('rag_embedding_retries_total', status=str(status or type(error).__name__))
+            with self._lock:
+                self.stats['retries'] += 1
+                if status == 429:
+                    self.stats['rate_limited'] += 1
+                    # Everyone backs off, not just this worker
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            if headers:
+                self._observe(headers)
+            print(f"Embedding request failed ({status or type(error).__name__}); "
+                  f"retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+    
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+    
+    def _observe(self, headers):
+        """Update the buckets from x-ratelimit-* headers"""
+        self.request_bucket.update(
+            _int_header(headers, 'x-ratelimit-limit-requests'),
+            _int_header(headers, 'x-ratelimit-remaining-requests')
+        )
+        self.token_bucket.update(
+            _int_header(headers, 'x-ratelimit-limit-tokens'),
+            _int_header(headers, 'x-ratelimit-remaining-tokens')
+        )
+    
+    @staticmethod
+    def _error_details(error):
+        response = getattr(error, 'response', None)
+        status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+        headers = getattr(response, 'headers', None) or {}
+        return status, headers
+    
+    @staticmethod
+    def _retryable(error, status):
+        if status is not None:
+            return status in (408, 409, 429) or status >= 500
+        import openai
+        return isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError))
+    
+    @staticmethod
+    def _retry_after(headers):
+        if not headers:
+            return None
+        if headers.get('retry-after-ms'):
+            try:
+                return float(headers['retry-after-ms']) / 1000
+            except ValueError:
+                pass
+        return parse_reset(headers.get('retry-after'))
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
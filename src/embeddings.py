@@ -1,53 +1,190 @@
-import openai
-from sentence_transformers import SentenceTransformer
 import os
+import numpy as np
 from dotenv import load_dotenv
 
+from src.embedding_cache import EmbeddingCache
+from src.embedding_dispatcher import EmbeddingDispatcher
+from src.local_embeddings import LocalEmbeddingEngine
+from src.metrics import metrics, SIZE_BUCKETS
+
 load_dotenv()
 
 class EmbeddingService:
-    def __init__(self, provider="openai"):
+    def __init__(self, provider="openai", cache=None):
         self.provider = provider
+        # Optional EmbeddingCache; only cache misses are sent to the backend
+        self.cache = cache
+        
+        # Clients and the local model are created on first use: importing
+        # openai or sentence_transformers (torch) costs seconds at startup
+        self._client = None
+        self._async_client = None
         
         if provider == "openai":
-            self.client = openai.OpenAI(
+            self.model_name = "text-embedding-ada-002"
+            # Token-budget batching, rate-limit pacing and retries for bulk embedding
+            self.dispatcher = EmbeddingDispatcher(lambda: self.client, self.model_name)
+        elif provider == "local":
+            self.model_name = "all-MiniLM-L6-v2"
+            # Length-sorted batching, optional multi-process encoding and
+            # micro-batching of concurrent single queries
+            self.local_engine = LocalEmbeddingEngine(self.model_name)
+    
+    @property
+    def client(self):
+        """OpenAI client, created on first use"""
+        if self._client is None:
+            import openai
+            self._client = openai.OpenAI(
                 api_key=os.getenv("OPENAI_API_KEY")
             )
-        elif provider == "local":
-            # Load local embedding model
-            print("Loading local embedding model...")
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        return self._client
     
-    def get_embedding(self, text):
-        """Get embedding for a single text"""
-        if self.provider == "openai":
-            response = self.client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
+    @client.setter
+    def client(self, client):
+        self._client = client
+    
+    @property
+    def async_client(self):
+        """AsyncOpenAI client, created on first use"""
+        if self._async_client is None:
+            import openai
+            self._async_client = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY")
             )
-            return response.data[0].embedding
-        
+        return self._async_client
+    
+    @async_client.setter
+    def async_client(self, client):
+        self._async_client = client
+    
+    @property
+    def model(self):
+        """Local SentenceTransformer model, loaded on first use"""
+        return self.local_engine.model
+    
+    def warm_up(self):
+        """Create the client or load the local model ahead of the first request"""
+        if self.provider == "openai":
+            self.client
+            self.async_client
         elif self.provider == "local":
-            return self.model.encode(text).tolist()
+            self.model
     
-    def get_embeddings_batch(self, texts, batch_size=100):
-        """Get embeddings for multiple texts"""
-        embeddings = []
+    def get_embedding(self, text):
+        """Get embedding for a single text, as a float32 array"""
+        key, cached = self._cache_lookup(text)
+        if cached is not None:
+            return cached
         
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            
+        with metrics.span('embed_query'):
             if self.provider == "openai":
                 response = self.client.embeddings.create(
-                    model="text-embedding-ada-002",
-                    input=batch
+                    model=self.model_name,
+                    input=text
                 )
-                batch_embeddings = [data.embedding for data in response.data]
+                embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
             
             elif self.provider == "local":
-                batch_embeddings = self.model.encode(batch).tolist()
+                embedding = self.local_engine.encode_one(text)
+        
+        return self._cache_store(key, embedding)
+    
+    async def aget_embedding(self, text):
+        """Async get_embedding: awaits OpenAI or the local engine's micro-batch worker"""
+        key, cached = self._cache_lookup(text)
+        if cached is not None:
+            return cached
+        
+        with metrics.span('embed_query'):
+            if self.provider == "openai":
+                response = await self.async_client.embeddings.create(
+                    model=self.model_name,
+                    input=text
+                )
+                embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+            
+            elif self.provider == "local":
+                embedding = await self.local_engine.aencode_one(text)
+        
+        return self._cache_store(key, embedding)
+    
+    def _cache_lookup(self, text):
+        """Return (cache key, cached embedding or None)"""
+        if self.cache is None:
+            return None, None
+        key = EmbeddingCache.make_key(self.provider, self.model_name, text)
+        cached = self.cache.get(key)
+        metrics.inc('rag_cache_requests_total', cache='embedding', result='miss' if cached is None else 'hit')
+        return key, cached
+    
+    def _cache_store(self, key, embedding):
+        """Cache a fresh embedding and return it"""
+        if self.cache is not None:
+            self.cache.put(key, embedding)
+        return embedding
+    
+    def get_embeddings_batch(self, texts, batch_size=None):
+        """Get embeddings for multiple texts, as one (n, dim) float32 array
+        
+        batch_size caps the texts per API request (or local forward pass);
+        None leaves batching to the backend. Vectors stay NumPy arrays
+        through the cache and the vector store; nothing is converted to
+        Python lists on the way.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.cache is None:
+            return np.asarray(self._embed_texts(texts, batch_size), dtype=np.float32)
+        
+        keys = [EmbeddingCache.make_key(self.provider, self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        hits = sum(vector is not None for vector in cached)
+        metrics.inc('rag_cache_requests_total', hits, cache='embedding', result='hit')
+        metrics.inc('rag_cache_requests_total', len(keys) - hits, cache='embedding', result='miss')
+        
+        # Only send each distinct missing text to the backend once
+        missing = {}
+        for text, key, vector in zip(texts, keys, cached):
+            if vector is None and key not in missing:
+                missing[key] = text
+        
+        if missing:
+            print(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits")
+            missing_keys = list(missing)
+            
+            # Each finished request is cached right away, so an interrupted
+            # ingest only re-embeds what hadn't come back yet
+            def checkpoint(indices, vectors):
+                self.cache.put_many([missing_keys[i] for i in indices], vectors)
+            
+            new_embeddings = np.asarray(
+                self._embed_texts(list(missing.values()), batch_size, checkpoint), dtype=np.float32
+            )
+            fresh = dict(zip(missing_keys, new_embeddings))
+        else:
+            fresh = {}
+        
+        return np.stack([vector if vector is not None else fresh[key]
+                         for key, vector in zip(keys, cached)])
+    
+    def _embed_texts(self, texts, batch_size, on_batch=None):
+        """Embed texts with the backend
+        
+        OpenAI requests are packed by token budget by the dispatcher, with at
+        most batch_size texts each; the local engine returns one float32 array
+        and runs forward passes of batch_size texts (its device default when
+        None). on_batch(indices, embeddings) sees each finished part.
+        """
+        metrics.observe('rag_embedding_batch_size', len(texts), buckets=SIZE_BUCKETS)
+        with metrics.span('embed'):
+            if self.provider == "local":
+                embeddings = self.local_engine.encode(texts, batch_size)
+                if on_batch:
+                    on_batch(list(range(len(texts))), embeddings)
             
-            embeddings.extend(batch_embeddings)
-            print(f"Processed {min(i + batch_size, len(texts))}/{len(texts)} embeddings")
+            elif self.provider == "openai":
+                embeddings = self.dispatcher.embed(texts, on_batch, batch_size)
         
-        return embeddings
\ No newline at end of file
+        print(f"Processed {len(texts)}/{len(texts)} embeddings")
+        return embeddings
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import traceback
+
+
+class DocumentWatcher:
+    """Watches a directory tree and reports changed paths in debounced batches
+
+    Change events are collected until `debounce` seconds pass without a new
+    one (or `max_delay` seconds after the first, so a steady stream of
+    writes can't hold a batch back forever); then on_changes(paths) is
+    called with the changed files and directories. Uses watchdog (inotify,
+    FSEvents, ReadDirectoryChangesW) when it is installed, otherwise polls
+    file sizes and mtimes every poll_interval seconds. Nothing is read or
+    hashed here; deciding what really changed is left to the ingest manifest.
+    """
+    
+    def __init__(self, directory, on_changes, is_supported=None, debounce=1.0, max_delay=10.0,
+                 poll_interval=2.0, use_polling=False):
+        self.directory = os.path.abspath(directory)
+        self.on_changes = on_changes
+        self.is_supported = is_supported or (lambda path: True)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling
+        self.mode = None
+        self.batches = 0
+        
+        self._pending = set()
+        self._first_event = None
+        self._last_event = None
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._observer = None
+    
+    def start(self):
+        """Start watching (returns immediately)"""
+        observer = None if self.use_polling else self._start_observer()
+        if observer is not None:
+            self._observer = observer
+            self.mode = "events"
+        else:
+            self.mode = "polling"
+            self._spawn(self._poll, "watcher-poll")
+        self._spawn(self._dispatch, "watcher-dispatch")
+        print(f"Watching {self.directory} ({self.mode})")
+    
+    def stop(self):
+        """Stop watching; changes still waiting for their debounce are dropped"""
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        for thread in self._threads:
+            thread.join()
+    
+    def notify(self, path):
+        """Record a change to a path (called by the event source)"""
+        now = time.monotonic()
+        with self._condition:
+            if not self._pending:
+                self._first_event = now
+            self._pending.add(path)
+            self._last_event = now
+            self._condition.notify_all()
+    
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+    
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            with self._condition:
+                while not self._pending and not self._stopping.is_set():
+                    self._condition.wait()
+                # Wait for a quiet period, bounded by max_delay. Polling only
+                # sees changes once per interval, so quiet means one more poll.
+                quiet = self.debounce + (self.poll_interval if self.mode == "polling" else 0)
+                while not self._stopping.is_set():
+                    due = min(self._last_event + quiet, self._first_event + self.max_delay)
+                    remaining = due - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopping.is_set():
+                    return
+                paths = sorted(self._pending)
+                self._pending = set()
+            
+            self.batches += 1
+            try:
+                self.on_changes(paths)
+            except Exception:
+                traceback.print_exc()
+    
+    def _start_observer(self):
+        """A running watchdog observer, or None when watchdog isn't installed"""
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        observer = Observer()
+        observer.schedule(_EventHandler(self), self.directory, recursive=True)
+        observer.start()
+        return observer
+    
+    def _poll(self):
+        snapshot = self._snapshot()
+        while not self._stopping.wait(self.poll_interval):
+            current = self._snapshot()
+            for path in current.keys() | snapshot.keys():
+                if current.get(path) != snapshot.get(path):
+                    self.notify(path)
+            snapshot = current
+    
+    def _snapshot(self):
+        """path -> (mtime, size) of every supported file under the directory"""
+        snapshot = {}
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                if not self.is_supported(file):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+
+class _EventHandler:
+    """watchdog event handler feeding a DocumentWatcher"""
+    
+    def __init__(self, watcher):
+        self.watcher = watcher
+    
+    def dispatch(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        if event.is_directory and event.event_type == 'modified':
+            # Follows every change inside the directory, which has its own event
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path and (event.is_directory or self.watcher.is_supported(path)):
+                self.watcher.notify(os.fsdecode(path))
@@ -0,0 +1,160 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+
+
+class IngestCancelled(Exception):
+    """Raised by a job's run function when it stopped early because it was cancelled"""
+
+
+class IngestJob:
+    """One queued ingestion run: its state, progress counters and cancel flag
+
+    status moves from "queued" to "running" and ends as "completed",
+    "failed" or "cancelled".
+    """
+    
+    def __init__(self, job_id, directory, paths=None):
+        self.job_id = job_id
+        self.directory = directory
+        # Files/subdirectories to check, or None for the whole directory
+        self.paths = paths
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.progress = {'files_total': 0, 'files': 0, 'failed_files': 0, 'chunks': 0, 'embedded': 0,
+                         'duplicate_chunks': 0}
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+    
+    @property
+    def done(self):
+        return self.status in ("completed", "failed", "cancelled")
+    
+    def update(self, **progress):
+        """Merge new counter values (called from the ingesting thread)"""
+        with self._lock:
+            self.progress.update((key, value) for key, value in progress.items() if key in self.progress)
+    
+    def to_dict(self):
+        """JSON-ready snapshot with elapsed time and files/chunks/embeddings per second"""
+        with self._lock:
+            progress = dict(self.progress)
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        rates = {}
+        for key in ('files', 'chunks', 'embedded'):
+            rates[f'{key}_per_second'] = progress[key] / elapsed if elapsed else 0.0
+        return {
+            'job_id': self.job_id,
+            'directory': self.directory,
+            'paths': len(self.paths) if self.paths is not None else None,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'elapsed_seconds': elapsed,
+            'error': self.error,
+            **progress,
+            **rates
+        }
+
+
+class IngestJobManager:
+    """Background queue of ingestion jobs, run one at a time on a worker thread
+
+    run_job(job) does the work, reporting through job.update() and checking
+    job.cancel_event; it raises IngestCancelled if it stopped early. Jobs run one after another because they share the
+    ingest manifest and the vector store. Finished jobs are kept for status
+    queries, up to max_finished of them.
+    """
+    
+    def __init__(self, run_job, max_finished=50):
+        self.run_job = run_job
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def submit(self, directory, paths=None):
+        """Queue an ingestion of a directory (or of `paths` inside it), returning its IngestJob
+
+        A directory that already has a job waiting in the queue reuses it,
+        widened to cover the new paths (or the whole directory).
+        """
+        directory = os.path.abspath(directory)
+        paths = set(paths) if paths is not None else None
+        with self._lock:
+            for job in self._jobs.values():
+                if job.directory == directory and job.status == "queued":
+                    if job.paths is not None:
+                        job.paths = job.paths | paths if paths is not None else None
+                    return job
+            job = IngestJob(f"ingest-{next(self._ids)}", directory, paths)
+            self._jobs[job.job_id] = job
+            self._forget_finished()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="ingest-jobs", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+    
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+    
+    def jobs(self):
+        """All known jobs, oldest first"""
+        with self._lock:
+            return list(self._jobs.values())
+    
+    def active(self):
+        """The running job and those waiting, oldest first"""
+        return [job for job in self.jobs() if not job.done]
+    
+    def cancel(self, job_id):
+        """Cancel a queued or running job; False if unknown or already finished"""
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel_event.set()
+        with self._lock:
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished = time.time()
+        return True
+    
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started = time.time()
+            
+            try:
+                self.run_job(job)
+                status = "completed"
+            except IngestCancelled:
+                status = "cancelled"
+            except Exception as e:
+                traceback.print_exc()
+                job.error = str(e)
+                status = "failed"
+            
+            job.finished = time.time()
+            job.status = status
+            print(f"Ingest job {job.job_id} {status}")
+    
+    def _forget_finished(self):
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.job_id]
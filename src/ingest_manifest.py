@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+
+# Version 2: chunks carry extension, directory and mtime metadata for filters
+MANIFEST_VERSION = 2
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """Persistent record of ingested files (mtime, size, content hash, chunk ids)
+
+    Lets a re-ingest skip files that have not changed and find the chunks that
+    belong to files which were edited or removed since the last run.
+    refresh() picks up a manifest saved by another process (the watch daemon).
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._load()
+    
+    def refresh(self):
+        """Reload the manifest if another process saved it since it was read"""
+        if self._disk_stamp() != self._stamp:
+            self._load()
+    
+    def _load(self):
+        self._stamp = self._disk_stamp()
+        self.files = {}
+        self.is_new = self._stamp is None
+        
+        if not self.is_new:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.files = manifest.get('files', {})
+            if manifest.get('version', 1) < MANIFEST_VERSION:
+                # Chunks from an older version lack metadata this one stores:
+                # forget mtime and hash so every file counts as changed and is
+                # re-ingested (its old chunk ids are still known, so they're replaced)
+                for entry in self.files.values():
+                    entry['mtime'] = entry['hash'] = None
+    
+    def _disk_stamp(self):
+        """Identity of the manifest file (replaced atomically on every save), or None"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def get(self, file_path):
+        """Get the manifest entry for a file, or None if it was never ingested"""
+        return self.files.get(os.path.abspath(file_path))
+    
+    def is_unchanged(self, file_path, stat):
+        """Cheap check: same mtime and size as the last ingest"""
+        entry = self.get(file_path)
+        return (
+            entry is not None and
+            entry['mtime'] == stat.st_mtime and
+            entry['size'] == stat.st_size
+        )
+    
+    def update(self, file_path, stat, content_hash, chunk_ids):
+        """Record the current state of an ingested file"""
+        self.files[os.path.abspath(file_path)] = {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': content_hash,
+            'chunk_ids': list(chunk_ids)
+        }
+    
+    def remove(self, file_path):
+        """Forget a file, returning its entry (or None)"""
+        return self.files.pop(os.path.abspath(file_path), None)
+    
+    def files_under(self, directory_path):
+        """All recorded files that live inside a directory"""
+        root = os.path.join(os.path.abspath(directory_path), '')
+        return [path for path in self.files if path.startswith(root)]
+    
+    def total_chunks(self):
+        """Number of chunks recorded across all files"""
+        return sum(len(entry['chunk_ids']) for entry in self.files.values())
+    
+    def save(self):
+        """Write the manifest atomically"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+        self._stamp = self._disk_stamp()
+        self.is_new = False
+    
+    def clear(self):
+        """Forget every file"""
+        self.files = {}
+        self.is_new = False
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._stamp = None
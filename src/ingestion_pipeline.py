@@ -0,0 +1,340 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from src.document_processor import DocumentProcessor
+from src.metrics import metrics
+from src.tokens import estimate_tokens
+
+_worker_processor = None
+
+
+def _processor(options):
+    """This worker's DocumentProcessor, rebuilt if the parent's options changed"""
+    global _worker_processor
+    if _worker_processor is None or _worker_processor.options() != options:
+        _worker_processor = DocumentProcessor(**options)
+    return _worker_processor
+
+
+def _process_file(file_path, chunk_prefix, options, pdf_pages_per_task=None):
+    """Pool worker: extract and chunk one file
+
+    Returns (chunks, None), or (None, page_count) for a PDF long enough to be
+    split into page ranges instead.
+    """
+    processor = _processor(options)
+    if pdf_pages_per_task and file_path.lower().endswith('.pdf'):
+        page_count = processor.pdf_page_count(file_path)
+        if page_count > pdf_pages_per_task:
+            return None, page_count
+    return processor.process_file(file_path, chunk_prefix=chunk_prefix), None
+
+
+def _recorded(task, *args):
+    """Pool worker: run a task, returning (result, metrics it recorded)"""
+    return task(*args), metrics.collect()
+
+
+def _extract_pages(file_path, start, stop, options):
+    """Pool worker: text of PDF pages [start, stop)"""
+    return _processor(options).extract_pdf_pages(file_path, start, stop)
+
+
+def _warm_worker(options):
+    """Pool worker: build the worker's DocumentProcessor ahead of the first file"""
+    _processor(options)
+    return os.getpid()
+
+
+def start_pool(max_workers, processor):
+    """Process pool whose workers have their parsers loaded, for reuse across runs"""
+    pool = ProcessPoolExecutor(max_workers=max_workers)
+    options = processor.options()
+    for _ in range(max_workers):
+        pool.submit(_warm_worker, options)
+    return pool
+
+
+class IngestionPipeline:
+    """Streaming extract -> chunk -> embed -> upsert pipeline with bounded memory
+
+    Files are extracted and chunked on a process pool (PyPDF2/python-docx are
+    CPU-bound; PDFs longer than pdf_pages_per_task pages are split into page
+    ranges extracted in parallel), chunks are grouped into embedding batches
+    (up to embed_batch_size chunks and, with embed_batch_tokens, that many
+    estimated tokens: one API request each) with embed_concurrency batches
+    embedding at once on a thread pool, and embedded chunks are
+    written to the vector store in bounded batches. Every stage holds at most
+    a fixed number of items, so a slow stage stalls the ones before it instead
+    of letting work pile up in memory. The processor's size and time limits
+    apply to every file (and to every page range of a split PDF). With a
+    deduplicator, near-duplicate chunks are linked to the chunk they repeat
+    between chunking and embedding, and are never embedded; kept chunks are
+    reported to it as stored once their write batch lands.
+
+    Pass a pool from start_pool() to reuse warm worker processes across
+    runs; otherwise each run starts (and shuts down) its own.
+    """
+    
+    def __init__(self, embedding_service, vector_store, max_workers=None,
+                 embed_batch_size=100, embed_concurrency=4, write_batch_size=500,
+                 max_pending_files=None, processor=None, pdf_pages_per_task=50, deduplicator=None,
+                 pool=None, flush_interval=2.0, embed_batch_tokens=None):
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+        self.deduplicator = deduplicator
+        self.processor = processor or DocumentProcessor()
+        self.pdf_pages_per_task = pdf_pages_per_task
+        self.pool = pool
+        # 0 extracts in the calling process (no pool)
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_tokens = embed_batch_tokens
+        self.embed_concurrency = max(1, embed_concurrency)
+        self.write_batch_size = write_batch_size
+        # Write a partial batch once it is this old (seconds), so progress and
+        # search results don't wait for write_batch_size chunks
+        self.flush_interval = flush_interval
+        self.max_pending_files = max_pending_files or max(2, self.max_workers * 2)
+    
+    def run(self, files, on_file_done=None, on_file_error=None, on_progress=None, cancel=None):
+        """Ingest an iterable of (file_path, chunk_prefix) pairs
+
+        on_file_done(file_path, chunk_ids) is called once all of a file's chunks
+        are stored (chunk_ids includes chunks linked as duplicates);
+        on_file_error(file_path, exc) when extraction fails; on_progress(stats)
+        whenever a file finishes or a write batch lands. Setting the `cancel`
+        event stops the run: no new files are started and what is already
+        embedded is written. Returns a dict with file, chunk and embedding
+        counts; 'duplicate_chunks' is the number of embeddings saved by
+        deduplication, 'cancelled' whether the run was stopped early.
+        """
+        stats = {'files': 0, 'failed_files': 0, 'chunks': 0, 'embedded': 0, 'duplicate_chunks': 0,
+                 'cancelled': False}
+        
+        def progress():
+            if on_progress:
+                on_progress(dict(stats))
+        # file_path -> [chunk ids, number of chunks not yet written]
+        pending = {}
+        write_buffer = []
+        last_flush = [time.monotonic()]
+        
+        def file_finished(file_path):
+            chunk_ids, _ = pending.pop(file_path)
+            stats['files'] += 1
+            metrics.inc('rag_ingest_files_total', result='ok')
+            if on_file_done:
+                on_file_done(file_path, chunk_ids)
+            progress()
+        
+        def flush():
+            last_flush[0] = time.monotonic()
+            if not write_buffer:
+                return
+            chunks = [chunk for chunk, _ in write_buffer]
+            embeddings = np.stack([embedding for _, embedding in write_buffer])
+            self.vector_store.upsert_documents(chunks, embeddings)
+            self.vector_store.checkpoint()
+            if self.deduplicator is not None:
+                self.deduplicator.stored([chunk['chunk_id'] for chunk in chunks])
+            stats['chunks'] += len(chunks)
+            metrics.inc('rag_ingest_chunks_total', len(chunks))
+            write_buffer.clear()
+            
+            for chunk in chunks:
+                entry = pending[chunk['file_path']]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    file_finished(chunk['file_path'])
+            progress()
+        
+        def extracted_files():
+            for file_path, chunks, error in self._extract(files):
+                if cancel is not None and cancel.is_set():
+                    stats['cancelled'] = True
+                    return
+                if error is not None:
+                    stats['failed_files'] += 1
+                    metrics.inc('rag_ingest_files_total', result='failed')
+                    print(f"Failed to process {file_path}: {error}")
+                    if on_file_error:
+                        on_file_error(file_path, error)
+                    progress()
+                    continue
+                
+                chunk_ids = [chunk['chunk_id'] for chunk in chunks]
+                linked = ""
+                if self.deduplicator is not None:
+                    with metrics.span('dedup'):
+                        unique = self.deduplicator.add(chunks)
+                    duplicates = len(chunks) - len(unique)
+                    if duplicates:
+                        stats['duplicate_chunks'] += duplicates
+                        metrics.inc('rag_ingest_duplicate_chunks_total', duplicates)
+                        linked = f", {duplicates} near-duplicates linked"
+                    chunks = unique
+                
+                print(f"Processing: {os.path.basename(file_path)} ({len(chunk_ids)} chunks{linked})")
+                pending[file_path] = [chunk_ids, len(chunks)]
+                if not chunks:
+                    file_finished(file_path)
+                    continue
+                yield chunks
+        
+        with ThreadPoolExecutor(max_workers=self.embed_concurrency) as embed_pool:
+            in_flight = {}
+            max_in_flight = self.embed_concurrency * 2
+            
+            def drain(return_when):
+                done, _ = wait(in_flight, return_when=return_when)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    write_buffer.extend(zip(batch, future.result()))
+                    stats['embedded'] += len(batch)
+                    if (len(write_buffer) >= self.write_batch_size or
+                            time.monotonic() - last_flush[0] >= self.flush_interval):
+                        flush()
+                    else:
+                        progress()
+            
+            batches = self._batches(extracted_files())
+            for batch in batches:
+                if cancel is not None and cancel.is_set():
+                    stats['cancelled'] = True
+                    batches.close()
+                    break
+                while len(in_flight) >= max_in_flight:
+                    drain(FIRST_COMPLETED)
+                future = embed_pool.submit(
+                    self.embedding_service.get_embeddings_batch,
+                    [chunk['text'] for chunk in batch]
+                )
+                in_flight[future] = batch
+            
+            while in_flight:
+                drain(FIRST_COMPLETED)
+            flush()
+        
+        return stats
+    
+    def _batches(self, chunk_lists):
+        """Regroup per-file chunk lists into embedding batches under the item and token budgets"""
+        batch, batch_tokens = [], 0
+        for chunks in chunk_lists:
+            for chunk in chunks:
+                tokens = estimate_tokens(chunk['text']) if self.embed_batch_tokens else 0
+                if batch and (len(batch) >= self.embed_batch_size or
+                              self.embed_batch_tokens and batch_tokens + tokens > self.embed_batch_tokens):
+                    yield batch
+                    batch, batch_tokens = [], 0
+                batch.append(chunk)
+                batch_tokens += tokens
+        if batch:
+            yield batch
+    
+    def _extract(self, files):
+        """Yield (file_path, chunks, error) as files finish extracting
+
+        At most max_pending_files are submitted or finished-but-unconsumed at
+        any time, so the pool only runs ahead of the embedder by that much.
+        A split PDF's page ranges count towards that limit (they queue ahead
+        of new files until there is room), and the file is chunked here once
+        all of its ranges are back.
+        """
+        if self.max_workers == 0:
+            for file_path, chunk_prefix in files:
+                try:
+                    yield file_path, self.processor.process_file(file_path, chunk_prefix), None
+                except Exception as e:
+                    yield file_path, None, e
+            return
+        
+        files = iter(files)
+        options = self.processor.options()
+        pool = self.pool or ProcessPoolExecutor(max_workers=self.max_workers)
+        # future -> (file_path, chunk_prefix, page range index or None)
+        in_flight = {}
+        try:
+            # file_path -> [page texts per range, ranges still running]
+            split = {}
+            failed = set()
+            # (file_path, chunk_prefix, page range index, first page) not yet submitted
+            queued_ranges = deque()
+            exhausted = False
+            
+            while True:
+                while queued_ranges and len(in_flight) < self.max_pending_files:
+                    file_path, chunk_prefix, i, start = queued_ranges.popleft()
+                    if file_path in failed:
+                        continue
+                    future = pool.submit(_recorded, _extract_pages, file_path, start,
+                                         start + self.pdf_pages_per_task, options)
+                    in_flight[future] = (file_path, chunk_prefix, i)
+                
+                while not exhausted and not queued_ranges and len(in_flight) < self.max_pending_files:
+                    try:
+                        file_path, chunk_prefix = next(files)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = pool.submit(_recorded, _process_file, file_path, chunk_prefix, options,
+                                         self.pdf_pages_per_task)
+                    in_flight[future] = (file_path, chunk_prefix, None)
+                
+                if not in_flight:
+                    return
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path, chunk_prefix, part = in_flight.pop(future)
+                    if file_path in failed:
+                        # Another page range of this file already failed
+                        continue
+                    try:
+                        result, recorded = future.result()
+                    except Exception as e:
+                        if part is not None:
+                            failed.add(file_path)
+                            del split[file_path]
+                            for other, (other_path, _, _) in in_flight.items():
+                                if other_path == file_path:
+                                    other.cancel()
+                        yield file_path, None, e
+                        continue
+                    # Timings recorded in the worker process
+                    metrics.merge(recorded)
+                    
+                    if part is None:
+                        chunks, page_count = result
+                        if chunks is not None:
+                            yield file_path, chunks, None
+                            continue
+                        starts = range(0, page_count, self.pdf_pages_per_task)
+                        print(f"Extracting {os.path.basename(file_path)} ({page_count} pages) "
+                              f"as {len(starts)} page ranges")
+                        split[file_path] = [[None] * len(starts), len(starts)]
+                        queued_ranges.extend((file_path, chunk_prefix, i, start) for i, start in enumerate(starts))
+                        continue
+                    
+                    ranges = split[file_path]
+                    ranges[0][part] = result
+                    ranges[1] -= 1
+                    if ranges[1]:
+                        continue
+                    del split[file_path]
+                    pages = [page for page_range in ranges[0] for page in page_range]
+                    try:
+                        yield file_path, self.processor.chunk_pages(file_path, pages, chunk_prefix), None
+                    except Exception as e:
+                        yield file_path, None, e
+        finally:
+            # Stopped early (cancelled, or the consumer failed): drop queued work
+            for future in in_flight:
+                future.cancel()
+            if pool is not self.pool:
+                pool.shutdown()
@@ -0,0 +1,330 @@
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from array import array
+from collections import Counter
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercased word tokens (identifiers like AB-1234 become 'ab', '1234')"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists: score(id) = sum over lists of 1 / (k + rank)
+
+    Returns [(id, score)] sorted best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """BM25 inverted index over chunk ids, stored as memory-mapped arrays
+
+    The persisted segment is a set of flat NumPy arrays (per-term posting
+    lists of doc numbers and term frequencies, plus doc lengths) opened with
+    mmap, so only the postings a query touches are paged in. New chunks go
+    into an in-memory delta (packed int32 arrays) that is searched alongside
+    the segment; flush() merges the delta (and drops deleted docs) into a new
+    segment on disk. Writers call flush(min_postings) after each batch, so
+    the delta stays small however much is indexed.
+
+    Other processes sharing the directory pick up a new segment with
+    refresh(). Unflushed local changes are replayed on top of it, and
+    flush() does the same first, so a segment is never written from a
+    stale view.
+    """
+    
+    def __init__(self, directory, k1=1.5, b=0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+    
+    def count(self):
+        """Number of live documents"""
+        return len(self._id_to_doc)
+    
+    def add(self, chunk_ids, texts):
+        """Index (or re-index) chunks"""
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                self._add_one(chunk_id, Counter(tokenize(text)))
+            self._dirty = True
+    
+    def delete(self, chunk_ids):
+        """Remove chunks from the index"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._delete_one(chunk_id)
+            self._dirty = True
+    
+    def search(self, query, n_results=10, allowed_ids=None):
+        """BM25 search, returning [(chunk_id, score)] best first
+
+        With allowed_ids, only those chunks are scored (IDF stays collection-wide).
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_ids)
+            live = len(self._id_to_doc)
+            if not terms or not live:
+                return []
+            
+            allowed = None
+            if allowed_ids is not None:
+                allowed_docs = [self._id_to_doc[chunk_id] for chunk_id in allowed_ids if chunk_id in self._id_to_doc]
+                if not allowed_docs:
+                    return []
+                allowed = np.zeros(len(self._deleted), dtype=bool)
+                allowed[allowed_docs] = True
+            
+            avg_length = self._total_length / live
+            lengths = self._doc_lengths()
+            norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+            scores = np.zeros(n_docs, dtype=np.float32)
+            
+            for term in terms:
+                docs, tfs = self._postings(term)
+                if not len(docs):
+                    continue
+                alive = ~self._deleted[docs]
+                docs, tfs = docs[alive], tfs[alive]
+                if not len(docs):
+                    continue
+                idf = math.log(1 + (live - len(docs) + 0.5) / (len(docs) + 0.5))
+                if allowed is not None:
+                    keep = allowed[docs]
+                    docs, tfs = docs[keep], tfs[keep]
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+            
+            top = min(n_results, int(np.count_nonzero(scores)))
+            if top == 0:
+                return []
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            return [(self._doc_ids[doc], float(scores[doc])) for doc in best]
+    
+    def flush(self, min_postings=0):
+        """Merge the in-memory delta into a new on-disk segment
+
+        With min_postings, nothing happens until the delta holds that many postings.
+        """
+        with self._lock:
+            if not self._dirty or self._delta_postings < min_postings:
+                return
+            if self._disk_stamp() != self._stamp:
+                # Another process wrote a segment since this one was loaded
+                self._rebase_locked()
+                if not self._dirty:
+                    return
+            
+            # Renumber live docs densely
+            old_docs = np.array(sorted(self._id_to_doc.values()), dtype=np.int64)
+            remap = np.full(len(self._doc_ids), -1, dtype=np.int64)
+            remap[old_docs] = np.arange(len(old_docs))
+            lengths = self._doc_lengths()[old_docs].astype(np.int32)
+            
+            terms = {}
+            doc_parts, tf_parts = [], []
+            offset = 0
+            for term in sorted(set(self._terms) | set(self._delta)):
+                docs, tfs = self._postings(term)
+                keep = remap[docs] >= 0
+                docs, tfs = remap[docs[keep]], tfs[keep]
+                if not len(docs):
+                    continue
+                terms[term] = [offset, len(docs)]
+                doc_parts.append(docs.astype(np.int32))
+                tf_parts.append(tfs.astype(np.int32))
+                offset += len(docs)
+            
+            generation = self._generation + 1
+            # Unique file names, so another process rebuilding the same index
+            # (see VectorStore.sync_lexical_index) can't overwrite this segment
+            segment = f"{generation}-{uuid.uuid4().hex[:8]}"
+            arrays = {
+                'docs': np.concatenate(doc_parts) if doc_parts else np.zeros(0, dtype=np.int32),
+                'tfs': np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.int32),
+                'lengths': lengths
+            }
+            for name, array in arrays.items():
+                np.save(self._array_path(name, segment), array)
+            
+            meta = {
+                'generation': generation,
+                'segment': segment,
+                'doc_ids': [self._doc_ids[doc] for doc in old_docs],
+                'terms': terms
+            }
+            tmp_path = os.path.join(self.directory, f'meta.json.{os.getpid()}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, os.path.join(self.directory, 'meta.json'))
+            
+            # Release the old mmaps before deleting their files
+            previous = self._segment_name
+            self._segment = None
+            self._load_locked()
+            for name in arrays:
+                path = self._array_path(name, previous)
+                if previous is not None and os.path.exists(path):
+                    os.remove(path)
+    
+    def refresh(self):
+        """Pick up a segment flushed by another process, keeping local unflushed changes"""
+        with self._lock:
+            if self._disk_stamp() != self._stamp:
+                self._rebase_locked()
+    
+    def clear(self):
+        """Drop the whole index"""
+        with self._lock:
+            self._segment = None
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+            self._load_locked()
+    
+    def _load(self):
+        with self._lock:
+            self._load_locked()
+    
+    def _load_locked(self):
+        meta_path = os.path.join(self.directory, 'meta.json')
+        # Taken first: if the segment is replaced while loading, the next refresh reloads
+        stamp = self._disk_stamp()
+        if stamp is not None:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            segment_name = meta.get('segment', str(meta['generation']))
+            # Opened before anything is replaced, so a segment deleted meanwhile leaves this view intact
+            segment = {
+                name: np.load(self._array_path(name, segment_name), mmap_mode='r')
+                for name in ('docs', 'tfs', 'lengths')
+            }
+            self._generation = meta['generation']
+            self._segment_name = segment_name
+            self._doc_ids = meta['doc_ids']
+            self._terms = meta['terms']
+            self._segment = segment
+        else:
+            self._generation = 0
+            self._segment_name = None
+            self._doc_ids = []
+            self._terms = {}
+            self._segment = None
+        self._stamp = stamp
+        
+        self._segment_docs = len(self._doc_ids)
+        self._id_to_doc = {chunk_id: doc for doc, chunk_id in enumerate(self._doc_ids)}
+        self._deleted = np.zeros(len(self._doc_ids), dtype=bool)
+        self._delta = {}
+        self._delta_postings = 0
+        self._delta_lengths = []
+        self._total_length = int(self._segment['lengths'].sum()) if self._segment is not None else 0
+        self._dirty = False
+    
+    def _rebase_locked(self):
+        """Reload the on-disk segment and replay this process's unflushed adds and deletes on it"""
+        deleted = [self._doc_ids[doc] for doc in np.flatnonzero(self._deleted[:self._segment_docs]).tolist()]
+        added = {}
+        for doc in range(self._segment_docs, len(self._doc_ids)):
+            chunk_id = self._doc_ids[doc]
+            if self._id_to_doc.get(chunk_id) == doc:
+                added[doc] = (chunk_id, {})
+        for term, postings in self._delta.items():
+            for doc, tf in np.frombuffer(postings, dtype=np.int32).reshape(-1, 2).tolist():
+                if doc in added:
+                    added[doc][1][term] = tf
+        
+        try:
+            self._load_locked()
+        except FileNotFoundError:
+            # The segment was replaced again while loading; keep this view until the next call
+            return
+        for chunk_id in deleted:
+            self._delete_one(chunk_id)
+        for chunk_id, terms in added.values():
+            self._add_one(chunk_id, terms)
+        self._dirty = bool(deleted or added)
+    
+    def _disk_stamp(self):
+        """Identity of the current meta.json (replaced atomically on every flush), or None"""
+        try:
+            stat = os.stat(os.path.join(self.directory, 'meta.json'))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _add_one(self, chunk_id, terms):
+        """Append a doc with the given term frequencies to the delta, replacing any earlier copy"""
+        self._delete_one(chunk_id)
+        
+        doc = len(self._doc_ids)
+        self._doc_ids.append(chunk_id)
+        self._id_to_doc[chunk_id] = doc
+        if doc >= len(self._deleted):
+            self._deleted = np.concatenate([self._deleted, np.zeros(max(doc, 1024), dtype=bool)])
+        
+        length = sum(terms.values())
+        self._delta_lengths.append(length)
+        self._total_length += length
+        for term, tf in terms.items():
+            postings = self._delta.get(term)
+            if postings is None:
+                # Interleaved doc, tf pairs
+                postings = self._delta[term] = array('i')
+            postings.extend((doc, tf))
+        self._delta_postings += len(terms)
+    
+    def _delete_one(self, chunk_id):
+        doc = self._id_to_doc.pop(chunk_id, None)
+        if doc is None:
+            return
+        self._deleted[doc] = True
+        if doc < self._segment_docs:
+            self._total_length -= int(self._segment['lengths'][doc])
+        else:
+            self._total_length -= self._delta_lengths[doc - self._segment_docs]
+    
+    def _doc_lengths(self):
+        segment_lengths = self._segment['lengths'] if self._segment is not None else np.zeros(0, dtype=np.int32)
+        if not self._delta_lengths:
+            return np.asarray(segment_lengths, dtype=np.float32)
+        return np.concatenate([
+            np.asarray(segment_lengths, dtype=np.float32),
+            np.asarray(self._delta_lengths, dtype=np.float32)
+        ])
+    
+    def _postings(self, term):
+        """(doc numbers, term frequencies) for a term across segment and delta"""
+        parts_docs, parts_tfs = [], []
+        entry = self._terms.get(term)
+        if entry is not None:
+            offset, length = entry
+            parts_docs.append(np.asarray(self._segment['docs'][offset:offset + length], dtype=np.int64))
+            parts_tfs.append(np.asarray(self._segment['tfs'][offset:offset + length], dtype=np.float32))
+        delta = self._delta.get(term)
+        if delta:
+            pairs = np.frombuffer(delta, dtype=np.int32).reshape(-1, 2)
+            parts_docs.append(pairs[:, 0].astype(np.int64))
+            parts_tfs.append(pairs[:, 1].astype(np.float32))
+        if not parts_docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(parts_docs), np.concatenate(parts_tfs)
+    
+    def _array_path(self, name, segment):
+        return os.path.join(self.directory, f"{name}.{segment}.npy")
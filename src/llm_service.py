@@ -1,106 +1,116 @@
-import anthropic
 import os
+import time
 from dotenv import load_dotenv
 
+from src.context_builder import ContextBuilder
+from src.metrics import metrics, SIZE_BUCKETS
+
 load_dotenv()
 
 class LLMService:
     def __init__(self):
-        self.client = anthropic.Anthropic(
-            api_key=os.getenv("ANTHROPIC_API_KEY")
-        )
+        self.model = "claude-3-5-haiku-20241022"
+        # Clients are created on first use so importing this module stays cheap
+        self._client = None
+        self._async_client = None
+        # Fits chunks and history into a token budget and marks long prefixes for prompt caching
+        self.context_builder = ContextBuilder()
+    
+    @property
+    def client(self):
+        """Anthropic client, created on first use"""
+        if self._client is None:
+            import anthropic
+            self._client = anthropic.Anthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY")
+            )
+        return self._client
+    
+    @client.setter
+    def client(self, client):
+        self._client = client
+    
+    @property
+    def async_client(self):
+        """AsyncAnthropic client, created on first use"""
+        if self._async_client is None:
+            import anthropic
+            self._async_client = anthropic.AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY")
+            )
+        return self._async_client
+    
+    @async_client.setter
+    def async_client(self, client):
+        self._async_client = client
+    
+    def warm_up(self):
+        """Create both clients ahead of the first request"""
+        self.client
+        self.async_client
     
     def generate_conversational_response(self, query, retrieved_chunks, conversation_history, max_tokens=600):
         """Generate response with conversation context"""
+        request = self.context_builder.conversational(query, retrieved_chunks, conversation_history)
         
-        # Build context from retrieved chunks
-        context_parts = []
-        for i, (doc, metadata) in enumerate(zip(retrieved_chunks['documents'], retrieved_chunks['metadatas']), 1):
-            context_parts.append(f"Source {i} ({metadata['source']}):\n{doc}")
-        
-        context = "\n\n".join(context_parts)
-        
-        # Build conversation history
-        history_text = ""
-        if conversation_history:
-            recent_history = conversation_history[-3:]  # Last 3 exchanges
-            history_parts = []
-            for exchange in recent_history:
-                history_parts.append(f"Previous Q: {exchange['question']}")
-                history_parts.append(f"Previous A: {exchange['response'][:200]}...")  # Truncate long responses
-            history_text = "\n".join(history_parts)
+        try:
+            response = self._create(request, max_tokens)
+            
+            return response.content[0].text
         
-        # Create conversational prompt
-        prompt = f"""You are having a conversation with a user about their personal documents. Here's the context:
-
-<conversation_history>
-{history_text if history_text else "This is the start of our conversation."}
-</conversation_history>
-
-<document_context>
-{context}
-</document_context>
-
-<current_question>
-{query}
-</current_question>
-
-Instructions:
-- Answer the current question based on the document context and conversation history
-- Reference previous parts of our conversation when relevant
-- If the current question builds on previous questions, acknowledge that connection
-- When citing information, indicate which source you're drawing from
-- If the context doesn't contain enough information, say so clearly
-
-Answer:"""
+        except Exception as e:
+            return f"Error generating conversational response: {str(e)}"
+    
+    async def agenerate_conversational_response(self, query, retrieved_chunks, conversation_history, max_tokens=600):
+        """Async generate_conversational_response (doesn't block the event loop)"""
+        request = self.context_builder.conversational(query, retrieved_chunks, conversation_history)
         
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-haiku-20241022",
-                max_tokens=max_tokens,
-                temperature=0.7,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            with metrics.span('generate'):
+                response = await self.async_client.messages.create(**self._request_kwargs(request, max_tokens))
+            self._record_usage(response)
             
             return response.content[0].text
-            
+        
         except Exception as e:
             return f"Error generating conversational response: {str(e)}"
     
+    def _request_kwargs(self, request, max_tokens):
+        """messages.create/stream arguments for a ContextBuilder request"""
+        kwargs = {
+            'model': self.model,
+            'max_tokens': max_tokens,
+            'temperature': 0.7,
+            'messages': request['messages']
+        }
+        if request.get('system'):
+            kwargs['system'] = request['system']
+        return kwargs
+    
+    def _create(self, request, max_tokens):
+        """messages.create for a ContextBuilder request, timed and with token usage recorded"""
+        with metrics.span('generate'):
+            response = self.client.messages.create(**self._request_kwargs(request, max_tokens))
+        self._record_usage(response)
+        return response
+    
+    @staticmethod
+    def _record_usage(message):
+        usage = getattr(message, 'usage', None)
+        if usage is None:
+            return
+        for kind in ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens'):
+            value = getattr(usage, kind, None)
+            if value:
+                metrics.observe('rag_tokens', value, buckets=SIZE_BUCKETS, kind=kind)
+    
     # Keep all existing methods
     def generate_response(self, query, retrieved_chunks, max_tokens=500):
         """Original non-conversational response method"""
-        context_parts = []
-        for i, (doc, metadata) in enumerate(zip(retrieved_chunks['documents'], retrieved_chunks['metadatas']), 1):
-            context_parts.append(f"Source {i} ({metadata['source']}):\n{doc}")
-        
-        context = "\n\n".join(context_parts)
-        
-        prompt = f"""Based on the following context, please answer the question.
-
-<context>
-{context}
-</context>
-
-<question>
-{query}
-</question>
-
-Please provide a comprehensive answer based on the context provided. When referencing information, indicate which source you're drawing from.
-
-Answer:"""
+        request = self.context_builder.documents(query, retrieved_chunks)
         
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-haiku-20241022",
-                max_tokens=max_tokens,
-                temperature=0.7,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            response = self._create(request, max_tokens)
             
             return response.content[0].text
             
@@ -110,72 +120,93 @@ Answer:"""
     def generate_simple_response(self, query, max_tokens=300):
         """Generate response without any context"""
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-haiku-20241022",
-                max_tokens=max_tokens,
-                temperature=0.7,
-                messages=[
-                    {"role": "user", "content": query}
-                ]
-            )
+            response = self._create(self._simple_request(query), max_tokens)
             
             return response.content[0].text
             
         except Exception as e:
             return f"Error generating response: {str(e)}"
-        
-    # Add this method to your existing LLMService class
-
+    
+    @staticmethod
+    def _simple_request(query):
+        return {'messages': [{"role": "user", "content": query}]}
+    
     def generate_hybrid_response(self, query, retrieved_chunks, conversation_history, relevance_threshold=0.7, max_tokens=600):
         """Generate response using documents OR general knowledge"""
         
         # Check if retrieved chunks are relevant
-        has_relevant_docs = (
-            retrieved_chunks['documents'] and 
-            len(retrieved_chunks['distances']) > 0 and 
-            min(retrieved_chunks['distances']) < relevance_threshold
-        )
-        
-        if has_relevant_docs:
+        if self.has_relevant_docs(retrieved_chunks, relevance_threshold):
             # Use document-based response
             return self.generate_conversational_response(query, retrieved_chunks, conversation_history, max_tokens)
         
         else:
             # Fall back to general knowledge with conversation context
-            history_text = ""
-            if conversation_history:
-                recent_history = conversation_history[-3:]
-                history_parts = []
-                for exchange in recent_history:
-                    history_parts.append(f"Previous Q: {exchange['question']}")
-                    history_parts.append(f"Previous A: {exchange['response'][:200]}...")
-                history_text = "\n".join(history_parts)
-            
-            prompt = f"""You are having a conversation with a user. Here's our conversation history:
-
-    <conversation_history>
-    {history_text if history_text else "This is the start of our conversation."}
-    </conversation_history>
-
-    <current_question>
-    {query}
-    </current_question>
-
-    Note: I searched the user's personal document collection but didn't find relevant information for this question, so please answer based on your general knowledge. If appropriate, acknowledge that this information comes from your training rather than their specific documents.
-
-    Answer:"""
+            request = self.context_builder.general_knowledge(query, conversation_history)
             
             try:
-                response = self.client.messages.create(
-                    model="claude-3-5-haiku-20241022",
-                    max_tokens=max_tokens,
-                    temperature=0.7,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                )
+                response = self._create(request, max_tokens)
                 
                 return response.content[0].text
-                
+            
             except Exception as e:
-                return f"Error generating hybrid response: {str(e)}"
\ No newline at end of file
+                return f"Error generating hybrid response: {str(e)}"
+    
+    @staticmethod
+    def has_relevant_docs(retrieved_chunks, relevance_threshold=0.7):
+        """Whether any retrieved chunk is close enough to answer from documents"""
+        return bool(
+            retrieved_chunks['documents'] and 
+            len(retrieved_chunks['distances']) > 0 and 
+            min(retrieved_chunks['distances']) < relevance_threshold
+        )
+    
+    # Streaming variants: yield text deltas as Claude generates them
+    def stream_conversational_response(self, query, retrieved_chunks, conversation_history, max_tokens=600):
+        """Streaming generate_conversational_response"""
+        request = self.context_builder.conversational(query, retrieved_chunks, conversation_history)
+        yield from self._stream(request, max_tokens, "Error generating conversational response")
+    
+    def stream_hybrid_response(self, query, retrieved_chunks, conversation_history, relevance_threshold=0.7, max_tokens=600):
+        """Streaming generate_hybrid_response"""
+        if self.has_relevant_docs(retrieved_chunks, relevance_threshold):
+            yield from self.stream_conversational_response(query, retrieved_chunks, conversation_history, max_tokens)
+        else:
+            request = self.context_builder.general_knowledge(query, conversation_history)
+            yield from self._stream(request, max_tokens, "Error generating hybrid response")
+    
+    def stream_simple_response(self, query, max_tokens=300):
+        """Streaming generate_simple_response"""
+        yield from self._stream(self._simple_request(query), max_tokens, "Error generating response")
+    
+    async def astream_conversational_response(self, query, retrieved_chunks, conversation_history, max_tokens=600):
+        """Async streaming generate_conversational_response"""
+        request = self.context_builder.conversational(query, retrieved_chunks, conversation_history)
+        try:
+            with metrics.span('generate'):
+                start = time.perf_counter()
+                async with self.async_client.messages.stream(**self._request_kwargs(request, max_tokens)) as stream:
+                    async for text in stream.text_stream:
+                        if start is not None:
+                            metrics.observe('rag_stage_seconds', time.perf_counter() - start, stage='first_token')
+                            start = None
+                        yield text
+                    self._record_usage(await stream.get_final_message())
+        
+        except Exception as e:
+            yield f"Error generating conversational response: {str(e)}"
+    
+    def _stream(self, request, max_tokens, error_prefix):
+        """Stream a completion for a request, yielding text deltas"""
+        try:
+            with metrics.span('generate'):
+                start = time.perf_counter()
+                with self.client.messages.stream(**self._request_kwargs(request, max_tokens)) as stream:
+                    for text in stream.text_stream:
+                        if start is not None:
+                            metrics.observe('rag_stage_seconds', time.perf_counter() - start, stage='first_token')
+                            start = None
+                        yield text
+                    self._record_usage(stream.get_final_message())
+        
+        except Exception as e:
+            yield f"{error_prefix}: {str(e)}"
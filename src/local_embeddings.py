@@ -0,0 +1,158 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Texts per forward pass for each device; larger batches only pay off with a GPU
+DEFAULT_BATCH_SIZES = {'cpu': 32, 'mps': 64, 'cuda': 128}
+
+
+def pick_device():
+    """"cuda" or "mps" when torch can use them, otherwise "cpu" """
+    import torch
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+class LocalEmbeddingEngine:
+    """SentenceTransformer encoding tuned for throughput
+
+    - Inputs are sorted by length so each batch pads to similar lengths, and
+      results are returned in input order as normalized float32 arrays.
+    - Large inputs can be spread over several CPU processes.
+    - Concurrent single-text requests (encode_one / aencode_one) are gathered
+      into one forward pass by a background worker.
+
+    Settings default to LOCAL_EMBEDDING_DEVICE, LOCAL_EMBEDDING_BATCH_SIZE and
+    LOCAL_EMBEDDING_PROCESSES from the environment.
+    """
+    
+    def __init__(self, model_name="all-MiniLM-L6-v2", device=None, batch_size=None, processes=None,
+                 micro_batch_wait=0.002, max_micro_batch=64):
+        self.model_name = model_name
+        self.device = device or os.getenv("LOCAL_EMBEDDING_DEVICE")
+        self.batch_size = batch_size or int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "0")) or None
+        self.processes = processes or int(os.getenv("LOCAL_EMBEDDING_PROCESSES", "1"))
+        # Smaller inputs aren't worth the inter-process transfer
+        self.min_multi_process_texts = 1000
+        
+        # How long the micro-batch worker waits for more requests after the first
+        self.micro_batch_wait = micro_batch_wait
+        self.max_micro_batch = max_micro_batch
+        
+        self._model = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._worker = None
+    
+    @property
+    def model(self):
+        """SentenceTransformer, loaded on first use"""
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                if self.device is None:
+                    self.device = pick_device()
+                if self.batch_size is None:
+                    self.batch_size = DEFAULT_BATCH_SIZES.get(self.device, 32)
+                # Load local embedding model
+                print(f"Loading local embedding model on {self.device}...")
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+    
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+    
+    def encode(self, texts, batch_size=None):
+        """Embed texts, returning an (n, dim) float32 array of unit vectors
+
+        batch_size overrides the engine's texts per forward pass.
+        """
+        model = self.model
+        batch_size = batch_size or self.batch_size
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        if self.processes > 1 and self.device == "cpu" and len(texts) >= self.min_multi_process_texts:
+            return self._encode_multi_process(texts, batch_size)
+        
+        # Longest first: similar lengths share a batch, so little padding is computed
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = model.encode(
+                [texts[i] for i in rows],
+                batch_size=len(rows),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        return embeddings
+    
+    def _encode_multi_process(self, texts, batch_size):
+        with self._lock:
+            if self._pool is None:
+                print(f"Starting {self.processes} local embedding processes...")
+                self._pool = self._model.start_multi_process_pool(["cpu"] * self.processes)
+        
+        # The pool sorts by length within each chunk sent to a worker
+        embeddings = self._model.encode_multi_process(
+            texts, self._pool, batch_size=batch_size, normalize_embeddings=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+    
+    def encode_one(self, text):
+        """Embed one text, sharing a forward pass with concurrent callers"""
+        return self._submit(text).result()
+    
+    async def aencode_one(self, text):
+        """Async encode_one; the event loop is not blocked while waiting"""
+        return await asyncio.wrap_future(self._submit(text))
+    
+    def _submit(self, text):
+        future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._micro_batch_loop, daemon=True)
+                self._worker.start()
+        self._requests.put((text, future))
+        return future
+    
+    def _micro_batch_loop(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.micro_batch_wait
+            while len(batch) < self.max_micro_batch:
+                try:
+                    batch.append(self._requests.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            
+            try:
+                embeddings = self.encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+    
+    def close(self):
+        """Stop the multi-process pool, if one was started"""
+        with self._lock:
+            if self._pool is not None:
+                self._model.stop_multi_process_pool(self._pool)
+                self._pool = None
@@ -0,0 +1,248 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Upper bounds for token counts and batch sizes
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000)
+
+HELP = {
+    'rag_stage_seconds': "Time spent in each pipeline stage",
+    'rag_stage_errors_total': "Pipeline stage calls that raised",
+    'rag_tokens': "Tokens per Claude or embeddings request",
+    'rag_embedding_batch_size': "Texts per embedding call (after cache hits are removed)",
+    'rag_cache_requests_total': "Embedding and answer cache lookups",
+    'rag_embedding_retries_total': "Retried embeddings requests by status",
+    'rag_ingest_files_total': "Files processed by the ingestion pipeline",
+    'rag_ingest_chunks_total': "Chunks written by the ingestion pipeline",
+    'rag_ingest_duplicate_chunks_total': "Near-duplicate chunks linked instead of embedded"
+}
+
+
+class Histogram:
+    """Fixed-bucket histogram: count, sum and a count per bucket"""
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One extra bucket for values above the last bound (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def quantile(self, q):
+        """Estimated q-quantile, interpolated within its bucket (None when empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Thread-safe counters and histograms keyed by metric name and labels
+
+    Recording costs a lock and a bisect, so spans can wrap every call.
+    Worker processes record into their own registry; collect() hands what
+    they recorded back to the parent, which merge()s it.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, ((label, value), ...)) -> value / Histogram
+        self._counters = {}
+        self._histograms = {}
+    
+    def inc(self, name, value=1, **labels):
+        """Add to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Record a value in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+    
+    @contextmanager
+    def span(self, stage):
+        """Time the enclosed block as a pipeline stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('rag_stage_errors_total', stage=stage)
+            raise
+        finally:
+            self.observe('rag_stage_seconds', time.perf_counter() - start, stage=stage)
+    
+    def collect(self):
+        """Everything recorded so far as plain data, resetting the registry"""
+        with self._lock:
+            state = {
+                'counters': list(self._counters.items()),
+                'histograms': [(key, h.buckets, h.counts, h.count, h.sum) for key, h in self._histograms.items()]
+            }
+            self._counters = {}
+            self._histograms = {}
+        return state
+    
+    def merge(self, state):
+        """Add counts from collect() (e.g. recorded in a worker process)"""
+        with self._lock:
+            for key, value in state['counters']:
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, buckets, counts, count, total in state['histograms']:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+    
+    def reset(self):
+        """Drop everything recorded"""
+        self.collect()
+    
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, h.buckets, list(h.counts), h.count, h.sum) for key, h in self._histograms.items()),
+                key=lambda item: item[0]
+            )
+        
+        lines = []
+        declared = set()
+        
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        
+        for (name, labels), buckets, counts, count, total in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+    
+    def to_dict(self):
+        """Counters and histograms (with p50/p95/p99 estimates) as JSON-ready data"""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': h.count,
+                    'sum': h.sum,
+                    'p50': h.quantile(0.5),
+                    'p95': h.quantile(0.95),
+                    'p99': h.quantile(0.99),
+                    'buckets': dict(zip([str(bound) for bound in h.buckets] + ['+Inf'], h.counts))
+                }
+                for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+        return {'counters': counters, 'histograms': histograms}
+    
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+    
+    def summary(self):
+        """Per-stage latency, token counts and cache hit rates"""
+        data = self.to_dict()
+        counter = {(c['name'], tuple(sorted(c['labels'].items()))): c['value'] for c in data['counters']}
+        
+        stages = {}
+        tokens = {}
+        for h in data['histograms']:
+            if h['name'] == 'rag_stage_seconds':
+                stage = h['labels']['stage']
+                stages[stage] = {
+                    'count': h['count'],
+                    'mean_ms': h['sum'] / h['count'] * 1000,
+                    'p50_ms': h['p50'] * 1000,
+                    'p95_ms': h['p95'] * 1000,
+                    'errors': counter.get(('rag_stage_errors_total', (('stage', stage),)), 0)
+                }
+            elif h['name'] == 'rag_tokens':
+                tokens[h['labels']['kind']] = {'requests': h['count'], 'total': int(h['sum'])}
+        
+        cache_hit_rate = {}
+        for cache in ('embedding', 'answer'):
+            hits = counter.get(('rag_cache_requests_total', (('cache', cache), ('result', 'hit'))), 0)
+            misses = counter.get(('rag_cache_requests_total', (('cache', cache), ('result', 'miss'))), 0)
+            if hits + misses:
+                cache_hit_rate[cache] = hits / (hits + misses)
+        
+        return {'stages': stages, 'tokens': tokens, 'cache_hit_rate': cache_hit_rate}
+    
+    def summary_text(self):
+        """summary() as a few readable lines"""
+        summary = self.summary()
+        if not summary['stages']:
+            return "No pipeline activity recorded yet"
+        lines = ["Stage latency (count, mean, p50, p95):"]
+        for stage, s in sorted(summary['stages'].items()):
+            errors = f", {s['errors']} errors" if s['errors'] else ""
+            lines.append(f"  {stage}: {s['count']}, {s['mean_ms']:.1f} ms, {s['p50_ms']:.1f} ms, "
+                         f"{s['p95_ms']:.1f} ms{errors}")
+        if summary['tokens']:
+            lines.append("Tokens:")
+            for kind, t in sorted(summary['tokens'].items()):
+                lines.append(f"  {kind}: {t['total']} over {t['requests']} requests")
+        if summary['cache_hit_rate']:
+            lines.append("Cache hit rate:")
+            for cache, rate in sorted(summary['cache_hit_rate'].items()):
+                lines.append(f"  {cache}: {rate:.0%}")
+        return '\n'.join(lines)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry shared by the pipeline modules
+metrics = Metrics()
@@ -0,0 +1,197 @@
+import numpy as np
+
+# Rows scored per block so temporaries stay small for large collections
+_BLOCK = 65536
+
+
+def nearest_centroids(vectors, centroids):
+    """Index of the nearest centroid (squared L2) for each vector"""
+    scores = vectors @ centroids.T
+    scores *= -2
+    scores += np.einsum('ij,ij->i', centroids, centroids)
+    return np.argmin(scores, axis=1).astype(np.int32)
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Plain Lloyd's k-means, returning float32 centroids"""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=len(vectors) < n_clusters)].copy()
+    
+    for _ in range(iterations):
+        labels = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class Float16Quantizer:
+    """Half-precision copies of the vectors (2 bytes per dimension)"""
+    
+    mode = "float16"
+    min_training_vectors = 0
+    
+    def __init__(self, dim):
+        self.dim = dim
+        self.code_size = dim
+        self.code_dtype = np.float16
+        self.trained = True
+    
+    def train(self, sample):
+        pass
+    
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+    
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+    
+    def distances(self, query, codes, norms):
+        """Approximate squared L2 from query to each coded vector"""
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK):
+            dots[start:start + _BLOCK] = codes[start:start + _BLOCK].astype(np.float32) @ query
+        return norms - 2 * dots + float(query @ query)
+    
+    def state(self):
+        return {}
+    
+    def load_state(self, state):
+        pass
+
+
+class Int8Quantizer:
+    """Per-dimension scalar quantization to 256 levels (1 byte per dimension)"""
+    
+    mode = "int8"
+    min_training_vectors = 256
+    
+    def __init__(self, dim):
+        self.dim = dim
+        self.code_size = dim
+        self.code_dtype = np.uint8
+        self.trained = False
+    
+    def train(self, sample):
+        sample = np.asarray(sample, dtype=np.float32)
+        self.low = sample.min(axis=0)
+        span = sample.max(axis=0) - self.low
+        self.scale = np.where(span > 0, span / 255, 1).astype(np.float32)
+        self.trained = True
+    
+    def encode(self, vectors):
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+    
+    def decode(self, codes):
+        return self.low + np.asarray(codes, dtype=np.float32) * self.scale
+    
+    def distances(self, query, codes, norms):
+        # q . x_hat = q . low + (q * scale) . code
+        offset = float(query @ self.low)
+        scaled = query * self.scale
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK):
+            dots[start:start + _BLOCK] = codes[start:start + _BLOCK].astype(np.float32) @ scaled
+        return norms - 2 * (dots + offset) + float(query @ query)
+    
+    def state(self):
+        return {'low': self.low, 'scale': self.scale}
+    
+    def load_state(self, state):
+        self.low = state['low']
+        self.scale = state['scale']
+        self.trained = True
+
+
+class ProductQuantizer:
+    """Product quantization: each of n_subvectors slices is coded as one of 256 centroids
+
+    A 1536-dim embedding with 192 subvectors takes 192 bytes instead of 6 KB.
+    Distances are computed asymmetrically from a per-query lookup table.
+    """
+    
+    mode = "pq"
+    min_training_vectors = 256
+    
+    def __init__(self, dim, n_subvectors=None):
+        if n_subvectors is None:
+            # ~8 dimensions per subvector, rounded to a divisor of dim
+            n_subvectors = max(1, dim // 8)
+            while dim % n_subvectors:
+                n_subvectors -= 1
+        if dim % n_subvectors:
+            raise ValueError(f"n_subvectors ({n_subvectors}) must divide the dimension ({dim})")
+        self.dim = dim
+        self.n_subvectors = n_subvectors
+        self.sub_dim = dim // n_subvectors
+        self.code_size = n_subvectors
+        self.code_dtype = np.uint8
+        self.trained = False
+    
+    def train(self, sample):
+        sample = np.asarray(sample, dtype=np.float32)
+        self.codebooks = np.stack([
+            kmeans(self._slice(sample, j), 256, seed=j) for j in range(self.n_subvectors)
+        ])
+        self.trained = True
+    
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for j in range(self.n_subvectors):
+            codes[:, j] = nearest_centroids(self._slice(vectors, j), self.codebooks[j])
+        return codes
+    
+    def decode(self, codes):
+        """Concatenated centroids of each code, shape (len(codes), dim)"""
+        codes = np.asarray(codes)
+        return self.codebooks[np.arange(self.n_subvectors), codes].reshape(len(codes), self.dim)
+    
+    def distances(self, query, codes, norms):
+        # table[j, c] = ||q_j - codebook[j, c]||^2
+        diff = self.codebooks - query.reshape(self.n_subvectors, 1, self.sub_dim)
+        table = np.einsum('jcd,jcd->jc', diff, diff)
+        distances = np.empty(len(codes), dtype=np.float32)
+        columns = np.arange(self.n_subvectors)
+        for start in range(0, len(codes), _BLOCK):
+            block = codes[start:start + _BLOCK]
+            distances[start:start + len(block)] = table[columns, block].sum(axis=1)
+        return distances
+    
+    def state(self):
+        return {'codebooks': self.codebooks}
+    
+    def load_state(self, state):
+        self.codebooks = state['codebooks']
+        self.trained = True
+    
+    def _slice(self, vectors, j):
+        return vectors[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+
+
+QUANTIZERS = {
+    'float16': Float16Quantizer,
+    'int8': Int8Quantizer,
+    'pq': ProductQuantizer
+}
+
+
+def make_quantizer(mode, dim, **options):
+    """Quantizer for a storage mode ("float16", "int8" or "pq")"""
+    if mode not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    return QUANTIZERS[mode](dim, **options)
+
+
+def recall_at_k(approximate, exact):
+    """Mean fraction of each exact top-k list found in the approximate one"""
+    if not exact:
+        return 1.0
+    return float(np.mean([
+        len(set(found) & set(truth)) / len(truth) if truth else 1.0
+        for found, truth in zip(approximate, exact)
+    ]))
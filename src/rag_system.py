@@ -1,144 +1,955 @@
 import sys
 import os
 import json
+import asyncio
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from src.document_processor import DocumentProcessor
 from src.embeddings import EmbeddingService
+from src.embedding_cache import EmbeddingCache
+from src.embedding_dispatcher import MAX_INPUTS_PER_REQUEST
 from src.vector_store import VectorStore
+from src.vector_backends import backend_data_directory
 from src.llm_service import LLMService
+from src.ingest_manifest import IngestManifest, file_hash
+from src.chunk_dedup import ChunkDeduplicator
+from src.ingestion_pipeline import IngestionPipeline, start_pool
+from src.ingest_jobs import IngestJobManager, IngestCancelled
+from src.file_watcher import DocumentWatcher
+from src.session_store import SessionStore
+from src.answer_cache import AnswerCache, is_follow_up
+from src.reranker import CrossEncoderReranker
+from src.metrics import metrics
+from src.context_builder import fit_to_budget
 
 class ConversationalRAGSystem:
-    def __init__(self, embedding_provider="openai"):
+    def __init__(self, embedding_provider="openai", max_concurrent_queries=8, persist_sessions=False,
+                 vector_backend=None, vector_quantization=None, rerank=None, dedup=None):
         print("Initializing Conversational Claude RAG System...")
         self.doc_processor = DocumentProcessor()
-        self.embedding_service = EmbeddingService(provider=embedding_provider)
-        self.vector_store = VectorStore()
-        self.llm_service = LLMService()
+        self.persist_directory = "./chroma_db"
+        self.embedding_provider = embedding_provider
+        # "chroma" (default) or "ann"; also settable with VECTOR_BACKEND in .env.
+        # The ann backend can keep float16/int8/pq codes (VECTOR_QUANTIZATION),
+        # and with VECTOR_KEEP_FULL_VECTORS=0 drop the float32 copy they rescore from.
+        self.vector_backend = vector_backend or os.getenv("VECTOR_BACKEND", "chroma")
+        self.vector_quantization = vector_quantization or os.getenv("VECTOR_QUANTIZATION")
+        self.keep_full_vectors = os.getenv("VECTOR_KEEP_FULL_VECTORS", "1") != "0"
         
-        # NEW: Conversation management
-        self.conversation_history = []
+        # The vector store and the embedding/LLM services are built on first
+        # use (or by warm_up) so constructing the system stays fast
+        self._vector_store = None
+        self._embedding_service = None
+        self._llm_service = None
+        # Reentrant: building the vector store also builds the dedup index
+        self._init_lock = threading.RLock()
+        
+        # Each backend has its own contents, so its own manifest
+        self.data_directory = backend_data_directory(self.vector_backend, self.persist_directory)
+        self.manifest = IngestManifest(os.path.join(self.data_directory, "ingest_manifest.json"))
+        
+        # Near-duplicate chunks (e.g. a PDF exported from a DOCX that is also
+        # ingested) are linked to the first copy instead of being embedded
+        # again, and cited alongside it. DEDUP_CHUNKS=0 in .env turns this off.
+        if dedup is None:
+            dedup = os.getenv("DEDUP_CHUNKS", "1") != "0"
+        self.dedup = dedup
+        self._chunk_dedup = None
+        
+        # Ingestion pipeline settings (None = one extraction process per core)
+        self.ingest_workers = None
+        # Chunks per local-model call; OpenAI batches are packed to the
+        # dispatcher's token budget instead
+        self.embed_batch_size = 100
+        # PDFs longer than this are extracted as page ranges on several workers.
+        # Per-file size and time limits live on doc_processor (max_file_size,
+        # max_text_chars, file_timeout); files that exceed them are skipped.
+        self.pdf_pages_per_task = 50
+        # Extraction workers are started once and reused by every ingest run
+        self._ingest_pool = None
+        self._ingest_pool_size = None
+        # Background ingestion (ingest_async / job_status / cancel_job)
+        self.ingest_jobs = IngestJobManager(self._run_ingest_job)
+        # Directory -> DocumentWatcher (see watch)
+        self.watchers = {}
+        
+        # Hybrid retrieval: BM25 and vector search run concurrently and are
+        # fused with reciprocal-rank fusion over hybrid_candidates from each
+        self.hybrid_search = True
+        self.hybrid_candidates = 20
+        self._lexical_pool = ThreadPoolExecutor(max_workers=max_concurrent_queries)
+        
+        # Optional cross-encoder rerank (also RERANK=1 in .env): rerank_candidates
+        # are retrieved and only the best n_results reach Claude. Scoring that
+        # misses reranker.deadline falls back to retrieval order.
+        if rerank is None:
+            rerank = os.getenv("RERANK", "0") == "1"
+        self.reranker = CrossEncoderReranker() if rerank else None
+        self.rerank_candidates = 50
+        
+        # Answers reused for near-duplicate questions over the same chunks
+        self.answer_cache = AnswerCache()
+        
+        # Limits how many aquery calls run at once (embedding + Chroma + Claude)
+        self._query_semaphore = asyncio.Semaphore(max_concurrent_queries)
+        
+        # NEW: Conversation management, one history per session id
         self.max_history_length = 10  # Keep last 10 exchanges
+        self.sessions = SessionStore(
+            max_history_length=self.max_history_length,
+            db_path=os.path.join(self.persist_directory, "sessions.sqlite") if persist_sessions else None
+        )
         
         print("System initialized successfully!")
     
-    def query(self, question, n_results=5, session_id="default"):
-        """Query with conversation memory"""
-        print(f"Processing conversational query: {question}")
+    @property
+    def vector_store(self):
+        if self._vector_store is None:
+            with self._init_lock:
+                if self._vector_store is None:
+                    options = None
+                    if self.vector_quantization:
+                        options = {'quantization': self.vector_quantization,
+                                   'keep_full_vectors': self.keep_full_vectors}
+                    store = VectorStore(self.persist_directory, self.vector_backend, options)
+                    # Filters then also match chunks through their linked near-duplicates
+                    store.deduplicator = self.chunk_dedup
+                    self._vector_store = store
+        return self._vector_store
+    
+    @vector_store.setter
+    def vector_store(self, store):
+        self._vector_store = store
+    
+    @property
+    def chunk_dedup(self):
+        """Near-duplicate index, or None with dedup off"""
+        if self.dedup and self._chunk_dedup is None:
+            with self._init_lock:
+                if self._chunk_dedup is None:
+                    self._chunk_dedup = ChunkDeduplicator(os.path.join(self.data_directory, "chunk_dedup.sqlite"))
+        return self._chunk_dedup
+    
+    @property
+    def embedding_service(self):
+        if self._embedding_service is None:
+            with self._init_lock:
+                if self._embedding_service is None:
+                    self._embedding_service = EmbeddingService(
+                        provider=self.embedding_provider,
+                        cache=EmbeddingCache(os.path.join(self.persist_directory, "embedding_cache.sqlite"))
+                    )
+        return self._embedding_service
+    
+    @embedding_service.setter
+    def embedding_service(self, service):
+        self._embedding_service = service
+    
+    @property
+    def llm_service(self):
+        if self._llm_service is None:
+            with self._init_lock:
+                if self._llm_service is None:
+                    self._llm_service = LLMService()
+        return self._llm_service
+    
+    @llm_service.setter
+    def llm_service(self, service):
+        self._llm_service = service
+    
+    def warm_up(self):
+        """Load the vector store, API clients and any local model ahead of the first query"""
+        self.vector_store
+        self.embedding_service.warm_up()
+        self.llm_service.warm_up()
+        if self.reranker is not None:
+            self.reranker.warm_up()
+        print("RAG system warmed up")
+    
+    @property
+    def conversation_history(self):
+        """History of the default session"""
+        return self.sessions.get_history("default")
+    
+    def query(self, question, n_results=5, session_id="default", filters=None):
+        """Query with conversation memory
         
-        # Retrieve relevant documents
-        results = self.vector_store.query(question, self.embedding_service, n_results)
+        `filters` restricts retrieval to matching chunks (see build_where).
+        """
+        print(f"Processing conversational query: {question}")
         
-        if not results['documents']:
-            response = "No relevant documents found in the database. Please add some documents first."
-        else:
-            print(f"Found {len(results['documents'])} relevant chunks")
+        with self.sessions.lock(session_id):
+            # Retrieve relevant documents
+            query_embedding, results = self._retrieve(question, n_results, self.build_where(filters))
             
-            # Generate response with conversation history
-            response = self.llm_service.generate_conversational_response(
-                question, 
-                results, 
-                self.conversation_history
-            )
+            if not results['documents']:
+                response = "No relevant documents found in the database. Please add some documents first."
+            else:
+                print(f"Found {len(results['documents'])} relevant chunks")
+                
+                history = self.sessions.get_history(session_id)
+                response = self._cached_answer("conversational", question, query_embedding, results, history)
+                if response is None:
+                    # Generate response with conversation history
+                    response = self.llm_service.generate_conversational_response(
+                        question, 
+                        results, 
+                        history
+                    )
+                    self._cache_answer("conversational", question, query_embedding, results, history, response)
+            
+            # Store conversation exchange
+            turn = self._add_to_history(question, response, session_id)
         
-        # Store conversation exchange
-        self._add_to_history(question, response)
+        return self._query_result(response, results, turn)
+    
+    async def aquery(self, question, n_results=5, session_id="default", filters=None):
+        """Async query: embedding and Claude calls are awaited, Chroma runs on a worker thread
         
+        At most max_concurrent_queries run at once; others wait their turn.
+        """
+        async with self.sessions.async_lock(session_id), self._query_semaphore:
+            print(f"Processing conversational query: {question}")
+            
+            query_embedding, results = await self._aretrieve(question, n_results, self.build_where(filters))
+            
+            if not results['documents']:
+                response = "No relevant documents found in the database. Please add some documents first."
+            else:
+                print(f"Found {len(results['documents'])} relevant chunks")
+                
+                history = self.sessions.get_history(session_id)
+                response = await asyncio.to_thread(
+                    self._cached_answer, "conversational", question, query_embedding, results, history
+                )
+                if response is None:
+                    llm_service = await self._allm_service()
+                    response = await llm_service.agenerate_conversational_response(
+                        question, 
+                        results, 
+                        history
+                    )
+                    await asyncio.to_thread(
+                        self._cache_answer, "conversational", question, query_embedding, results, history, response
+                    )
+            
+            turn = self._add_to_history(question, response, session_id)
+            
+            return self._query_result(response, results, turn)
+    
+    def _query_result(self, response, results, conversation_turn):
+        """Shape a query response for callers"""
         return {
             'answer': response,
             'sources': results['metadatas'] if results['documents'] else [],
             'retrieved_chunks': results['documents'] if results['documents'] else [],
             'similarity_scores': results['distances'] if results['documents'] else [],
-            'conversation_turn': len(self.conversation_history)
+            'conversation_turn': conversation_turn
         }
     
-    def query_hybrid(self, question, n_results=5, relevance_threshold=0.7):
-        """Query with hybrid document/general knowledge mode"""
-        print(f"Processing hybrid query: {question}")
+    def retrieve(self, question, n_results=5, filters=None, max_tokens=None, max_chars=None):
+        """Ranked chunks for a question, without calling Claude
         
-        # Always try to retrieve relevant documents first
-        results = self.vector_store.query(question, self.embedding_service, n_results)
+        For clients that do their own synthesis. Chunks are returned in rank
+        order until max_tokens / max_chars of chunk text is used; the chunk
+        that crosses the budget is cut short and marked 'truncated'. Each
+        result carries its id, text, distance, fusion/rerank score when
+        available and the chunk's metadata (source, file_path, offsets, page).
+        """
+        _, results = self._retrieve(question, n_results, self.build_where(filters))
+        return self._retrieval_result(question, results, max_tokens, max_chars)
+    
+    async def aretrieve(self, question, n_results=5, filters=None, max_tokens=None, max_chars=None):
+        """Async retrieve (shares max_concurrent_queries with aquery)"""
+        async with self._query_semaphore:
+            _, results = await self._aretrieve(question, n_results, self.build_where(filters))
+        return self._retrieval_result(question, results, max_tokens, max_chars)
+    
+    @staticmethod
+    def _retrieval_result(question, results, max_tokens, max_chars):
+        """Structured retrieve() output for results trimmed to the budget"""
+        texts, truncated = fit_to_budget(results['documents'], max_tokens, max_chars)
+        scores = {
+            key: results[key] for key in ('rrf_scores', 'rerank_scores') if key in results
+        }
+        chunks = []
+        for i, text in enumerate(texts):
+            chunk = {
+                'rank': i + 1,
+                'id': results['ids'][i],
+                'text': text,
+                'distance': results['distances'][i],
+                **results['metadatas'][i]
+            }
+            for key, values in scores.items():
+                chunk[key[:-1]] = values[i]
+            if len(text) < len(results['documents'][i]):
+                chunk['truncated'] = True
+            chunks.append(chunk)
+        return {
+            'question': question,
+            'results': chunks,
+            'total_chars': sum(len(chunk['text']) for chunk in chunks),
+            'truncated': truncated
+        }
+    
+    def query_batch(self, questions, n_results=5, filters=None):
+        """Retrieve chunks for many questions at once, without calling Claude
+        
+        The questions are embedded in one batched call and searched with one
+        vectorized top-k; with hybrid_search on, their BM25 searches run on
+        the lexical pool in the meantime. Returns one dict per question with
+        'question', 'ids', 'sources', 'retrieved_chunks' and 'similarity_scores'.
+        """
+        if not questions:
+            return []
+        where = self.build_where(filters)
+        
+        with metrics.span('retrieve_batch'):
+            fetch = self._fetch_count(n_results)
+            candidates = max(fetch, self.hybrid_candidates) if self.hybrid_search else fetch
+            lexical = [
+                self._lexical_pool.submit(self.vector_store.lexical_query, question, candidates, where)
+                for question in questions
+            ] if self.hybrid_search else None
+            
+            query_embeddings = self.embedding_service.get_embeddings_batch(list(questions))
+            vector_results = self.vector_store.query_by_embeddings(query_embeddings, candidates, where)
+            
+            batch = []
+            for i, question in enumerate(questions):
+                results = vector_results[i]
+                if lexical is not None:
+                    results = self.vector_store.fuse_results(
+                        query_embeddings[i], results, lexical[i].result(), fetch
+                    )
+                results = self._rerank(question, results, n_results)
+                batch.append({
+                    'question': question,
+                    'ids': results['ids'],
+                    'sources': results['metadatas'],
+                    'retrieved_chunks': results['documents'],
+                    'similarity_scores': results['distances']
+                })
+            return batch
+    
+    def _retrieve(self, question, n_results, where=None):
+        """Embed a question and fetch its best chunks; returns (embedding, results)
+        
+        With hybrid_search on, BM25 runs on a worker thread while the question
+        is embedded and searched, and the two rankings are fused. With a
+        reranker, rerank_candidates are fetched and reranked down to n_results.
+        A `where` filter is applied inside both searches, before ranking.
+        """
+        with metrics.span('retrieve'):
+            fetch = self._fetch_count(n_results)
+            if not self.hybrid_search:
+                query_embedding = self.embedding_service.get_embedding(question)
+                results = self.vector_store.query_by_embedding(query_embedding, fetch, where)
+                return query_embedding, self._rerank(question, results, n_results)
+            
+            candidates = max(fetch, self.hybrid_candidates)
+            lexical = self._lexical_pool.submit(self.vector_store.lexical_query, question, candidates, where)
+            query_embedding = self.embedding_service.get_embedding(question)
+            vector_results = self.vector_store.query_by_embedding(query_embedding, candidates, where)
+            results = self.vector_store.fuse_results(query_embedding, vector_results, lexical.result(), fetch)
+            return query_embedding, self._rerank(question, results, n_results)
+    
+    async def _aretrieve(self, question, n_results, where=None):
+        """Async _retrieve: Chroma, BM25 and rerank work runs on worker threads"""
+        vector_store, embedding_service = await self._aretrieval_services()
+        with metrics.span('retrieve'):
+            fetch = self._fetch_count(n_results)
+            if not self.hybrid_search:
+                query_embedding = await embedding_service.aget_embedding(question)
+                results = await asyncio.to_thread(
+                    vector_store.query_by_embedding, query_embedding, fetch, where
+                )
+                return query_embedding, await asyncio.to_thread(self._rerank, question, results, n_results)
+            
+            candidates = max(fetch, self.hybrid_candidates)
+            loop = asyncio.get_running_loop()
+            lexical = loop.run_in_executor(self._lexical_pool, vector_store.lexical_query,
+                                           question, candidates, where)
+            query_embedding = await embedding_service.aget_embedding(question)
+            vector_results = await asyncio.to_thread(
+                vector_store.query_by_embedding, query_embedding, candidates, where
+            )
+            results = await asyncio.to_thread(
+                vector_store.fuse_results, query_embedding, vector_results, await lexical, fetch
+            )
+            return query_embedding, await asyncio.to_thread(self._rerank, question, results, n_results)
+    
+    async def _aretrieval_services(self):
+        """(vector_store, embedding_service), built on a worker thread
+        
+        The first use opens the vector store and creates the API client (or
+        loads the local model), which must not stall the event loop.
+        """
+        def build():
+            embedding_service = self.embedding_service
+            if embedding_service.provider == "openai":
+                embedding_service.async_client
+            return self.vector_store, embedding_service
+        return await asyncio.to_thread(build)
+    
+    async def _allm_service(self):
+        """llm_service with its async client, built on a worker thread"""
+        def build():
+            llm_service = self.llm_service
+            llm_service.async_client
+            return llm_service
+        return await asyncio.to_thread(build)
+    
+    def build_where(self, filters):
+        """Turn query filters into a vector store where clause (None for no filter)
         
-        # Use hybrid response generation
-        response = self.llm_service.generate_hybrid_response(
-            question, 
-            results, 
-            self.conversation_history,
-            relevance_threshold
+        Keys: source, file_path, extension, directory (includes its
+        subdirectories), page, modified_after and modified_before (epoch
+        seconds or ISO dates). A list value matches any of its items and a
+        dict is passed through as a raw operator clause.
+        """
+        if not filters:
+            return None
+        
+        clauses = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key in ('modified_after', 'modified_before'):
+                op = '$gte' if key == 'modified_after' else '$lte'
+                clauses.append({'mtime': {op: _timestamp(value)}})
+                continue
+            if key == 'extension':
+                value = ([_normalize_extension(item) for item in value] if isinstance(value, list)
+                         else _normalize_extension(value))
+            elif key == 'directory':
+                value = self._directories_under(value if isinstance(value, list) else [value])
+            elif key not in ('source', 'file_path', 'page'):
+                raise ValueError(f"Unknown filter: {key}")
+            if isinstance(value, list):
+                value = {'$in': value}
+            clauses.append({key: value})
+        
+        if not clauses:
+            return None
+        # Chroma wants a single top-level operator when there are several conditions
+        return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+    
+    def _directories_under(self, directories):
+        """The given directories plus their ingested subdirectories"""
+        self.manifest.refresh()
+        found = set()
+        for directory in directories:
+            root = os.path.abspath(os.path.expanduser(directory))
+            found.add(root)
+            found.update(os.path.dirname(path) for path in self.manifest.files_under(root))
+        return sorted(found)
+    
+    def _fetch_count(self, n_results):
+        """How many chunks to retrieve before reranking"""
+        if self.reranker is None:
+            return n_results
+        return max(n_results, self.rerank_candidates)
+    
+    def _rerank(self, question, results, n_results):
+        """Last retrieval step: cross-encoder rerank (when enabled) and duplicate provenance"""
+        if self.reranker is not None:
+            with metrics.span('rerank'):
+                results = self.reranker.rerank(question, results, n_results)
+        return self._add_provenance(results)
+    
+    def _add_provenance(self, results):
+        """List the near-duplicates linked to each chunk in its metadata['duplicates']"""
+        if self.chunk_dedup is None or not results['ids']:
+            return results
+        duplicates = self.chunk_dedup.provenance(results['ids'])
+        if duplicates:
+            results['metadatas'] = [
+                {**metadata, 'duplicates': duplicates[chunk_id]} if chunk_id in duplicates else metadata
+                for chunk_id, metadata in zip(results['ids'], results['metadatas'])
+            ]
+        return results
+    
+    def _cached_answer(self, kind, question, query_embedding, results, history):
+        """Answer cached for a near-identical question over the same chunks (and history, for follow-ups), or None"""
+        answer = self.answer_cache.lookup(
+            kind, query_embedding, results['ids'], self.vector_store.version,
+            self._history_context(question, history)
         )
+        metrics.inc('rag_cache_requests_total', cache='answer', result='miss' if answer is None else 'hit')
+        if answer is not None:
+            print("Answer cache hit")
+        return answer
+    
+    def _cache_answer(self, kind, question, query_embedding, results, history, answer):
+        """Remember a generated answer (errors are not cached)"""
+        if answer and not answer.startswith("Error generating"):
+            self.answer_cache.store(
+                kind, query_embedding, results['ids'], self.vector_store.version, answer,
+                self._history_context(question, history)
+            )
+    
+    def _history_context(self, question, history):
+        """Answer cache context: the history text sent with a follow-up question, else ""
+        
+        Retrieval sees only the question, so a standalone question's answer
+        is keyed on the question and its chunks and is reused across a long
+        session; a follow-up leans on the conversation, so its answer is only
+        reused under the same history.
+        """
+        if not is_follow_up(question):
+            return ""
+        return self.llm_service.context_builder.history_text(history)
+    
+    def query_hybrid(self, question, n_results=5, relevance_threshold=0.7, session_id="default", filters=None):
+        """Query with hybrid document/general knowledge mode"""
+        print(f"Processing hybrid query: {question}")
+        
+        with self.sessions.lock(session_id):
+            # Always try to retrieve relevant documents first
+            query_embedding, results = self._retrieve(question, n_results, self.build_where(filters))
+            
+            kind = f"hybrid:{relevance_threshold}"
+            history = self.sessions.get_history(session_id)
+            response = self._cached_answer(kind, question, query_embedding, results, history)
+            if response is None:
+                # Use hybrid response generation
+                response = self.llm_service.generate_hybrid_response(
+                    question, 
+                    results, 
+                    history,
+                    relevance_threshold
+                )
+                self._cache_answer(kind, question, query_embedding, results, history, response)
+            
+            # Store conversation exchange
+            turn = self._add_to_history(question, response, session_id)
         
         # Determine response mode
-        has_relevant_docs = (
-            results['documents'] and 
-            len(results['distances']) > 0 and 
-            min(results['distances']) < relevance_threshold
-        )
+        has_relevant_docs = self.llm_service.has_relevant_docs(results, relevance_threshold)
         
         mode = "document_based" if has_relevant_docs else "general_knowledge"
         
-        # Store conversation exchange
-        self._add_to_history(question, response)
-        
         return {
             'answer': response,
             'sources': results['metadatas'] if has_relevant_docs else [],
             'retrieved_chunks': results['documents'] if has_relevant_docs else [],
             'similarity_scores': results['distances'] if has_relevant_docs else [],
             'mode': mode,
-            'conversation_turn': len(self.conversation_history)
+            'conversation_turn': turn
         }
     
-    def _add_to_history(self, question, response):
-        """Add exchange to conversation history"""
-        self.conversation_history.append({
-            'timestamp': datetime.now().isoformat(),
-            'question': question,
-            'response': response
-        })
+    def query_hybrid_stream(self, question, n_results=5, relevance_threshold=0.7, session_id="default",
+                            filters=None):
+        """Streaming query_hybrid
         
-        # Keep history manageable
-        if len(self.conversation_history) > self.max_history_length:
-            self.conversation_history = self.conversation_history[-self.max_history_length:]
+        Retrieval happens up front; the returned dict has the same keys as
+        query_hybrid except 'answer' is replaced by 'answer_stream', a generator
+        of text deltas. The stream holds the session lock from reading the
+        history until the exchange is added to it, once the stream is
+        exhausted; 'conversation_turn' is None until then.
+        """
+        print(f"Processing hybrid query: {question}")
+        
+        query_embedding, results = self._retrieve(question, n_results, self.build_where(filters))
+        has_relevant_docs = self.llm_service.has_relevant_docs(results, relevance_threshold)
+        kind = f"hybrid:{relevance_threshold}"
+        
+        def answer_stream():
+            with self.sessions.lock(session_id):
+                history = self.sessions.get_history(session_id)
+                response = self._cached_answer(kind, question, query_embedding, results, history)
+                if response is not None:
+                    yield response
+                else:
+                    parts = []
+                    for text in self.llm_service.stream_hybrid_response(
+                        question,
+                        results,
+                        history,
+                        relevance_threshold
+                    ):
+                        parts.append(text)
+                        yield text
+                    response = ''.join(parts)
+                    self._cache_answer(kind, question, query_embedding, results, history, response)
+                result['conversation_turn'] = self._add_to_history(question, response, session_id)
+        
+        result = {
+            'answer_stream': answer_stream(),
+            'sources': results['metadatas'] if has_relevant_docs else [],
+            'retrieved_chunks': results['documents'] if has_relevant_docs else [],
+            'similarity_scores': results['distances'] if has_relevant_docs else [],
+            'mode': "document_based" if has_relevant_docs else "general_knowledge",
+            'conversation_turn': None
+        }
+        return result
     
-    def clear_conversation(self):
+    async def aquery_stream(self, question, n_results=5, session_id="default", filters=None):
+        """Streaming aquery
+        
+        Returns the same keys as aquery except 'answer' is replaced by
+        'answer_stream', an async generator of text deltas. Retrieval and
+        generation each take a slot under max_concurrent_queries. As with
+        query_hybrid_stream, the stream holds the session lock from reading
+        the history until the exchange is added, and 'conversation_turn' is
+        None until the stream is exhausted.
+        """
+        async with self._query_semaphore:
+            print(f"Processing conversational query: {question}")
+            
+            query_embedding, results = await self._aretrieve(question, n_results, self.build_where(filters))
+        
+        async def answer_stream():
+            async with self.sessions.async_lock(session_id):
+                history = self.sessions.get_history(session_id)
+                cached = (await asyncio.to_thread(
+                    self._cached_answer, "conversational", question, query_embedding, results, history
+                ) if results['documents'] else None)
+                if not results['documents']:
+                    response = "No relevant documents found in the database. Please add some documents first."
+                    yield response
+                elif cached is not None:
+                    response = cached
+                    yield response
+                else:
+                    print(f"Found {len(results['documents'])} relevant chunks")
+                    parts = []
+                    llm_service = await self._allm_service()
+                    async with self._query_semaphore:
+                        async for text in llm_service.astream_conversational_response(
+                            question,
+                            results,
+                            history
+                        ):
+                            parts.append(text)
+                            yield text
+                    response = ''.join(parts)
+                    await asyncio.to_thread(
+                        self._cache_answer, "conversational", question, query_embedding, results, history, response
+                    )
+                
+                result['conversation_turn'] = self._add_to_history(question, response, session_id)
+        
+        result = self._query_result(None, results, None)
+        del result['answer']
+        result['answer_stream'] = answer_stream()
+        return result
+    
+    def _add_to_history(self, question, response, session_id="default"):
+        """Add exchange to a session's conversation history, returning its length"""
+        return self.sessions.append(session_id, question, response)
+    
+    def clear_conversation(self, session_id="default"):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.sessions.clear(session_id)
         print("Conversation history cleared")
     
-    def get_conversation_summary(self):
+    def get_conversation_summary(self, session_id="default"):
         """Get summary of current conversation"""
-        if not self.conversation_history:
+        history = self.sessions.get_history(session_id)
+        if not history:
             return "No conversation history"
         
-        return f"{len(self.conversation_history)} exchanges in current conversation"
+        return f"{len(history)} exchanges in current conversation"
     
     # Keep all existing methods from your original rag_system.py
-    def ingest_documents(self, directory_path):
-        """Complete document ingestion pipeline"""
+    def ingest_documents(self, directory_path, on_progress=None, cancel=None, paths=None):
+        """Incremental document ingestion pipeline
+        
+        Only files whose content changed since the last run (per the ingest
+        manifest) are extracted, embedded and upserted. Chunks belonging to
+        files that were removed, or that now produce fewer chunks, are deleted.
+        With `paths` (files or subdirectories of directory_path, e.g. from a
+        file watcher) only those are checked instead of the whole directory.
+        on_progress(**counts) receives files_total once the directory is
+        scanned, then the pipeline's running counts; setting the `cancel`
+        event stops after the files already embedded are stored.
+        """
         if not os.path.exists(directory_path):
             print(f"Directory {directory_path} not found!")
             return False
         
-        print("Step 1: Processing documents...")
-        chunks = self.doc_processor.process_directory(directory_path)
+        print("Step 1: Checking for changed documents...")
+        self.vector_store.sync_lexical_index()
+        changed_files, removed_files, unchanged = self._plan_ingest(directory_path, paths)
+        if on_progress:
+            on_progress(files_total=len(changed_files))
+        if cancel is not None and cancel.is_set():
+            print("Ingestion cancelled")
+            return False
         
-        if not chunks:
-            print("No documents found or processed successfully.")
+        if not changed_files and not removed_files and not unchanged:
+            print("No documents found or processed successfully." if paths is None else "No document changes.")
             return False
         
-        print(f"Found {len(chunks)} document chunks")
+        print(f"{len(changed_files)} changed, {len(removed_files)} removed, {unchanged} unchanged files")
+        
+        retired_ids = []
+        for file_path in removed_files:
+            entry = self.manifest.remove(file_path)
+            self.vector_store.delete_documents(ids=entry['chunk_ids'])
+            retired_ids.extend(entry['chunk_ids'])
+        # Changed files' old chunks stay searchable until replaced, but new
+        # chunks must not be matched against them as duplicates
+        for file_path, _, _ in changed_files:
+            entry = self.manifest.get(file_path)
+            if entry is not None:
+                retired_ids.extend(entry['chunk_ids'])
+        self._retire_chunks(retired_ids)
         
-        print("Step 2: Generating embeddings...")
-        texts = [chunk['text'] for chunk in chunks]
-        embeddings = self.embedding_service.get_embeddings_batch(texts)
+        if changed_files:
+            print("Step 2: Extracting, embedding and storing changed documents...")
+            file_state = {file_path: (stat, content_hash) for file_path, stat, content_hash in changed_files}
+            
+            # Chunks ingested before the manifest existed used other ids
+            if self.manifest.is_new and self.vector_store.get_stats()['total_documents'] > 0:
+                for file_path in file_state:
+                    self.vector_store.delete_documents(where={'file_path': file_path})
+            
+            def on_file_done(file_path, chunk_ids):
+                entry = self.manifest.get(file_path)
+                if entry is not None:
+                    stale_ids = set(entry['chunk_ids']) - set(chunk_ids)
+                    if self.chunk_dedup is not None:
+                        # Chunks now linked to a copy elsewhere drop their old vectors
+                        stale_ids |= self.chunk_dedup.linked(chunk_ids) & set(entry['chunk_ids'])
+                    self.vector_store.delete_documents(ids=sorted(stale_ids))
+                stat, content_hash = file_state[file_path]
+                self.manifest.update(file_path, stat, content_hash, chunk_ids)
+            
+            files = ((file_path, os.path.relpath(file_path, directory_path)) for file_path in file_state)
+            try:
+                stats = self._make_pipeline().run(
+                    files,
+                    on_file_done=on_file_done,
+                    on_progress=(lambda counts: on_progress(**counts)) if on_progress else None,
+                    cancel=cancel
+                )
+            except BrokenProcessPool:
+                # A worker died; start fresh workers next time
+                self._ingest_pool = None
+                raise
+            finally:
+                # Keep progress for completed files even if the run was interrupted
+                self._save_ingest_state()
+            print(f"Stored {stats['chunks']} chunks from {stats['files']} files")
+            if stats['duplicate_chunks']:
+                print(f"Linked {stats['duplicate_chunks']} near-duplicate chunks instead of embedding them")
+            if stats['cancelled']:
+                print("Ingestion cancelled; remaining files will be picked up by the next run")
+                return False
         
-        print("Step 3: Storing in vector database...")
-        self.vector_store.add_documents(chunks, embeddings)
+        self._save_ingest_state()
         
-        print(f"Ingestion complete! Added {len(chunks)} chunks to the database.")
+        print(f"Ingestion complete! {len(changed_files)} files updated, {len(removed_files)} removed.")
         return True
     
+    def _save_ingest_state(self):
+        self.manifest.save()
+        if self.chunk_dedup is not None:
+            # Kept chunks whose write never landed (a cancelled or failed run)
+            # are unregistered before committing, so later copies can't be
+            # linked to a chunk that isn't stored
+            self._store_promoted(self.chunk_dedup.rollback())
+            self.chunk_dedup.flush()
+        self.vector_store.flush()
+    
+    def _retire_chunks(self, chunk_ids):
+        """Drop chunks from the dedup index, storing duplicates promoted in their place"""
+        if self.chunk_dedup is None or not chunk_ids:
+            return
+        self._store_promoted(self.chunk_dedup.remove(chunk_ids))
+    
+    def _store_promoted(self, promoted):
+        """Embed and store duplicates promoted to replace kept chunks"""
+        if not promoted:
+            return
+        print(f"Embedding {len(promoted)} duplicate chunks whose original was removed, changed or never stored")
+        embeddings = self.embedding_service.get_embeddings_batch([chunk['text'] for chunk in promoted])
+        self.vector_store.upsert_documents(promoted, embeddings)
+        self.chunk_dedup.stored([chunk['chunk_id'] for chunk in promoted])
+    
+    def ingest_async(self, directory_path, paths=None):
+        """Queue ingest_documents on a background thread, returning a job id
+        
+        Jobs run one at a time on warm extraction workers; follow them with
+        job_status and stop them with cancel_job. `paths` limits the job to
+        those files/subdirectories (see ingest_documents); paths for a
+        directory that already has a job waiting are merged into it.
+        """
+        job = self.ingest_jobs.submit(directory_path, paths)
+        print(f"Queued ingest job {job.job_id} for {job.directory}")
+        return job.job_id
+    
+    def watch(self, directory_path, debounce=1.0, max_delay=10.0):
+        """Keep a directory indexed as files are added, edited, moved or deleted
+        
+        Catches up with one incremental ingest, then ingests changed paths
+        in debounced batches as background jobs (see DocumentWatcher).
+        Returns the running watcher; stop() it to stop watching.
+        """
+        directory_path = os.path.abspath(directory_path)
+        if directory_path in self.watchers:
+            return self.watchers[directory_path]
+        watcher = DocumentWatcher(
+            directory_path,
+            lambda paths: self.ingest_async(directory_path, paths),
+            is_supported=self.doc_processor.is_supported,
+            debounce=debounce,
+            max_delay=max_delay
+        )
+        watcher.start()
+        self.watchers[directory_path] = watcher
+        self.ingest_async(directory_path)
+        return watcher
+    
+    def stop_watching(self, directory_path=None):
+        """Stop the watcher for a directory, or all of them"""
+        if directory_path is None:
+            directories = list(self.watchers)
+        else:
+            directories = [os.path.abspath(directory_path)]
+        for directory in directories:
+            watcher = self.watchers.pop(directory, None)
+            if watcher is not None:
+                watcher.stop()
+    
+    def job_status(self, job_id=None):
+        """Status and progress of one ingest job (None if unknown), or of all jobs
+        
+        Each status has the job's state (queued, running, completed, failed,
+        cancelled), files_total/files/failed_files/chunks/embedded counts and
+        files, chunks and embeddings per second.
+        """
+        if job_id is None:
+            return [job.to_dict() for job in self.ingest_jobs.jobs()]
+        job = self.ingest_jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+    
+    def cancel_job(self, job_id):
+        """Cancel a queued or running ingest job; False if it already finished"""
+        return self.ingest_jobs.cancel(job_id)
+    
+    def _run_ingest_job(self, job):
+        if not os.path.isdir(job.directory):
+            raise ValueError(f"Directory {job.directory} not found")
+        completed = self.ingest_documents(job.directory, on_progress=job.update, cancel=job.cancel_event,
+                                          paths=job.paths)
+        if not completed and job.cancel_event.is_set():
+            raise IngestCancelled()
+    
+    def _ingest_executor(self):
+        """Warm extraction process pool shared by ingest runs (None with ingest_workers=0)"""
+        workers = (os.cpu_count() or 1) if self.ingest_workers is None else self.ingest_workers
+        if workers == 0:
+            return None
+        with self._init_lock:
+            if self._ingest_pool is None or self._ingest_pool_size != workers:
+                if self._ingest_pool is not None:
+                    self._ingest_pool.shutdown(wait=False, cancel_futures=True)
+                self._ingest_pool = start_pool(workers, self.doc_processor)
+                self._ingest_pool_size = workers
+            return self._ingest_pool
+    
+    def _make_pipeline(self):
+        """Streaming ingestion pipeline bound to this system's services"""
+        service = self.embedding_service
+        if service.provider == "openai":
+            # One pipeline batch per API request, packed by tokens; the
+            # dispatcher's max_in_flight is the only concurrency limit
+            batching = {
+                'embed_batch_size': MAX_INPUTS_PER_REQUEST,
+                'embed_batch_tokens': service.dispatcher.max_batch_tokens,
+                'embed_concurrency': service.dispatcher.max_in_flight
+            }
+        else:
+            # A local model is already parallel internally
+            batching = {'embed_batch_size': self.embed_batch_size, 'embed_concurrency': 1}
+        return IngestionPipeline(
+            service,
+            self.vector_store,
+            max_workers=self.ingest_workers,
+            processor=self.doc_processor,
+            pdf_pages_per_task=self.pdf_pages_per_task,
+            deduplicator=self.chunk_dedup,
+            pool=self._ingest_executor(),
+            **batching
+        )
+    
+    def _plan_ingest(self, directory_path, paths=None):
+        """Compare a directory (or just `paths` inside it) against the ingest manifest
+        
+        Returns (changed_files, removed_files, unchanged_count) where
+        changed_files is a list of (file_path, stat, content_hash).
+        """
+        self.manifest.refresh()
+        if paths is None:
+            candidates = self.doc_processor.iter_files(directory_path)
+            known = self.manifest.files_under(directory_path)
+        else:
+            candidates, known = self._paths_to_check(directory_path, paths)
+        
+        changed_files = []
+        seen = set()
+        unchanged = 0
+        
+        for file_path in candidates:
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                # Deleted since it was listed
+                continue
+            seen.add(os.path.abspath(file_path))
+            
+            if self.manifest.is_unchanged(file_path, stat):
+                unchanged += 1
+                continue
+            
+            content_hash = file_hash(file_path)
+            entry = self.manifest.get(file_path)
+            if entry is not None and entry['hash'] == content_hash:
+                # Touched but not edited: just refresh mtime/size
+                self.manifest.update(file_path, stat, content_hash, entry['chunk_ids'])
+                unchanged += 1
+                continue
+            
+            changed_files.append((file_path, stat, content_hash))
+        
+        removed_files = [path for path in known if path not in seen]
+        
+        return changed_files, removed_files, unchanged
+    
+    def _paths_to_check(self, directory_path, paths):
+        """Supported files at or under `paths`, and manifest files those paths cover
+        
+        Files are spelled the way iter_files(directory_path) would, so chunk
+        metadata matches a full ingest.
+        """
+        root = os.path.abspath(directory_path)
+        candidates = set()
+        known = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            if path != root and not path.startswith(os.path.join(root, '')):
+                continue
+            if os.path.isdir(path):
+                found = self.doc_processor.iter_files(path)
+            elif os.path.isfile(path) and self.doc_processor.is_supported(path):
+                found = [path]
+            else:
+                found = []
+            candidates.update(os.path.join(directory_path, os.path.relpath(file_path, root)) for file_path in found)
+            known.update(self.manifest.files_under(path))
+            if self.manifest.get(path) is not None:
+                known.add(path)
+        return sorted(candidates), sorted(known)
+    
     def test_claude_connection(self):
         """Test Claude API connection"""
         try:
@@ -149,8 +960,51 @@ class ConversationalRAGSystem:
     
     def get_system_stats(self):
         """Get system statistics"""
-        return self.vector_store.get_stats()
+        self.manifest.refresh()
+        if self._vector_store is None and not self.manifest.is_new:
+            # Answered from the ingest manifest so stats don't wait for the store to load
+            stats = {
+                'total_documents': self.manifest.total_chunks(),
+                'total_files': len(self.manifest.files),
+                'backend': self.vector_backend,
+                'loaded': False
+            }
+        else:
+            stats = self.vector_store.get_stats()
+        stats['answer_cache'] = self.answer_cache.stats()
+        if self.chunk_dedup is not None:
+            stats['dedup'] = self.chunk_dedup.stats()
+        return stats
+    
+    def get_metrics(self, format="summary"):
+        """Pipeline timings and counters: "summary" (dict), "text", "json" or "prometheus"
+        
+        Stages: extract, chunk, dedup, embed, upsert, embed_query, retrieve,
+        vector_search, lexical_search, rerank, generate and first_token.
+        """
+        if format == "prometheus":
+            return metrics.to_prometheus()
+        if format == "json":
+            return metrics.to_json()
+        if format == "text":
+            return metrics.summary_text()
+        return metrics.summary()
     
     def clear_database(self):
         """Clear all documents from the database"""
-        self.vector_store.clear_collection()
\ No newline at end of file
+        self.vector_store.clear_collection()
+        self.manifest.clear()
+        if self.chunk_dedup is not None:
+            self.chunk_dedup.clear()
+
+
+def _normalize_extension(extension):
+    extension = extension.lower()
+    return extension if extension.startswith('.') else f".{extension}"
+
+
+def _timestamp(value):
+    """Epoch seconds from a number or an ISO date/datetime string"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
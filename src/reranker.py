@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src.local_embeddings import pick_device
+
+
+class CrossEncoderReranker:
+    """Re-scores retrieved chunks against the question with a local cross-encoder
+
+    Candidates are scored in batches on a thread pool. If scoring doesn't
+    finish within `deadline` seconds (or the model is still loading), the
+    candidates keep their retrieval order, so reranking never adds more
+    than the deadline to a query.
+    """
+    
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=16, max_workers=4,
+                 deadline=0.5, device=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.deadline = deadline
+        self.device = device or os.getenv("RERANK_DEVICE")
+        self._model = None
+        self._loading = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.stats = {'reranked': 0, 'fallbacks': 0}
+    
+    def warm_up(self):
+        """Load the model now (blocking)"""
+        self._start_loading().result()
+    
+    def _start_loading(self):
+        with self._lock:
+            if self._loading is None:
+                self._loading = self._pool.submit(self._load)
+            return self._loading
+    
+    def _load(self):
+        from sentence_transformers import CrossEncoder
+        if self.device is None:
+            self.device = pick_device()
+        print(f"Loading reranker model on {self.device}...")
+        self._model = CrossEncoder(self.model_name, device=self.device)
+    
+    def rerank(self, question, results, n_results, deadline=None):
+        """Best n_results of `results` by cross-encoder score
+
+        Adds 'rerank_scores' when reranked; otherwise returns the first
+        n_results in their original order.
+        """
+        count = len(results['ids'])
+        deadline = self.deadline if deadline is None else deadline
+        if count <= 1:
+            return _select(results, list(range(count)))
+        
+        loading = self._start_loading()
+        if not loading.done():
+            # The first queries don't wait for the model to load
+            return self._fallback(results, n_results, "model still loading")
+        if loading.exception() is not None:
+            return self._fallback(results, n_results, f"model failed to load: {loading.exception()}")
+        
+        start = time.perf_counter()
+        documents = results['documents']
+        futures = [
+            self._pool.submit(self._score, question, documents[i:i + self.batch_size])
+            for i in range(0, count, self.batch_size)
+        ]
+        done, pending = wait(futures, timeout=deadline)
+        if pending:
+            for future in pending:
+                future.cancel()
+            return self._fallback(results, n_results, f"deadline of {deadline * 1000:.0f} ms exceeded")
+        
+        scores = [score for future in futures for score in future.result()]
+        order = sorted(range(count), key=lambda i: scores[i], reverse=True)[:n_results]
+        reranked = _select(results, order)
+        reranked['rerank_scores'] = [scores[i] for i in order]
+        self.stats['reranked'] += 1
+        print(f"Reranked {count} candidates in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return reranked
+    
+    def _score(self, question, documents):
+        scores = self._model.predict([(question, document) for document in documents],
+                                     batch_size=len(documents), show_progress_bar=False)
+        return [float(score) for score in scores]
+    
+    def _fallback(self, results, n_results, reason):
+        self.stats['fallbacks'] += 1
+        print(f"Rerank skipped ({reason}); using retrieval order")
+        return _select(results, list(range(min(n_results, len(results['ids'])))))
+
+
+def _select(results, order):
+    """Results reduced to the rows in `order`, in that order"""
+    count = len(results['ids'])
+    return {
+        key: [value[i] for i in order] if isinstance(value, list) and len(value) == count else value
+        for key, value in results.items()
+    }
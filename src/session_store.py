@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class SessionStore:
+    """Conversation histories keyed by session id
+
+    Sessions live in a bounded in-memory LRU and expire after `ttl_seconds`
+    of inactivity. With `db_path` set, histories are also written through to
+    SQLite so they survive eviction and restarts.
+
+    Reads and appends are atomic. Callers that need a whole
+    read-history -> generate -> append sequence to be exclusive per session
+    take `lock(session_id)` (threads) or `async_lock(session_id)` (asyncio);
+    different sessions never wait on each other.
+    """
+    
+    def __init__(self, max_sessions=1000, ttl_seconds=24 * 3600, max_history_length=10, db_path=None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_history_length = max_history_length
+        self.db_path = db_path
+        
+        self._sessions = OrderedDict()  # session_id -> (history, last_access)
+        self._locks = {}
+        self._async_locks = {}
+        self._lock = threading.Lock()
+        
+        self._conn = None
+        self._saves = 0
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " history TEXT NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.commit()
+    
+    def get_history(self, session_id):
+        """Copy of a session's history (oldest exchange first)"""
+        with self._lock:
+            return list(self._load(session_id))
+    
+    def append(self, session_id, question, response):
+        """Record an exchange, returning the session's new history length"""
+        exchange = {
+            'timestamp': datetime.now().isoformat(),
+            'question': question,
+            'response': response
+        }
+        
+        with self._lock:
+            history = self._load(session_id)
+            history.append(exchange)
+            
+            # Keep history manageable
+            if len(history) > self.max_history_length:
+                del history[:-self.max_history_length]
+            
+            self._save(session_id, history)
+            return len(history)
+    
+    def clear(self, session_id):
+        """Forget a session's history"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+    
+    def lock(self, session_id):
+        """Per-session threading.Lock"""
+        with self._lock:
+            # Touch the session so it isn't evicted (dropping its lock) right away
+            self._load(session_id)
+            return self._locks.setdefault(session_id, threading.Lock())
+    
+    def async_lock(self, session_id):
+        """Per-session asyncio.Lock"""
+        with self._lock:
+            self._load(session_id)
+            return self._async_locks.setdefault(session_id, asyncio.Lock())
+    
+    def active_sessions(self):
+        """Number of sessions held in memory"""
+        with self._lock:
+            return len(self._sessions)
+    
+    def _load(self, session_id):
+        """Live history list for a session (caller holds self._lock)"""
+        now = time.time()
+        entry = self._sessions.get(session_id)
+        
+        if entry is not None and now - entry[1] > self.ttl_seconds:
+            self._forget(session_id)
+            entry = None
+        
+        if entry is None:
+            history = []
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT history, last_access FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row and now - row[1] <= self.ttl_seconds:
+                    history = json.loads(row[0])
+            entry = (history, now)
+        
+        self._sessions[session_id] = (entry[0], now)
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        return entry[0]
+    
+    def _save(self, session_id, history):
+        if self._conn is None:
+            return
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, history, last_access) VALUES (?, ?, ?)",
+            (session_id, json.dumps(history), now)
+        )
+        
+        # Purge expired sessions from disk every so often
+        self._saves += 1
+        if self._saves % 100 == 0:
+            self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl_seconds,))
+        self._conn.commit()
+    
+    def _evict(self):
+        # Drop expired sessions from the cold end, then enforce the LRU bound
+        now = time.time()
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            self._forget(session_id)
+    
+    def _forget(self, session_id):
+        self._sessions.pop(session_id, None)
+        # Only drop locks nobody is holding
+        lock = self._locks.get(session_id)
+        if lock is not None and not lock.locked():
+            del self._locks[session_id]
+        async_lock = self._async_locks.get(session_id)
+        if async_lock is not None and not async_lock.locked():
+            del self._async_locks[session_id]
@@ -0,0 +1,19 @@
+_tokenizer = None
+
+
+def estimate_tokens(text):
+    """Token count with tiktoken when installed, otherwise ~4 characters per token
+
+    tiktoken's cl100k_base is OpenAI's tokenizer; for Claude it is a close
+    enough estimate for budgeting.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _tokenizer = False
+    if _tokenizer:
+        return len(_tokenizer.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
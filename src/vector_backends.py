@@ -0,0 +1,230 @@
+import os
+
+import numpy as np
+
+
+class VectorBackend:
+    """Storage and nearest-neighbour search behind VectorStore
+
+    Backends store (id, embedding, document, metadata) records and return
+    results as dicts of parallel lists ('ids', 'documents', 'metadatas' and
+    'distances' or 'embeddings'). Distances are squared L2, Chroma's default.
+    `where` filters use Chroma's syntax.
+    """
+    
+    name = None
+    
+    def add(self, ids, embeddings, documents, metadatas):
+        raise NotImplementedError
+    
+    def upsert(self, ids, embeddings, documents, metadatas):
+        raise NotImplementedError
+    
+    def delete(self, ids=None, where=None):
+        raise NotImplementedError
+    
+    def resolve_ids(self, ids=None, where=None):
+        """Ids of stored records matching ids and/or a where filter"""
+        raise NotImplementedError
+    
+    def query(self, query_embedding, n_results, where=None, ids=None):
+        """Nearest records; with `where` and/or `ids`, only matching records are scored"""
+        raise NotImplementedError
+    
+    def query_batch(self, query_embeddings, n_results, where=None, ids=None):
+        """query() for several embeddings at once, one result dict per embedding"""
+        return [self.query(query_embedding, n_results, where, ids) for query_embedding in query_embeddings]
+    
+    def get(self, ids, include_embeddings=False):
+        raise NotImplementedError
+    
+    def page(self, offset, limit):
+        """A page of stored ids and documents, for rebuilding derived indexes"""
+        raise NotImplementedError
+    
+    def count(self):
+        raise NotImplementedError
+    
+    def clear(self):
+        raise NotImplementedError
+    
+    def flush(self):
+        """Persist any state the backend buffers in memory"""
+        pass
+    
+    def refresh(self):
+        """Catch up with writes made by another process (a no-op where every call reads storage)"""
+        pass
+    
+    def stats(self):
+        """Backend-specific index statistics"""
+        return {}
+
+
+class ChromaBackend(VectorBackend):
+    """ChromaDB persistent collection"""
+    
+    name = "chroma"
+    
+    def __init__(self, persist_directory, collection_name):
+        # Imported here: chromadb takes a noticeable time to import
+        import chromadb
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        
+        # Create or get collection
+        try:
+            self.collection = self.client.get_collection(self.collection_name)
+            print(f"Loaded existing collection: {self.collection_name}")
+        except:
+            self.collection = self.client.create_collection(self.collection_name)
+            print(f"Created new collection: {self.collection_name}")
+    
+    def add(self, ids, embeddings, documents, metadatas):
+        self.collection.add(embeddings=_matrix(embeddings), documents=documents, metadatas=metadatas, ids=ids)
+    
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(embeddings=_matrix(embeddings), documents=documents, metadatas=metadatas, ids=ids)
+    
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids or None, where=where)
+    
+    def resolve_ids(self, ids=None, where=None):
+        if not where:
+            return list(ids or [])
+        return self.collection.get(ids=ids or None, where=where, include=[])['ids']
+    
+    def refresh(self):
+        # A client keeps the vector index it loaded and never sees another
+        # process's writes, so open a new one. Chroma shares one system per
+        # path; dropping it from that cache (without stopping it) lets
+        # queries already running on the old client finish.
+        import chromadb
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient._identifier_to_system.pop(getattr(self.client, '_identifier', None), None)
+        client = chromadb.PersistentClient(path=self.persist_directory)
+        self.collection = client.get_collection(self.collection_name)
+        self.client = client
+    
+    def query(self, query_embedding, n_results, where=None, ids=None):
+        return self.query_batch([query_embedding], n_results, where, ids)[0]
+    
+    def query_batch(self, query_embeddings, n_results, where=None, ids=None):
+        if not len(query_embeddings):
+            return []
+        # Chroma applies the filter before the vector search
+        results = self.collection.query(
+            query_embeddings=_matrix(query_embeddings),
+            n_results=n_results,
+            where=where or None,
+            ids=ids or None
+        )
+        
+        return [
+            {
+                'ids': results['ids'][i],
+                'documents': results['documents'][i],
+                'metadatas': results['metadatas'][i],
+                'distances': results['distances'][i]
+            }
+            for i in range(len(query_embeddings))
+        ]
+    
+    def get(self, ids, include_embeddings=False):
+        include = ['documents', 'metadatas'] + (['embeddings'] if include_embeddings else [])
+        results = self.collection.get(ids=ids, include=include)
+        fetched = {
+            'ids': results['ids'],
+            'documents': results['documents'],
+            'metadatas': results['metadatas']
+        }
+        if include_embeddings:
+            fetched['embeddings'] = results['embeddings']
+        return fetched
+    
+    def page(self, offset, limit):
+        results = self.collection.get(offset=offset, limit=limit, include=['documents'])
+        return {'ids': results['ids'], 'documents': results['documents']}
+    
+    def count(self):
+        return self.collection.count()
+    
+    def clear(self):
+        self.client.delete_collection(self.collection_name)
+        self.collection = self.client.create_collection(self.collection_name)
+
+
+def _matrix(embeddings):
+    """Embeddings (arrays or lists) as one float32 matrix; chromadb takes NumPy directly"""
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+_SQL_COMPARISONS = {'$eq': '=', '$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+
+def where_to_sql(where, column="metadata"):
+    """Translate a where filter into an SQLite condition over a JSON column
+
+    Returns (sql, params) matching Chroma's semantics for the same filter.
+    """
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ('$and', '$or'):
+            parts = [where_to_sql(clause, column) for clause in condition]
+            joiner = ' AND ' if key == '$and' else ' OR '
+            clauses.append('(' + (joiner.join(sql for sql, _ in parts) or ('1' if key == '$and' else '0')) + ')')
+            for _, part_params in parts:
+                params.extend(part_params)
+            continue
+        
+        field = f"json_extract({column}, ?)"
+        if '"' in key:
+            raise ValueError(f"Unsupported metadata key in where filter: {key}")
+        path = f'$."{key}"'
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, operand in condition.items():
+            if op in _SQL_COMPARISONS:
+                clauses.append(f"{field} {_SQL_COMPARISONS[op]} ?")
+                params.extend([path, operand])
+            elif op == '$ne':
+                clauses.append(f"{field} IS NOT ?")
+                params.extend([path, operand])
+            elif not operand and op in ('$in', '$nin'):
+                clauses.append("0" if op == '$in' else "1")
+            elif op == '$in':
+                clauses.append(f"{field} IN ({','.join('?' * len(operand))})")
+                params.extend([path, *operand])
+            elif op == '$nin':
+                clauses.append(f"({field} IS NULL OR {field} NOT IN ({','.join('?' * len(operand))}))")
+                params.extend([path, path, *operand])
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+    return ' AND '.join(clauses) or '1', params
+
+
+def make_backend(name, persist_directory, collection_name, **options):
+    """Build a backend by name ("chroma" or "ann")
+
+    Extra options go to the backend constructor (e.g. quantization="int8"
+    for "ann"). Returns (backend, data_directory); data_directory is where
+    state derived from that backend's contents (lexical index, ingest
+    manifest) belongs.
+    """
+    data_directory = backend_data_directory(name, persist_directory)
+    if name == "chroma":
+        if options:
+            raise ValueError(f"The chroma backend takes no options (got {sorted(options)})")
+        return ChromaBackend(persist_directory, collection_name), data_directory
+    from src.ann_backend import ANNBackend
+    return ANNBackend(data_directory, **options), data_directory
+
+
+def backend_data_directory(name, persist_directory):
+    """Directory holding a backend's derived state, known without opening the backend"""
+    if name == "chroma":
+        return persist_directory
+    if name == "ann":
+        return os.path.join(persist_directory, "ann_index")
+    raise ValueError(f"Unknown vector backend: {name}")
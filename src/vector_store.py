@@ -1,59 +1,305 @@
-import chromadb
-from chromadb.config import Settings
+import json
+import os
+import threading
 import uuid
+import numpy as np
+
+from src.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from src.metrics import metrics
+from src.vector_backends import make_backend
 
 class VectorStore:
-    def __init__(self, persist_directory="./chroma_db"):
-        self.client = chromadb.PersistentClient(path=persist_directory)
+    def __init__(self, persist_directory="./chroma_db", backend="chroma", backend_options=None):
+        self.persist_directory = persist_directory
         self.collection_name = "claude_document_collection"
         
-        # Create or get collection
+        # "chroma" (ChromaDB collection) or "ann" (in-process memory-mapped index)
+        self.backend, self.data_directory = make_backend(
+            backend, persist_directory, self.collection_name, **(backend_options or {})
+        )
+        
+        # BM25 index over the same chunk ids, kept in step with the collection.
+        # Its in-memory postings are merged to disk once there are this many.
+        self.lexical_index = LexicalIndex(os.path.join(self.data_directory, "lexical_index"))
+        self.lexical_merge_postings = 500000
+        
+        # Collection generation, replaced on every write so caches can tell the
+        # collection changed; kept on disk so every process sharing the store sees it
+        self._generation_path = os.path.join(self.data_directory, "collection_generation")
+        
+        # Near-duplicate index (a ChunkDeduplicator) when chunks are deduplicated:
+        # filters then also match stored chunks through their linked duplicates
+        self.deduplicator = None
+        
+        # where filter -> matching chunk ids for BM25, valid for one generation;
+        # read and filled from the lexical thread pool, hence the lock
+        self._filter_ids_cache = {}
+        self._filter_ids_version = None
+        self._filter_ids_lock = threading.Lock()
+        
+        # Generation the backend was last brought up to date with (see refresh)
+        self._seen_version = self.version
+        
+        self.sync_lexical_index()
+    
+    @property
+    def version(self):
+        """Current collection generation (None before the first write)"""
         try:
-            self.collection = self.client.get_collection(self.collection_name)
-            print(f"Loaded existing collection: {self.collection_name}")
-        except:
-            self.collection = self.client.create_collection(self.collection_name)
-            print(f"Created new collection: {self.collection_name}")
+            with open(self._generation_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def _bump_version(self):
+        # A random token rather than a counter, so two processes writing at
+        # once can't both land on the same value
+        version = uuid.uuid4().hex
+        tmp_path = f"{self._generation_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(tmp_path, self._generation_path)
+        # Writes refresh first, so this process already holds this generation
+        # (with the one writer per store the watch daemon assumes)
+        self._seen_version = version
+    
+    def refresh(self):
+        """Catch up with writes made by another process sharing the store, such as the watch daemon
+        
+        The backend reloads what changed when the collection generation
+        moves. The lexical index checks for a new segment every time, since
+        a writer flushes its postings after the write that moved it.
+        """
+        version = self.version
+        if version != self._seen_version:
+            self._seen_version = version
+            self.backend.refresh()
+        self.lexical_index.refresh()
     
     def add_documents(self, chunks, embeddings):
         """Add document chunks with embeddings to vector store"""
+        self.refresh()
         ids = [chunk['chunk_id'] for chunk in chunks]
         documents = [chunk['text'] for chunk in chunks]
-        metadatas = [{'source': chunk['source'], 'file_path': chunk['file_path']} 
-                    for chunk in chunks]
-        
-        self.collection.add(
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
+        metadatas = [self._chunk_metadata(chunk) for chunk in chunks]
+        
+        with metrics.span('upsert'):
+            self.backend.add(ids, embeddings, documents, metadatas)
+            self.lexical_index.add(ids, documents)
+        self._bump_version()
         print(f"Added {len(chunks)} chunks to vector store")
     
-    def query(self, query_text, embedding_service, n_results=5):
+    def upsert_documents(self, chunks, embeddings):
+        """Insert or overwrite document chunks by chunk id"""
+        if not chunks:
+            return
+        self.refresh()
+        
+        ids = [chunk['chunk_id'] for chunk in chunks]
+        documents = [chunk['text'] for chunk in chunks]
+        metadatas = [self._chunk_metadata(chunk) for chunk in chunks]
+        
+        with metrics.span('upsert'):
+            self.backend.upsert(ids, embeddings, documents, metadatas)
+            self.lexical_index.add(ids, documents)
+        self._bump_version()
+        print(f"Upserted {len(chunks)} chunks to vector store")
+    
+    def _chunk_metadata(self, chunk):
+        """Metadata stored alongside a chunk"""
+        metadata = {'source': chunk['source'], 'file_path': chunk['file_path']}
+        # Character offsets, file attributes and PDF page of the chunk, when known
+        for key in ('start_char', 'end_char', 'extension', 'directory', 'mtime', 'page'):
+            if key in chunk:
+                metadata[key] = chunk[key]
+        return metadata
+    
+    def delete_documents(self, ids=None, where=None):
+        """Delete chunks by id and/or metadata filter"""
+        if not ids and not where:
+            return
+        self.refresh()
+        
+        # Resolve the filter so the lexical index drops the same chunks
+        self.lexical_index.delete(self.backend.resolve_ids(ids, where) if where else ids)
+        
+        self.backend.delete(ids=ids, where=where)
+        self._bump_version()
+        if ids:
+            print(f"Deleted {len(ids)} chunks from vector store")
+    
+    def query(self, query_text, embedding_service, n_results=5, where=None):
         """Search for similar documents"""
         query_embedding = embedding_service.get_embedding(query_text)
+        return self.query_by_embedding(query_embedding, n_results, where)
+    
+    def query_by_embedding(self, query_embedding, n_results=5, where=None):
+        """Search for documents similar to an already-computed query embedding
         
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
+        `where` is a metadata filter applied inside the backend, so n_results
+        matching chunks come back even when most of the collection doesn't match.
+        """
+        return self.query_by_embeddings([query_embedding], n_results, where)[0]
+    
+    def query_batch(self, query_texts, embedding_service, n_results=5, where=None):
+        """Search for several questions, embedding them in one batched call"""
+        query_embeddings = embedding_service.get_embeddings_batch(list(query_texts))
+        return self.query_by_embeddings(query_embeddings, n_results, where)
+    
+    def query_by_embeddings(self, query_embeddings, n_results=5, where=None):
+        """query_by_embedding for many embeddings in one backend call, one result per embedding"""
+        self.refresh()
+        with metrics.span('vector_search'):
+            results = self.backend.query_batch(query_embeddings, n_results, where=where)
+            linked = self._linked_ids(where)
+            if linked:
+                # Chunks matched only through a duplicate are searched by id and merged in
+                extra = self.backend.query_batch(query_embeddings, n_results, ids=linked)
+                results = [_merge_results(first, second, n_results) for first, second in zip(results, extra)]
+            return results
+    
+    def lexical_query(self, query_text, n_results=5, where=None):
+        """BM25 search over chunk text, returning [(chunk_id, score)]"""
+        self.refresh()
+        with metrics.span('lexical_search'):
+            allowed_ids = self._filter_ids(where) if where else None
+            # Duplicate links change without a collection write, so they aren't cached
+            linked = self._linked_ids(where)
+            if linked:
+                allowed_ids = list(allowed_ids) + linked
+            return self.lexical_index.search(query_text, n_results, allowed_ids)
+    
+    def _linked_ids(self, where):
+        """Stored chunks whose linked near-duplicates match a where filter"""
+        if self.deduplicator is None or not where:
+            return []
+        return self.deduplicator.canonical_ids(where)
+    
+    def _filter_ids(self, where):
+        """Chunk ids matching a where filter (cached until the collection generation changes)"""
+        version = self.version
+        key = json.dumps(where, sort_keys=True)
+        with self._filter_ids_lock:
+            if version != self._filter_ids_version:
+                self._filter_ids_cache = {}
+                self._filter_ids_version = version
+            ids = self._filter_ids_cache.get(key)
+        if ids is None:
+            # Resolved outside the lock so one slow filter doesn't serialize the others
+            ids = self.backend.resolve_ids(where=where)
+            with self._filter_ids_lock:
+                if version == self._filter_ids_version:
+                    if len(self._filter_ids_cache) >= 64:
+                        self._filter_ids_cache.pop(next(iter(self._filter_ids_cache)))
+                    self._filter_ids_cache[key] = ids
+        return ids
+    
+    def fuse_results(self, query_embedding, vector_results, lexical_hits, n_results=5, rrf_k=60):
+        """Merge dense and BM25 rankings with reciprocal-rank fusion
         
+        Returns the same shape as query_by_embedding, ordered by fused score,
+        plus 'rrf_scores'. Chunks found only by BM25 are fetched from the
+        collection and given their real vector distance.
+        """
+        fused = reciprocal_rank_fusion(
+            [vector_results['ids'], [chunk_id for chunk_id, _ in lexical_hits]], k=rrf_k
+        )[:n_results]
+        
+        found = {
+            chunk_id: (document, metadata, distance)
+            for chunk_id, document, metadata, distance in zip(
+                vector_results['ids'], vector_results['documents'],
+                vector_results['metadatas'], vector_results['distances']
+            )
+        }
+        
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in found]
+        if missing:
+            fetched = self.backend.get(missing, include_embeddings=True)
+            query = np.asarray(query_embedding, dtype=np.float32)
+            for chunk_id, document, metadata, embedding in zip(
+                fetched['ids'], fetched['documents'], fetched['metadatas'], fetched['embeddings']
+            ):
+                # Squared L2, the collection's distance metric
+                diff = np.asarray(embedding, dtype=np.float32) - query
+                found[chunk_id] = (document, metadata, float(np.dot(diff, diff)))
+        
+        # A chunk deleted since BM25 saw it won't come back from get()
+        fused = [(chunk_id, score) for chunk_id, score in fused if chunk_id in found]
         return {
-            'documents': results['documents'][0],
-            'metadatas': results['metadatas'][0],
-            'distances': results['distances'][0]
+            'ids': [chunk_id for chunk_id, _ in fused],
+            'documents': [found[chunk_id][0] for chunk_id, _ in fused],
+            'metadatas': [found[chunk_id][1] for chunk_id, _ in fused],
+            'distances': [found[chunk_id][2] for chunk_id, _ in fused],
+            'rrf_scores': [score for _, score in fused]
         }
     
+    def sync_lexical_index(self):
+        """Rebuild the lexical index from the collection when their chunk counts differ
+        
+        They differ for a collection that was never indexed, or when a process
+        stopped after storing chunks but before their postings reached disk.
+        """
+        total = self.backend.count()
+        if self.lexical_index.count() == total:
+            return
+        
+        print(f"Rebuilding lexical index for {total} chunks...")
+        self.lexical_index.clear()
+        page_size = 1000
+        for offset in range(0, total, page_size):
+            page = self.backend.page(offset, page_size)
+            self.lexical_index.add(page['ids'], page['documents'])
+            self.lexical_index.flush(min_postings=self.lexical_merge_postings)
+        self.lexical_index.flush()
+    
+    def checkpoint(self):
+        """Merge the lexical index's in-memory postings to disk once there are lexical_merge_postings
+        
+        Called after every ingestion write batch, so memory stays bounded on
+        large ingests and little is left to rebuild if the process dies.
+        """
+        self.lexical_index.flush(min_postings=self.lexical_merge_postings)
+    
+    def flush(self):
+        """Persist pending lexical index and backend changes"""
+        self.lexical_index.flush()
+        self.backend.flush()
+    
     def get_stats(self):
         """Get collection statistics"""
+        self.refresh()
         return {
-            'total_documents': self.collection.count(),
-            'collection_name': self.collection_name
+            'total_documents': self.backend.count(),
+            'collection_name': self.collection_name,
+            'backend': self.backend.name,
+            **self.backend.stats()
         }
     
+    def quantization_report(self, k=10, n_queries=100):
+        """recall@k of the quantized index against exact search (ann backend only)"""
+        if not hasattr(self.backend, 'recall_report'):
+            raise ValueError(f"The {self.backend.name} backend does not support quantization")
+        return self.backend.recall_report(k=k, n_queries=n_queries)
+    
     def clear_collection(self):
         """Clear all documents from collection (useful for testing)"""
-        self.client.delete_collection(self.collection_name)
-        self.collection = self.client.create_collection(self.collection_name)
-        print("Cleared collection")
\ No newline at end of file
+        self.backend.clear()
+        self.lexical_index.clear()
+        self._bump_version()
+        print("Cleared collection")
+
+def _merge_results(first, second, n_results):
+    """The n_results closest records of two query results, each id once"""
+    merged = {}
+    for results in (first, second):
+        for i, chunk_id in enumerate(results['ids']):
+            if chunk_id not in merged:
+                merged[chunk_id] = (results['distances'][i], results['documents'][i], results['metadatas'][i])
+    best = sorted(merged.items(), key=lambda item: item[1][0])[:n_results]
+    return {
+        'ids': [chunk_id for chunk_id, _ in best],
+        'documents': [record[1] for _, record in best],
+        'metadatas': [record[2] for _, record in best],
+        'distances': [record[0] for _, record in best]
+    }
@@ -0,0 +1,37 @@
+import asyncio
+
+from benchmarks.fakes import FakeAnthropic, FakeAsyncAnthropic
+from src.llm_service import LLMService
+
+CHUNKS = {
+    'documents': ["Returns are accepted within thirty days of purchase."],
+    'metadatas': [{'source': 'policy.txt', 'file_path': '/docs/policy.txt'}],
+    'distances': [0.1]
+}
+
+
+def _service():
+    service = LLMService()
+    service.client = FakeAnthropic()
+    service.async_client = FakeAsyncAnthropic()
+    return service
+
+
+def test_fake_stream_end_to_end():
+    text = ''.join(_service().stream_conversational_response("What is the return window?", CHUNKS, []))
+    assert text.startswith("Synthetic answer")
+
+
+def test_fake_async_stream_end_to_end():
+    async def consume():
+        stream = _service().astream_conversational_response("What is the return window?", CHUNKS, [])
+        return ''.join([text async for text in stream])
+    
+    text = asyncio.run(consume())
+    assert text.startswith("Synthetic answer")
+    assert "Error" not in text
+
+
+def test_fake_async_create_end_to_end():
+    text = asyncio.run(_service().agenerate_conversational_response("What is the return window?", CHUNKS, []))
+    assert text.startswith("Synthetic answer")
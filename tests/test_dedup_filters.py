@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from benchmarks.fakes import FakeOpenAI
+from src.rag_system import ConversationalRAGSystem
+
+TEXT = ("Returns are accepted within thirty days of purchase when the item is unused and in its "
+        "original packaging. Refunds go back to the original payment method within five business "
+        "days. Store credit is offered for returns after thirty days. ")
+OTHER = ("The warehouse ships orders Monday through Friday. Express shipping arrives the next "
+         "business day and standard shipping within a week. ")
+
+
+@pytest.fixture(params=["ann", "chroma"])
+def rag(request, tmp_path, monkeypatch):
+    # The system keeps its state under ./chroma_db
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("docs/sub")
+    with open("docs/a.txt", "w", encoding="utf-8") as f:
+        f.write(TEXT * 3)
+    with open("docs/sub/a_copy.txt", "w", encoding="utf-8") as f:
+        f.write(TEXT * 3)
+    with open("docs/b.txt", "w", encoding="utf-8") as f:
+        f.write(OTHER * 3)
+    
+    rag = ConversationalRAGSystem(embedding_provider="openai", vector_backend=request.param, dedup=True)
+    rag.embedding_service.client = FakeOpenAI(dim=64)
+    rag.embedding_service.cache = None
+    rag.ingest_workers = 0
+    rag.ingest_documents("docs")
+    yield rag
+    if request.param == "chroma":
+        # Chroma caches clients by path, and every test's ./chroma_db is a new directory
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+
+
+def test_copy_is_linked_not_stored(rag):
+    assert rag.chunk_dedup.stats()['duplicate_chunks'] > 0
+    assert not rag.vector_store.backend.resolve_ids(where={'source': 'a_copy.txt'})
+
+
+@pytest.mark.parametrize("filters", [{'source': 'a_copy.txt'}, {'directory': 'docs/sub'}])
+def test_filters_match_linked_duplicates(rag, filters):
+    results = rag.retrieve("How long do refunds take?", n_results=3, filters=filters)['results']
+    assert results
+    for chunk in results:
+        assert chunk['source'] == 'a.txt'
+        assert 'a_copy.txt' in [duplicate['source'] for duplicate in chunk['duplicates']]
+
+
+def test_filters_still_exclude_other_documents(rag):
+    results = rag.retrieve("When do orders ship?", n_results=5, filters={'source': 'a_copy.txt'})['results']
+    assert all(chunk['source'] == 'a.txt' for chunk in results)
+    assert not rag.retrieve("When do orders ship?", filters={'source': 'missing.txt'})['results']
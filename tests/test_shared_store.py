@@ -0,0 +1,47 @@
+import numpy as np
+
+from src.vector_store import VectorStore
+
+
+def _chunks(name, count):
+    return [
+        {'chunk_id': f"{name}_{i}", 'text': f"{name} part{name} section {i}",
+         'source': f"{name}.txt", 'file_path': f"/docs/{name}.txt"}
+        for i in range(count)
+    ]
+
+
+def _embeddings(name, count):
+    return np.random.default_rng(sum(map(ord, name))).random((count, 8)).tolist()
+
+
+def test_reader_sees_another_writers_chunks(tmp_path):
+    writer = VectorStore(str(tmp_path), "ann")
+    reader = VectorStore(str(tmp_path), "ann")
+    
+    writer.add_documents(_chunks("alpha", 3), _embeddings("alpha", 3))
+    writer.flush()
+    
+    assert reader.get_stats()['total_documents'] == 3
+    assert reader.lexical_query("partalpha")
+    assert reader.query_by_embedding(_embeddings("alpha", 3)[1], 1)['ids'] == ["alpha_1"]
+    
+    writer.delete_documents(where={'source': 'alpha.txt'})
+    writer.flush()
+    assert reader.get_stats()['total_documents'] == 0
+    assert not reader.lexical_query("partalpha")
+
+
+def test_flush_keeps_postings_written_by_another_process(tmp_path):
+    writer = VectorStore(str(tmp_path), "ann")
+    reader = VectorStore(str(tmp_path), "ann")
+    
+    writer.add_documents(_chunks("alpha", 2), _embeddings("alpha", 2))
+    writer.flush()
+    # Indexed on top of a segment this index never loaded
+    reader.lexical_index.add(["beta_0"], ["partbeta"])
+    reader.lexical_index.flush()
+    
+    writer.lexical_index.refresh()
+    assert writer.lexical_query("partalpha")
+    assert writer.lexical_query("partbeta")
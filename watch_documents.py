@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Keep a documents directory indexed: new, edited, moved and deleted files are
+ingested within seconds. Run it as the only process writing to the store."""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from src.rag_system import ConversationalRAGSystem
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a documents directory and keep the index up to date")
+    parser.add_argument("directory", nargs="?", default="./documents", help="Directory to watch")
+    parser.add_argument("--embedding-provider", default="openai", choices=["openai", "local"])
+    parser.add_argument("--debounce", type=float, default=1.0,
+                        help="Seconds without further changes before a batch is ingested")
+    parser.add_argument("--max-delay", type=float, default=10.0,
+                        help="Longest a change waits while files keep changing")
+    args = parser.parse_args()
+    
+    if not os.path.isdir(args.directory):
+        sys.exit(f"Directory {args.directory} not found")
+    
+    rag = ConversationalRAGSystem(embedding_provider=args.embedding_provider)
+    rag.watch(args.directory, debounce=args.debounce, max_delay=args.max_delay)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping...")
+        rag.stop_watching()
+        # Let the running job store what it has embedded and save the manifest
+        for job in rag.ingest_jobs.active():
+            rag.cancel_job(job.job_id)
+        while rag.ingest_jobs.active():
+            time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    main()